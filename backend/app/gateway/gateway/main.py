@@ -1,45 +1,131 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 import os
 import httpx
 from shared.logger import get_logger, setup_observability
 from shared.config import settings
 
 
-app = FastAPI(title="Gateway")
-setup_observability("gateway", app)
 logger = get_logger(__name__)
 
 CHAT_SERVICE_URL = os.getenv("CHAT_SERVICE_URL", "http://chat-service:8003").rstrip("/")
 USER_SERVICE_URL = os.getenv("USER_SERVICE_URL", "http://user-service:8001").rstrip("/")
 AI_SERVICE_URL = os.getenv("AI_SERVICE_URL", "http://ai-service:8004").rstrip("/")
 
+# Upstream connection pool tuning
+PROXY_TIMEOUT = float(os.getenv("GATEWAY_PROXY_TIMEOUT", "30"))
+PROXY_HTTP2 = os.getenv("GATEWAY_HTTP2", "").lower() in ("1", "true", "yes")
+PROXY_MAX_CONNECTIONS = int(os.getenv("GATEWAY_MAX_CONNECTIONS", "100"))
+PROXY_MAX_KEEPALIVE = int(os.getenv("GATEWAY_MAX_KEEPALIVE_CONNECTIONS", "20"))
+PROXY_KEEPALIVE_EXPIRY = float(os.getenv("GATEWAY_KEEPALIVE_EXPIRY", "30"))
+
+# Connection-scoped headers must not be forwarded over a pooled connection
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+}
+# The relayed body is re-framed and already decoded by httpx
+RESPONSE_SKIP_HEADERS = HOP_BY_HOP_HEADERS | {"content-length", "content-encoding"}
+
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def _new_client() -> httpx.AsyncClient:
+    http2 = PROXY_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except Exception:
+            logger.warning("GATEWAY_HTTP2 requested but h2 is not installed; using HTTP/1.1")
+            http2 = False
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(PROXY_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=PROXY_MAX_CONNECTIONS,
+            max_keepalive_connections=PROXY_MAX_KEEPALIVE,
+            keepalive_expiry=PROXY_KEEPALIVE_EXPIRY,
+        ),
+        http2=http2,
+    )
+
+
+def _client_for(upstream: str) -> httpx.AsyncClient:
+    # One long-lived client per upstream; created lazily if the lifespan
+    # did not run (e.g. when the app is mounted without startup events).
+    client = _clients.get(upstream)
+    if client is None or client.is_closed:
+        client = _clients[upstream] = _new_client()
+    return client
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for upstream in (CHAT_SERVICE_URL, USER_SERVICE_URL, AI_SERVICE_URL):
+        _client_for(upstream)
+    try:
+        yield
+    finally:
+        for client in list(_clients.values()):
+            await client.aclose()
+        _clients.clear()
+
+
+app = FastAPI(title="Gateway", lifespan=lifespan)
+setup_observability("gateway", app)
+
 
-async def proxy_request(target_base: str, path: str, request: Request) -> Response:
+async def proxy_request(upstream: str, target_base: str, path: str, request: Request) -> Response:
     url = f"{target_base}/{path}" if path else target_base
-    headers = dict(request.headers)
-    body = await request.body()
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
     method = request.method
     params = dict(request.query_params)
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        resp = await client.request(method, url, params=params, headers=headers, content=body)
-
-    # Preserve content-type if available
-    media_type = resp.headers.get("content-type")
-    return Response(content=resp.content, status_code=resp.status_code, media_type=media_type)
+    # Only forward a body when the caller sent one, so bodiless requests are
+    # not turned into chunked uploads.
+    has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+    content = request.stream() if has_body else None
+
+    client = _client_for(upstream)
+    # Stream the request body through (uploads are never held in memory)
+    # and relay the response chunk by chunk so streamed answers reach the
+    # browser as they are generated.
+    upstream_resp = await client.send(
+        client.build_request(method, url, params=params, headers=headers, content=content),
+        stream=True,
+    )
+
+    response = StreamingResponse(
+        upstream_resp.aiter_bytes(),
+        status_code=upstream_resp.status_code,
+        background=BackgroundTask(upstream_resp.aclose),
+    )
+    # Relay the upstream headers (content-type, Retry-After, every Set-Cookie)
+    response.raw_headers.extend(
+        (k.lower(), v) for k, v in upstream_resp.headers.raw if k.decode("latin-1").lower() not in RESPONSE_SKIP_HEADERS
+    )
+    return response
 
 
 @app.api_route("/auth/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
 async def proxy_auth(path: str, request: Request):
     logger.info(f"Proxying to user_service/auth: {path}")
-    return await proxy_request(f"{USER_SERVICE_URL}/auth", path, request)
+    return await proxy_request(USER_SERVICE_URL, f"{USER_SERVICE_URL}/auth", path, request)
 
 
 @app.api_route("/users/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
 async def proxy_users(path: str, request: Request):
     logger.info(f"Proxying to user_service: {path}")
-    return await proxy_request(USER_SERVICE_URL, path, request)
+    return await proxy_request(USER_SERVICE_URL, USER_SERVICE_URL, path, request)
 
 
 @app.get("/ping")
@@ -50,37 +136,37 @@ async def ping():
 @app.api_route("/chat/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
 async def proxy_chat(path: str, request: Request):
     logger.info(f"Proxying to chat_service: {path}")
-    return await proxy_request(f"{CHAT_SERVICE_URL}/api/v1/chat", path, request)
+    return await proxy_request(CHAT_SERVICE_URL, f"{CHAT_SERVICE_URL}/api/v1/chat", path, request)
 
 
 @app.api_route("/api/v1/chat/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
 async def proxy_chat_api(path: str, request: Request):
     logger.info(f"Proxying to chat_service /api/v1/chat: {path}")
-    return await proxy_request(f"{CHAT_SERVICE_URL}/api/v1/chat", path, request)
+    return await proxy_request(CHAT_SERVICE_URL, f"{CHAT_SERVICE_URL}/api/v1/chat", path, request)
 
 
 @app.api_route("/api/v1/graph/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
 async def proxy_graph(path: str, request: Request):
     logger.info(f"Proxying to chat_service /api/v1/graph: {path}")
-    return await proxy_request(f"{CHAT_SERVICE_URL}/api/v1/graph", path, request)
+    return await proxy_request(CHAT_SERVICE_URL, f"{CHAT_SERVICE_URL}/api/v1/graph", path, request)
 
 
 @app.api_route("/api/v1/voice", methods=["POST"])  # file upload
 async def proxy_voice(request: Request):
     logger.info("Proxying to chat_service /api/v1/voice")
-    return await proxy_request(f"{CHAT_SERVICE_URL}/api/v1/voice", "", request)
+    return await proxy_request(CHAT_SERVICE_URL, f"{CHAT_SERVICE_URL}/api/v1/voice", "", request)
 
 
 @app.api_route("/api/v1/ocr", methods=["POST"])  # file upload
 async def proxy_ocr(request: Request):
     logger.info("Proxying to chat_service /api/v1/ocr")
-    return await proxy_request(f"{CHAT_SERVICE_URL}/api/v1/ocr", "", request)
+    return await proxy_request(CHAT_SERVICE_URL, f"{CHAT_SERVICE_URL}/api/v1/ocr", "", request)
 
 
 @app.api_route("/api/v1/index", methods=["POST"])  # ingestion
 async def proxy_index(request: Request):
     logger.info("Proxying to ai_service /api/v1/index")
-    return await proxy_request(f"{AI_SERVICE_URL}/api/v1/index", "", request)
+    return await proxy_request(AI_SERVICE_URL, f"{AI_SERVICE_URL}/api/v1/index", "", request)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.CORS_ORIGINS if hasattr(settings, 'CORS_ORIGINS') else ["*"],
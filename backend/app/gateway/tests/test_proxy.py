@@ -0,0 +1,41 @@
+import gzip
+
+import httpx
+from fastapi.testclient import TestClient
+
+from gateway import main
+
+
+def _upstream(handler):
+    main._clients[main.CHAT_SERVICE_URL] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_relays_retry_after_from_upstream():
+    _upstream(lambda request: httpx.Response(
+        503,
+        json={"detail": "model busy, retry after 7s"},
+        headers={"Retry-After": "7", "Connection": "close"},
+    ))
+    resp = TestClient(main.app).post("/api/v1/chat/query", json={"text": "hi"})
+    assert resp.status_code == 503
+    assert resp.headers["retry-after"] == "7"
+    assert resp.headers["content-type"] == "application/json"
+    assert resp.json() == {"detail": "model busy, retry after 7s"}
+
+
+def test_relays_decoded_body_without_upstream_framing():
+    body = gzip.compress(b'{"answer": "ok"}')
+    _upstream(lambda request: httpx.Response(
+        200,
+        content=body,
+        headers=[
+            ("Content-Type", "application/json"),
+            ("Content-Encoding", "gzip"),
+            ("Set-Cookie", "a=1"),
+            ("Set-Cookie", "b=2"),
+        ],
+    ))
+    resp = TestClient(main.app).post("/api/v1/chat/query", json={"text": "hi"})
+    assert resp.json() == {"answer": "ok"}
+    assert "content-encoding" not in resp.headers
+    assert resp.headers.get_list("set-cookie") == ["a=1", "b=2"]
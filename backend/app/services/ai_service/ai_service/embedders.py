@@ -0,0 +1,215 @@
+import hashlib
+import json
+import math
+import os
+import re
+from typing import List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_BACKENDS = ("hf", "onnx", "hash")
+# One default for ai_service and the worker: both write into the same collection
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_EMBEDDING_BACKEND = "hf"
+POOLING_MODES = ("mean", "cls", "max")
+
+
+class Embedder(Embeddings):
+    """A LangChain ``Embeddings`` that also knows its vector size.
+
+    ``dim`` is what the Qdrant collection is created with and checked
+    against, so switching models cannot silently mix vector spaces.
+    """
+
+    backend = "base"
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    @property
+    def dim(self) -> int:
+        raise NotImplementedError
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class HFEmbedder(Embedder):
+    """sentence-transformers on PyTorch (the original backend)."""
+
+    backend = "hf"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        self._model = HuggingFaceEmbeddings(model_name=model_name)
+
+    @property
+    def dim(self) -> int:
+        return int(self._model.client.get_sentence_embedding_dimension())
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._model.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._model.embed_query(text)
+
+
+class OnnxEmbedder(Embedder):
+    """ONNX Runtime on CPU, pooled the way the sentence-transformers model is.
+
+    Loads ``EMBEDDING_ONNX_FILE`` from a local directory or the model's Hub
+    repo; the sentence-transformers repos ship int8 exports (e.g.
+    ``onnx/model_quint8_avx2.onnx``) alongside ``onnx/model.onnx``. Pooling
+    and L2 normalisation follow the repo's ``modules.json`` and pooling
+    config, so the vectors match the ``hf`` backend's. No PyTorch is
+    imported, which keeps replica RSS to the model plus runtime.
+    """
+
+    backend = "onnx"
+
+    def __init__(self, model_name: str, onnx_file: Optional[str] = None, max_length: Optional[int] = None, batch_size: Optional[int] = None, threads: Optional[int] = None):
+        super().__init__(model_name)
+        import numpy as np
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self._np = np
+        self.onnx_file = onnx_file or os.getenv("EMBEDDING_ONNX_FILE", "onnx/model.onnx")
+        self.max_length = max_length or int(os.getenv("EMBEDDING_MAX_LENGTH", "256"))
+        self.batch_size = batch_size or int(os.getenv("EMBEDDING_ONNX_BATCH_SIZE", "32"))
+        model_path = self._resolve(model_name, self.onnx_file)
+        tokenizer_path = self._resolve(model_name, "tokenizer.json")
+
+        self.pooling, self.normalize = self._pooling(model_name)
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=self.max_length)
+        self.tokenizer.enable_padding()
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads or int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self.session.get_inputs()}
+        width = self.session.get_outputs()[0].shape[-1]
+        # Some exports leave the hidden size symbolic; probe it once
+        self._dim = width if isinstance(width, int) else len(self._encode(["probe"])[0])
+
+    @staticmethod
+    def _resolve(model_name: str, filename: str) -> str:
+        local = os.path.join(model_name, filename)
+        if os.path.exists(local):
+            return local
+        from huggingface_hub import hf_hub_download
+        return hf_hub_download(repo_id=model_name, filename=filename)
+
+    @classmethod
+    def _config(cls, model_name: str, filename: str) -> Optional[dict]:
+        if os.path.isdir(model_name) and not os.path.exists(os.path.join(model_name, filename)):
+            return None
+        try:
+            with open(cls._resolve(model_name, filename)) as fh:
+                return json.load(fh)
+        except Exception:
+            return None
+
+    @classmethod
+    def _pooling(cls, model_name: str) -> Tuple[str, bool]:
+        """(pooling mode, normalise) from the sentence-transformers module list;
+        mean pooling and normalisation for a model that has none.
+        """
+        modules = cls._config(model_name, "modules.json")
+        if modules is None:
+            return "mean", True
+        mode, normalize = "mean", False
+        for module in modules:
+            kind = module.get("type", "")
+            if kind.endswith("Normalize"):
+                normalize = True
+            elif kind.endswith("Pooling"):
+                config = cls._config(model_name, os.path.join(module.get("path") or "1_Pooling", "config.json")) or {}
+                modes = [k[len("pooling_mode_"):] for k, on in config.items() if k.startswith("pooling_mode_") and on]
+                modes = [{"cls_token": "cls", "mean_tokens": "mean", "max_tokens": "max"}.get(m, m) for m in modes]
+                if len(modes) != 1 or modes[0] not in POOLING_MODES:
+                    raise ValueError(f"unsupported pooling {modes} for {model_name!r}; ONNX supports one of {', '.join(POOLING_MODES)}")
+                mode = modes[0]
+        return mode, normalize
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        np = self._np
+        encodings = self.tokenizer.encode_batch(texts)
+        ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self._inputs:
+            feeds["token_type_ids"] = np.zeros_like(ids)
+        hidden = self.session.run(None, feeds)[0]
+        return pool(hidden, mask, self.pooling, self.normalize).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        out: List[List[float]] = []
+        for i in range(0, len(texts), self.batch_size):
+            out.extend(self._encode(texts[i:i + self.batch_size]))
+        return out
+
+
+def pool(hidden, mask, mode: str = "mean", normalize: bool = True):
+    """Token states ``(batch, tokens, dim)`` to one vector per text, as sentence-transformers pools them."""
+    import numpy as np
+
+    if mode == "cls":
+        pooled = hidden[:, 0]
+    elif mode == "max":
+        pooled = np.where(mask[..., None] > 0, hidden, -1e9).max(axis=1)
+    else:
+        weights = mask[..., None].astype(np.float32)
+        pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+    if normalize:
+        pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+    return pooled
+
+
+class HashingEmbedder(Embedder):
+    """Deterministic feature-hashing vectors: no model, no downloads.
+
+    Same text always gives the same unit vector and shared words give
+    positive similarity, which is enough for tests and offline development.
+    """
+
+    backend = "hash"
+    _token = re.compile(r"\w+")
+
+    def __init__(self, model_name: str = "hash", dim: Optional[int] = None):
+        super().__init__(model_name)
+        self._dim = dim or int(os.getenv("EMBEDDING_HASH_DIM", "384"))
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def _vector(self, text: str) -> List[float]:
+        vec = [0.0] * self._dim
+        for token in self._token.findall((text or "").lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vec[value % self._dim] += 1.0 if (value >> 63) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(t) for t in texts]
+
+
+def make_embedder(backend: str, model_name: str) -> Embedder:
+    if backend == "hf":
+        return HFEmbedder(model_name)
+    if backend == "onnx":
+        return OnnxEmbedder(model_name)
+    if backend == "hash":
+        return HashingEmbedder(model_name)
+    raise ValueError(f"unknown EMBEDDING_BACKEND {backend!r}; expected one of {', '.join(EMBEDDING_BACKENDS)}")
@@ -0,0 +1,172 @@
+import math
+import os
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from shared.lexical import LexicalStore, tokenize
+from shared.logger import get_logger
+
+logger = get_logger("ai_service.lexical")
+
+
+def _view(buf: array) -> np.ndarray:
+    return np.frombuffer(buf, dtype=f"u{buf.itemsize}") if len(buf) else np.zeros(0, dtype=f"u{buf.itemsize}")
+
+
+class BM25Index:
+    """In-memory BM25 over chunk term statistics.
+
+    Postings are two parallel ``array`` buffers per term (doc numbers and
+    term frequencies) and per-document data lives in flat arrays, so the
+    index costs a few bytes per posting instead of a Python object each.
+    Queries score postings with NumPy. Deleted documents are tombstoned and
+    dropped by a compaction once they make up a quarter of the index.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._ids: List[str] = []
+        self._docs: Dict[str, int] = {}
+        self._collections: List[str] = []
+        self._owner_codes: Dict[Optional[str], int] = {}
+        self._owners = array("i")
+        self._lengths = array("I")
+        self._live = bytearray()
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._n_live = 0
+        self._total_length = 0
+        self._dead = 0
+        # Newest lexical_docs.updated_at applied; polling resumes from here
+        self.synced_at = None
+
+    def __len__(self) -> int:
+        return self._n_live
+
+    def _owner_code(self, owner: Optional[str]) -> int:
+        code = self._owner_codes.get(owner)
+        if code is None:
+            code = self._owner_codes[owner] = len(self._owner_codes)
+        return code
+
+    def add(self, point_id: str, terms: Iterable[Sequence], owner: Optional[str], collection: str):
+        """Index one chunk from ``[term, tf]`` pairs, replacing any earlier version."""
+        with self._lock:
+            self.delete(point_id)
+            doc = len(self._ids)
+            self._ids.append(point_id)
+            self._docs[point_id] = doc
+            self._collections.append(collection)
+            self._owners.append(self._owner_code(owner))
+            length = 0
+            for term, tf in terms:
+                docs, tfs = self._postings.setdefault(term, (array("I"), array("H")))
+                docs.append(doc)
+                tfs.append(min(int(tf), 65535))
+                length += int(tf)
+            self._lengths.append(length)
+            self._live.append(1)
+            self._n_live += 1
+            self._total_length += length
+
+    def delete(self, point_id: str):
+        with self._lock:
+            doc = self._docs.pop(point_id, None)
+            if doc is None:
+                return
+            self._live[doc] = 0
+            self._n_live -= 1
+            self._total_length -= self._lengths[doc]
+            self._dead += 1
+            if self._dead > max(1024, len(self._ids) // 4):
+                self._compact()
+
+    def _compact(self):
+        keep = [doc for doc in range(len(self._ids)) if self._live[doc]]
+        remap = {old: new for new, old in enumerate(keep)}
+        postings: Dict[str, Tuple[array, array]] = {}
+        for term, (docs, tfs) in self._postings.items():
+            new_docs, new_tfs = array("I"), array("H")
+            for doc, tf in zip(docs, tfs):
+                new = remap.get(doc)
+                if new is not None:
+                    new_docs.append(new)
+                    new_tfs.append(tf)
+            if new_docs:
+                postings[term] = (new_docs, new_tfs)
+        self._postings = postings
+        self._ids = [self._ids[d] for d in keep]
+        self._docs = {point_id: doc for doc, point_id in enumerate(self._ids)}
+        self._collections = [self._collections[d] for d in keep]
+        self._owners = array("i", (self._owners[d] for d in keep))
+        self._lengths = array("I", (self._lengths[d] for d in keep))
+        self._live = bytearray(b"\x01" * len(keep))
+        self._dead = 0
+
+    def search(self, query: str, top_k: int, owners: Optional[Sequence[str]] = None) -> List[Tuple[str, str, float]]:
+        """``(point_id, collection, score)`` for the best ``top_k`` chunks, limited to ``owners``."""
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or not self._n_live:
+                return []
+            n = len(self._ids)
+            scores = np.zeros(n, dtype=np.float32)
+            live = np.frombuffer(self._live, dtype=np.uint8).astype(bool)
+            lengths = _view(self._lengths).astype(np.float32)
+            avgdl = max(self._total_length / self._n_live, 1.0)
+            for term in terms:
+                posting = self._postings.get(term)
+                if posting is None:
+                    continue
+                docs = _view(posting[0])
+                alive = live[docs]
+                docs = docs[alive]
+                if not len(docs):
+                    continue
+                tfs = _view(posting[1])[alive].astype(np.float32)
+                df = len(docs)
+                idf = math.log(1.0 + (self._n_live - df + 0.5) / (df + 0.5))
+                norm = self.k1 * (1.0 - self.b + self.b * lengths[docs] / avgdl)
+                # One posting per (term, doc), so the fancy-indexed += has no duplicates
+                scores[docs] += idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+            mask = scores > 0
+            if owners is not None:
+                codes = [self._owner_codes[o] for o in owners if o in self._owner_codes]
+                mask &= np.isin(_view(self._owners), codes)
+            hits = np.nonzero(mask)[0]
+            if not len(hits):
+                return []
+            k = min(top_k, len(hits))
+            top = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[d], self._collections[d], float(scores[d])) for d in top]
+
+    async def sync(self, store: LexicalStore) -> int:
+        """Apply every ``lexical_docs`` change since the last sync; returns how many."""
+        applied = 0
+        newest = self.synced_at
+        async for doc in store.changes(self.synced_at):
+            if doc.get("deleted"):
+                self.delete(doc["_id"])
+            else:
+                self.add(doc["_id"], doc.get("terms") or [], doc.get("owner"), doc.get("collection"))
+            applied += 1
+            newest = doc.get("updated_at") or newest
+        self.synced_at = newest
+        return applied
+
+
+_index: Optional[BM25Index] = None
+_index_lock = threading.Lock()
+
+
+def get_lexical_index() -> BM25Index:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = BM25Index(k1=float(os.getenv("BM25_K1", "1.2")), b=float(os.getenv("BM25_B", "0.75")))
+        return _index
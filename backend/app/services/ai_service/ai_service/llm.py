@@ -0,0 +1,512 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import httpx
+
+from shared.config import settings
+from shared.logger import get_logger
+
+logger = get_logger("ai_service.llm")
+
+BACKENDS = ("ollama", "openai", "stub")
+_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+class LLMUnavailable(RuntimeError):
+    """Every configured backend failed, timed out or has its circuit open."""
+
+
+@dataclass
+class Completion:
+    # Whole answer from ``complete``; one delta per chunk from ``stream``
+    text: str
+    backend: str
+    # Prompt tokens the backend reports evaluating (Ollama: prompt_eval_count)
+    prompt_tokens: Optional[int] = None
+
+
+def to_chat(messages: Sequence[Any]) -> List[Dict[str, str]]:
+    """LangChain messages (or role dicts) as OpenAI/Ollama-style role dicts."""
+    return [
+        m if isinstance(m, dict) else {"role": _ROLES.get(getattr(m, "type", ""), "user"), "content": m.content}
+        for m in messages
+    ]
+
+
+def _env(name: str, key: str, default: str) -> str:
+    # LLM_OLLAMA_TIMEOUT overrides LLM_TIMEOUT for one backend
+    return os.getenv(f"LLM_{name.upper()}_{key}", os.getenv(f"LLM_{key}", default))
+
+
+class CircuitBreaker:
+    """Opens after ``failures`` consecutive errors; after ``reset_seconds`` one trial call is let through."""
+
+    def __init__(self, failures: int, reset_seconds: float):
+        self.failures = max(1, failures)
+        self.reset_seconds = reset_seconds
+        self._errors = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if self._trial or time.monotonic() - self._opened_at >= self.reset_seconds else "open"
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        if self._trial or time.monotonic() - self._opened_at < self.reset_seconds:
+            return False
+        self._trial = True
+        return True
+
+    def abandon(self):
+        # A trial call that never reached the backend
+        self._trial = False
+
+    def success(self):
+        self._errors = 0
+        self._opened_at = None
+        self._trial = False
+
+    def failure(self):
+        self._errors += 1
+        if self._trial or self._errors >= self.failures:
+            self._opened_at = time.monotonic()
+        self._trial = False
+
+
+class LLMBackend:
+    """One chat-completion endpoint with its own pooled client, concurrency slots and breaker."""
+
+    def __init__(self, name: str, model: str, base_url: str = "", timeout: Optional[float] = None, max_concurrency: Optional[int] = None):
+        self.name = name
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout or float(_env(name, "TIMEOUT", "60"))
+        self.max_concurrency = max(1, max_concurrency or int(_env(name, "CONCURRENCY", "4")))
+        self.breaker = CircuitBreaker(int(_env(name, "BREAKER_FAILURES", "3")), float(_env(name, "BREAKER_RESET_SECONDS", "30")))
+        self.slots = asyncio.Semaphore(self.max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        # Smoothed seconds per completed request, for shedding and failover order
+        self.latency: Optional[float] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    # ------------------------------------------------------------ protocol
+
+    def _headers(self) -> Dict[str, str]:
+        return {}
+
+    def _request(self, messages: List[Dict[str, str]], stream: bool) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def _path(self) -> str:
+        raise NotImplementedError
+
+    def _parse(self, data: Dict[str, Any]) -> Completion:
+        raise NotImplementedError
+
+    def _parse_line(self, line: str) -> Optional[Completion]:
+        raise NotImplementedError
+
+    # ----------------------------------------------------------- transport
+
+    def _timeout(self) -> httpx.Timeout:
+        # Read timeout bounds the wait for the first token and every gap after it
+        return httpx.Timeout(self.timeout, connect=min(5.0, self.timeout))
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(base_url=self.base_url, headers=self._headers(), timeout=self._timeout(), limits=self._limits())
+        return self._client
+
+    async def complete(self, messages: List[Dict[str, str]]) -> Completion:
+        r = await asyncio.wait_for(self.client().post(self._path(), json=self._request(messages, False)), self.timeout)
+        r.raise_for_status()
+        return self._parse(r.json())
+
+    async def stream(self, messages: List[Dict[str, str]]) -> AsyncIterator[Completion]:
+        async with self.client().stream("POST", self._path(), json=self._request(messages, True)) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                chunk = self._parse_line(line) if line.strip() else None
+                if chunk is not None:
+                    yield chunk
+
+    async def warm(self):
+        """Make the backend ready to answer, e.g. load its model; a no-op where there is nothing to load."""
+
+    def observe(self, seconds: float):
+        self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+
+    def expected_wait(self) -> float:
+        """Rough seconds a new request would queue for a slot."""
+        if self.in_flight < self.max_concurrency:
+            return 0.0
+        return (self.waiting + 1) / self.max_concurrency * (self.latency or self.timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "model": self.model,
+            "breaker": self.breaker.state,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+        }
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class OllamaBackend(LLMBackend):
+    def _path(self) -> str:
+        return "/api/chat"
+
+    def _request(self, messages, stream):
+        return {"model": self.model, "messages": messages, "stream": stream}
+
+    def _parse(self, data):
+        return Completion((data.get("message") or {}).get("content", ""), self.name, data.get("prompt_eval_count"))
+
+    def _parse_line(self, line):
+        data = json.loads(line)
+        if data.get("error"):
+            raise RuntimeError(data["error"])
+        return Completion((data.get("message") or {}).get("content", ""), self.name, data.get("prompt_eval_count") if data.get("done") else None)
+
+    async def warm(self):
+        # A generate call without a prompt loads the model into memory and returns at once
+        r = await self.client().post("/api/generate", json={"model": self.model, "keep_alive": os.getenv("OLLAMA_KEEP_ALIVE", "5m")})
+        r.raise_for_status()
+
+
+class OpenAIBackend(LLMBackend):
+    """Any OpenAI-compatible ``/v1/chat/completions``: OpenRouter, vLLM, TGI, llama.cpp server."""
+
+    def __init__(self, *args, api_key: str = "", **kwargs):
+        self.api_key = api_key
+        super().__init__(*args, **kwargs)
+
+    def _headers(self):
+        h = {"X-Title": "GenAI Med Chat"}
+        if self.api_key:
+            h["Authorization"] = f"Bearer {self.api_key}"
+        return h
+
+    def _path(self) -> str:
+        return "/v1/chat/completions"
+
+    def _request(self, messages, stream):
+        body: Dict[str, Any] = {"model": self.model, "messages": messages, "stream": stream}
+        if stream:
+            body["stream_options"] = {"include_usage": True}
+        return body
+
+    def _parse(self, data):
+        choices = data.get("choices") or [{}]
+        return Completion((choices[0].get("message") or {}).get("content") or "", self.name, (data.get("usage") or {}).get("prompt_tokens"))
+
+    def _parse_line(self, line):
+        if not line.startswith("data:"):
+            return None
+        payload = line[5:].strip()
+        if payload == "[DONE]":
+            return None
+        data = json.loads(payload)
+        if data.get("error"):
+            raise RuntimeError(str(data["error"]))
+        choices = data.get("choices") or [{}]
+        text = (choices[0].get("delta") or {}).get("content") or ""
+        return Completion(text, self.name, (data.get("usage") or {}).get("prompt_tokens"))
+
+
+class StubBackend(LLMBackend):
+    """Canned answers without a model, for local runs and tests."""
+
+    def _answer(self, messages: List[Dict[str, str]]) -> Completion:
+        question = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        question = question.rsplit("Question:", 1)[-1].strip()
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+        return Completion(f"(stub answer) You asked: {question[:200]}", self.name, prompt_tokens)
+
+    async def complete(self, messages):
+        return self._answer(messages)
+
+    async def stream(self, messages):
+        answer = self._answer(messages)
+        words = answer.text.split(" ")
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            yield Completion(word + ("" if last else " "), self.name, answer.prompt_tokens if last else None)
+
+
+class _StreamBroken(Exception):
+    """A stream failed after its first token; raised from the original error."""
+
+
+class _Flight:
+    """One in-flight streamed generation that identical requests subscribe to."""
+
+    def __init__(self):
+        self.chunks: List[Completion] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class _Call:
+    """One in-flight completion that identical requests await."""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class LLMRouter:
+    """Routes generations across backends in preference order.
+
+    Identical prompts in flight at the same time share one upstream call
+    (streams are replayed to late joiners). A backend is skipped while its
+    breaker is open, and shed when its predicted queue wait exceeds
+    ``shed_after`` seconds, as long as a later backend can take the request;
+    fallbacks are tried fastest-first by observed latency. A stream only
+    fails over before its first token.
+    """
+
+    def __init__(self, backends: List[LLMBackend], shed_after: Optional[float] = None, coalesce: Optional[bool] = None):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = backends
+        self.shed_after = shed_after if shed_after is not None else float(os.getenv("LLM_SHED_AFTER_SECONDS", "2"))
+        self.coalesce = coalesce if coalesce is not None else os.getenv("LLM_COALESCE", "1") not in ("0", "false", "False")
+        self._completions: Dict[str, _Call] = {}
+        self._streams: Dict[str, _Flight] = {}
+        self.stats_counters = {"requests": 0, "coalesced": 0, "shed": 0, "failovers": 0, "unavailable": 0}
+
+    @staticmethod
+    def _key(messages: List[Dict[str, str]]) -> str:
+        return hashlib.sha1(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _order(self) -> List[LLMBackend]:
+        primary, rest = self.backends[0], self.backends[1:]
+        # Unmeasured fallbacks keep their configured order ahead of slow ones
+        return [primary] + sorted(rest, key=lambda b: b.expected_wait() + (b.latency or 0.0))
+
+    async def _acquire(self, backend: LLMBackend, last: bool) -> bool:
+        if not last and backend.expected_wait() > self.shed_after:
+            return False
+        backend.waiting += 1
+        try:
+            await asyncio.wait_for(backend.slots.acquire(), None if last else self.shed_after)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            backend.waiting -= 1
+
+    async def _failover(self, call):
+        """``await call(backend)`` on the first backend that is healthy, has a slot and succeeds."""
+        order = self._order()
+        for i, backend in enumerate(order):
+            last = all(b.breaker.state == "open" for b in order[i + 1:])
+            if not backend.breaker.allow():
+                continue
+            if not await self._acquire(backend, last):
+                self.stats_counters["shed"] += 1
+                backend.breaker.abandon()
+                logger.info(f"llm_shed backend={backend.name} waiting={backend.waiting} in_flight={backend.in_flight}")
+                continue
+            backend.in_flight += 1
+            t0 = time.perf_counter()
+            try:
+                result = await call(backend)
+            except _StreamBroken as e:
+                self._failed(backend, e.__cause__)
+                raise e.__cause__
+            except asyncio.CancelledError:
+                backend.breaker.abandon()
+                raise
+            except Exception as e:
+                self._failed(backend, e)
+                continue
+            finally:
+                backend.in_flight -= 1
+                backend.slots.release()
+            backend.observe(time.perf_counter() - t0)
+            backend.breaker.success()
+            return result
+        raise self._unavailable()
+
+    def _failed(self, backend: LLMBackend, e: BaseException):
+        backend.breaker.failure()
+        self.stats_counters["failovers"] += 1
+        logger.warning(f"llm_backend_error backend={backend.name} breaker={backend.breaker.state} error={type(e).__name__}: {e}")
+
+    def _unavailable(self) -> LLMUnavailable:
+        self.stats_counters["unavailable"] += 1
+        return LLMUnavailable("no LLM backend available: " + ", ".join(f"{b.name}={b.breaker.state}" for b in self.backends))
+
+    async def _complete(self, messages: List[Dict[str, str]]) -> Completion:
+        return await self._failover(lambda backend: backend.complete(messages))
+
+    async def agenerate(self, messages: Sequence[Any]) -> Completion:
+        chat = to_chat(messages)
+        self.stats_counters["requests"] += 1
+        if not self.coalesce:
+            return await self._complete(chat)
+        key = self._key(chat)
+        call = self._completions.get(key)
+        if call is not None:
+            self.stats_counters["coalesced"] += 1
+        else:
+            # Its own task, so one caller's cancellation does not reach the others
+            call = self._completions[key] = _Call(asyncio.create_task(self._complete(chat)))
+            call.task.add_done_callback(lambda task: self._landed(key, call))
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            # The last caller gone: stop generating rather than hold a slot for nobody
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def _landed(self, key: str, call: _Call):
+        if self._completions.get(key) is call:
+            self._completions.pop(key)
+        # Retrieved here so a call every waiter abandoned does not log "exception never retrieved"
+        if not call.task.cancelled():
+            call.task.exception()
+
+    async def _produce(self, flight: _Flight, chat: List[Dict[str, str]]):
+        async def relay(backend: LLMBackend):
+            started = False
+            try:
+                async for chunk in backend.stream(chat):
+                    started = True
+                    async with flight.changed:
+                        flight.chunks.append(chunk)
+                        flight.changed.notify_all()
+            except Exception as e:
+                # Listeners already have tokens from this backend; another one cannot continue them
+                if started:
+                    raise _StreamBroken() from e
+                raise
+
+        try:
+            await self._failover(relay)
+        except BaseException as e:
+            flight.error = e
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            flight.done = True
+            async with flight.changed:
+                flight.changed.notify_all()
+
+    async def astream(self, messages: Sequence[Any]) -> AsyncIterator[Completion]:
+        chat = to_chat(messages)
+        self.stats_counters["requests"] += 1
+        key = self._key(chat) if self.coalesce else None
+        flight = self._streams.get(key) if key else None
+        if flight is not None:
+            self.stats_counters["coalesced"] += 1
+        else:
+            flight = _Flight()
+            if key:
+                self._streams[key] = flight
+            flight.task = asyncio.create_task(self._produce(flight, chat))
+            if key:
+                flight.task.add_done_callback(lambda _: self._streams.pop(key, None) if self._streams.get(key) is flight else None)
+        flight.subscribers += 1
+        try:
+            i = 0
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: i < len(flight.chunks) or flight.done)
+                while i < len(flight.chunks):
+                    yield flight.chunks[i]
+                    i += 1
+                if flight.done and i >= len(flight.chunks):
+                    break
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.subscribers -= 1
+            # The last listener gone: stop generating rather than hold a slot for nobody
+            if flight.subscribers == 0 and not flight.done and flight.task is not None:
+                flight.task.cancel()
+
+    async def warm(self) -> Dict[str, bool]:
+        """Warm every backend; one that fails is reported, not raised, so startup can go on without it."""
+        results = {}
+        for backend in self.backends:
+            try:
+                await backend.warm()
+                results[backend.name] = True
+            except Exception as e:
+                logger.warning(f"llm_warm_failed backend={backend.name} error={e}")
+                results[backend.name] = False
+        return results
+
+    @property
+    def capacity(self) -> int:
+        """Generations all backends can run at once; beyond the primary's slots requests shed to fallbacks."""
+        return sum(b.max_concurrency for b in self.backends)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.stats_counters, "backends": [b.stats() for b in self.backends]}
+
+    async def aclose(self):
+        for backend in self.backends:
+            await backend.aclose()
+
+
+def make_backend(name: str) -> LLMBackend:
+    if name == "ollama":
+        # Ollama serves PIPELINE_MAX_CONCURRENCY generations at once unless LLM_OLLAMA_CONCURRENCY says otherwise
+        return OllamaBackend(
+            "ollama",
+            os.getenv("OLLAMA_MODEL", "llama3.1"),
+            os.getenv("OLLAMA_URL", os.getenv("OLLAMA_HOST", "http://localhost:11434")),
+            max_concurrency=int(os.getenv("LLM_OLLAMA_CONCURRENCY", os.getenv("PIPELINE_MAX_CONCURRENCY", "4"))),
+        )
+    if name == "openai":
+        return OpenAIBackend("openai", settings.OPENROUTER_MODEL, settings.AI_AGENT_BASE_URL, api_key=settings.AI_AGENT_API_KEY)
+    if name == "stub":
+        return StubBackend("stub", "stub")
+    raise ValueError(f"unknown LLM backend {name!r}; expected one of {', '.join(BACKENDS)}")
+
+
+_router: Optional[LLMRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_llm() -> LLMRouter:
+    """Process-wide router: MODEL_BACKEND first, then LLM_FALLBACKS (comma-separated) in order."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            names = [settings.MODEL_BACKEND] + [n.strip() for n in os.getenv("LLM_FALLBACKS", "").split(",") if n.strip()]
+            names = list(dict.fromkeys(names))
+            _router = LLMRouter([make_backend(n) for n in names])
+            logger.info(f"llm_router backends={','.join(names)}")
+        return _router
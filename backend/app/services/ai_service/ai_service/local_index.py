@@ -0,0 +1,348 @@
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+from shared.logger import get_logger
+
+logger = get_logger("ai_service.local_index")
+
+INDEX_MODES = ("flat", "ivf", "hnsw")
+
+
+def _normalize_rows(vectors) -> np.ndarray:
+    m = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    return m / np.clip(norms, 1e-12, None)
+
+
+class LocalVectorIndex:
+    """In-process cosine index over normalised float32 rows.
+
+    ``flat`` scores every row (exact). ``ivf`` clusters rows with k-means and
+    only scores the ``nprobe`` clusters nearest the query. ``hnsw`` delegates
+    to hnswlib when it is installed. Rows carry the same payload layout
+    LangChain's Qdrant store uses (``page_content`` + ``metadata``), and
+    :meth:`search` returns the ``[{"text", "metadata"}]`` shape of
+    ``RAGStore.search``, optionally restricted to given owners (``metadata.user_id``).
+
+    Snapshots are a directory holding ``vectors.npy`` and ``meta.json``;
+    :meth:`load` memory-maps the vectors, so a large snapshot is paged in on
+    demand and only copied on the first write.
+    """
+
+    def __init__(self, dim: int, mode: str = "flat", nlist: int = 64, nprobe: int = 8, ef: int = 64):
+        if mode not in INDEX_MODES:
+            raise ValueError(f"unknown LOCAL_INDEX_MODE {mode!r}; expected one of {', '.join(INDEX_MODES)}")
+        self.dim = dim
+        self.mode = mode
+        self.nlist = max(1, nlist)
+        self.nprobe = max(1, nprobe)
+        self.ef = max(1, ef)
+        self._lock = threading.RLock()
+        self._vecs = np.zeros((0, dim), dtype=np.float32)
+        self._n = 0
+        self._ids: List[str] = []
+        self._payloads: List[Dict[str, Any]] = []
+        self._rows: Dict[str, int] = {}
+        # metadata.user_id per row, kept as an array so filtering is vectorised
+        self._owners = np.empty(0, dtype=object)
+        # ivf: centroids and each row's cluster; retrained once the index doubles
+        self._centroids: Optional[np.ndarray] = None
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._trained_at = 0
+        # hnsw: graph labels are stable per id, rows are not (deletes swap rows)
+        self._hnsw = None
+        self._labels: Dict[str, int] = {}
+        self._label_ids: Dict[int, str] = {}
+        self._next_label = 0
+        # Newest lexical_docs.updated_at applied by RAGStore.sync_local_index; kept in snapshots
+        self.synced_at: Optional[datetime] = None
+        if mode == "hnsw":
+            self._init_hnsw(1024)
+
+    def __len__(self) -> int:
+        return self._n
+
+    def ids(self) -> List[str]:
+        with self._lock:
+            return list(self._ids)
+
+    # ---------------------------------------------------------------- writes
+
+    def _reserve(self, extra: int):
+        need = self._n + extra
+        cap = self._vecs.shape[0]
+        if need <= cap and self._vecs.flags.writeable:
+            return
+        grown = np.zeros((max(need, cap * 2, 64), self.dim), dtype=np.float32)
+        grown[: self._n] = self._vecs[: self._n]
+        self._vecs = grown
+        assign = np.zeros(grown.shape[0], dtype=np.int32)
+        assign[: self._n] = self._assign[: self._n]
+        self._assign = assign
+        owners = np.empty(grown.shape[0], dtype=object)
+        owners[: self._n] = self._owners[: self._n]
+        self._owners = owners
+
+    def add(self, ids: List[str], vectors, payloads: List[Dict[str, Any]]):
+        """Insert or replace rows by id."""
+        if not ids:
+            return
+        matrix = _normalize_rows(vectors)
+        if matrix.shape[1] != self.dim:
+            raise ValueError(f"vector size {matrix.shape[1]} does not match index dim {self.dim}")
+        with self._lock:
+            self._reserve(len(ids))
+            rows = []
+            for point_id, vec, payload in zip(ids, matrix, payloads):
+                row = self._rows.get(point_id)
+                if row is None:
+                    row = self._n
+                    self._n += 1
+                    self._ids.append(point_id)
+                    self._payloads.append(payload)
+                    self._rows[point_id] = row
+                else:
+                    self._payloads[row] = payload
+                self._vecs[row] = vec
+                self._owners[row] = (payload.get("metadata") or {}).get("user_id")
+                rows.append(row)
+            if self.mode == "ivf":
+                self._ivf_assign(np.asarray(rows))
+            elif self.mode == "hnsw":
+                self._hnsw_add([str(i) for i in ids], matrix)
+
+    def delete(self, ids: Iterable[str]):
+        with self._lock:
+            for point_id in ids:
+                row = self._rows.pop(point_id, None)
+                if row is None:
+                    continue
+                if not self._vecs.flags.writeable:
+                    self._reserve(0)
+                last = self._n - 1
+                if row != last:
+                    # Move the last row into the hole so the matrix stays dense
+                    moved = self._ids[last]
+                    self._vecs[row] = self._vecs[last]
+                    self._assign[row] = self._assign[last]
+                    self._owners[row] = self._owners[last]
+                    self._ids[row] = moved
+                    self._payloads[row] = self._payloads[last]
+                    self._rows[moved] = row
+                self._ids.pop()
+                self._payloads.pop()
+                self._n = last
+                if self._hnsw is not None:
+                    label = self._labels.pop(point_id, None)
+                    if label is not None:
+                        self._label_ids.pop(label, None)
+                        self._hnsw.mark_deleted(label)
+
+    # ------------------------------------------------------------------- ivf
+
+    def _kmeans(self, data: np.ndarray, k: int, iters: int = 10) -> np.ndarray:
+        rng = np.random.default_rng(0)
+        centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+        for _ in range(iters):
+            assign = np.argmax(data @ centroids.T, axis=1)
+            for c in range(k):
+                members = data[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize_rows(centroids)
+        return centroids
+
+    def _ivf_assign(self, rows: np.ndarray):
+        if self._centroids is None or self._n >= 2 * max(self._trained_at, 1):
+            self._ivf_train()
+            return
+        self._assign[rows] = np.argmax(self._vecs[rows] @ self._centroids.T, axis=1)
+
+    def _ivf_train(self):
+        n = self._n
+        # Too few rows to cluster usefully: one list, i.e. exact search
+        k = min(self.nlist, max(1, n // 16))
+        data = self._vecs[:n]
+        self._trained_at = n
+        if k == 1:
+            self._centroids = None
+            self._assign[:n] = 0
+            return
+        self._centroids = self._kmeans(data, k)
+        self._assign[:n] = np.argmax(data @ self._centroids.T, axis=1)
+
+    # ------------------------------------------------------------------ hnsw
+
+    def _init_hnsw(self, capacity: int):
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise RuntimeError("LOCAL_INDEX_MODE=hnsw requires the hnswlib package") from e
+        self._hnsw = hnswlib.Index(space="ip", dim=self.dim)
+        self._hnsw.init_index(max_elements=capacity, ef_construction=200, M=16, allow_replace_deleted=True)
+        self._hnsw.set_ef(self.ef)
+
+    def _hnsw_add(self, ids: List[str], matrix: np.ndarray):
+        labels = []
+        for point_id in ids:
+            label = self._labels.get(point_id)
+            if label is None:
+                label = self._next_label
+                self._next_label += 1
+                self._labels[point_id] = label
+                self._label_ids[label] = point_id
+            labels.append(label)
+        needed = self._hnsw.get_current_count() + len(ids)
+        if needed > self._hnsw.get_max_elements():
+            self._hnsw.resize_index(max(needed, 2 * self._hnsw.get_max_elements()))
+        self._hnsw.add_items(matrix, np.asarray(labels), replace_deleted=True)
+
+    # ----------------------------------------------------------------- reads
+
+    def _owner_mask(self, rows: np.ndarray, user_id: Union[str, Sequence[str]]) -> np.ndarray:
+        if isinstance(user_id, str):
+            return self._owners[rows] == user_id
+        return np.isin(self._owners[rows], list(user_id))
+
+    def _candidates(self, query: np.ndarray, user_id) -> np.ndarray:
+        n = self._n
+        rows = np.arange(n)
+        if self.mode == "ivf" and self._centroids is not None and len(self._centroids) > self.nprobe:
+            probe = np.argsort(-(self._centroids @ query))[: self.nprobe]
+            rows = rows[np.isin(self._assign[:n], probe)]
+        if user_id is not None:
+            rows = rows[self._owner_mask(rows, user_id)]
+        return rows
+
+    def _search_hnsw(self, query: np.ndarray, top_k: int, user_id):
+        allowed = None
+        k = min(top_k, self._n)
+        if user_id is not None:
+            owners = {user_id} if isinstance(user_id, str) else set(user_id)
+            allowed = lambda label: self._owners[self._rows[self._label_ids[label]]] in owners
+            k = min(k, int(self._owner_mask(np.arange(self._n), user_id).sum()))
+        if not k:
+            return []
+        labels, distances = self._hnsw.knn_query(query, k=k, filter=allowed)
+        # hnswlib's "ip" space reports 1 - dot
+        return [(self._rows[self._label_ids[int(l)]], 1.0 - float(d)) for l, d in zip(labels[0], distances[0])]
+
+    def _search_rows(self, query: np.ndarray, top_k: int, user_id):
+        if self._hnsw is not None:
+            try:
+                return self._search_hnsw(query, top_k, user_id)
+            except RuntimeError:
+                # hnswlib raises when a filtered walk finds fewer than k; score exactly instead
+                pass
+        rows = self._candidates(query, user_id)
+        if not len(rows):
+            return []
+        scores = self._vecs[rows] @ query
+        k = min(top_k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+    def search(self, vector, top_k: int = 3, user_id: Union[str, Sequence[str], None] = None) -> List[Dict[str, Any]]:
+        """Top ``top_k`` rows by cosine, limited to rows owned by ``user_id`` (one id or several)."""
+        query = _normalize_rows(vector)[0]
+        with self._lock:
+            if not self._n:
+                return []
+            hits = self._search_rows(query, top_k, user_id)
+            return [self._hit(row, score) for row, score in hits]
+
+    def _hit(self, row: int, score: Optional[float] = None) -> Dict[str, Any]:
+        metadata = dict(self._payloads[row].get("metadata", {}))
+        if score is not None:
+            metadata["score"] = score
+        return {"id": self._ids[row], "text": self._payloads[row].get("page_content", ""), "metadata": metadata}
+
+    def get(self, ids: Iterable[str]) -> List[Dict[str, Any]]:
+        """Rows for the ids present, in the same shape as :meth:`search` hits."""
+        with self._lock:
+            return [self._hit(self._rows[i]) for i in ids if i in self._rows]
+
+    # ------------------------------------------------------------- snapshots
+
+    def save(self, path: str):
+        """Write a snapshot atomically (temp files, then rename)."""
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            vectors = np.ascontiguousarray(self._vecs[: self._n])
+            meta = {
+                "dim": self.dim,
+                "mode": self.mode,
+                "synced_at": self.synced_at.isoformat() if self.synced_at else None,
+                "ids": self._ids,
+                "payloads": self._payloads,
+            }
+            tmp_vecs = os.path.join(path, "vectors.tmp.npy")
+            tmp_meta = os.path.join(path, "meta.json.tmp")
+            np.save(tmp_vecs, vectors)
+            with open(tmp_meta, "w") as fh:
+                json.dump(meta, fh, default=str)
+        os.replace(tmp_vecs, os.path.join(path, "vectors.npy"))
+        os.replace(tmp_meta, os.path.join(path, "meta.json"))
+        logger.info(f"local_index_saved path={path} rows={len(vectors)}")
+
+    @classmethod
+    def load(cls, path: str, mode: Optional[str] = None, **kwargs) -> "LocalVectorIndex":
+        with open(os.path.join(path, "meta.json")) as fh:
+            meta = json.load(fh)
+        index = cls(meta["dim"], mode=mode or meta.get("mode", "flat"), **kwargs)
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        if meta.get("synced_at"):
+            index.synced_at = datetime.fromisoformat(meta["synced_at"])
+        with index._lock:
+            if index.mode == "flat":
+                # Read-only mapping; the first write copies it into memory
+                index._vecs = vectors
+                index._n = len(vectors)
+                index._ids = list(meta["ids"])
+                index._payloads = list(meta["payloads"])
+                index._rows = {point_id: row for row, point_id in enumerate(index._ids)}
+                index._assign = np.zeros(len(vectors), dtype=np.int32)
+                index._owners = np.empty(len(vectors), dtype=object)
+                for row, payload in enumerate(index._payloads):
+                    index._owners[row] = (payload.get("metadata") or {}).get("user_id")
+            else:
+                # Approximate modes rebuild their structures from the rows
+                index.add(list(meta["ids"]), np.asarray(vectors), list(meta["payloads"]))
+        logger.info(f"local_index_loaded path={path} rows={len(index)} mode={index.mode}")
+        return index
+
+
+_index: Optional[LocalVectorIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_local_index(dim: int) -> LocalVectorIndex:
+    """Process-wide index, loaded from ``LOCAL_INDEX_PATH`` when a snapshot exists there."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            mode = os.getenv("LOCAL_INDEX_MODE", "flat")
+            opts = {
+                "nlist": int(os.getenv("LOCAL_INDEX_NLIST", "64")),
+                "nprobe": int(os.getenv("LOCAL_INDEX_NPROBE", "8")),
+                "ef": int(os.getenv("LOCAL_INDEX_EF", "64")),
+            }
+            path = os.getenv("LOCAL_INDEX_PATH", "")
+            index = None
+            if path and os.path.exists(os.path.join(path, "meta.json")):
+                try:
+                    index = LocalVectorIndex.load(path, mode=mode, **opts)
+                    if index.dim != dim:
+                        logger.warning(f"local_index_snapshot_ignored path={path} dim={index.dim} expected={dim}")
+                        index = None
+                except Exception as e:
+                    logger.warning(f"local_index_load_failed path={path} error={e}")
+                    index = None
+            _index = index or LocalVectorIndex(dim, mode=mode, **opts)
+        return _index
@@ -3,28 +3,178 @@ AI Service with Ollama + LangChain + LangGraph + LangSmith
 Includes basic endpoints for chat generation, OCR/voice passthrough, and RAG ingestion.
 """
 
-from fastapi import FastAPI, UploadFile, Depends, Request
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, Depends, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
 import httpx
+import json
 import os
-from typing import Optional
+import threading
+import time
+from typing import Optional, AsyncIterable, AsyncIterator, Dict, Any
 from langsmith import traceable
 from opentelemetry import trace
 from shared.logger import setup_observability, get_logger
 from shared.config import settings
+from shared.mongo import close_async_mongo_client
+from shared.startup import StartupReport
+from shared.uploads import spool_upload, UploadTooLarge
 
+from .llm import LLMUnavailable, get_llm
 from .pipeline import ChatPipeline
-from .rag import RAGStore
+from .rag import RAGStore, get_rag_store
+from .scheduler import Rejected, get_scheduler
+from .batching import EmbeddingBatcher
+from .models import get_embeddings, registry
 from .auth import get_current_user, require_role
 
+# Built on first use or by the startup warm-up, never at import: importing this module stays fast
+_pipeline: Optional[ChatPipeline] = None
+_pipeline_lock = threading.Lock()
+# Concurrent /embed calls are coalesced into one embed_documents batch
+embed_batcher = EmbeddingBatcher(lambda texts: get_rag_store().emb.embed_documents(texts))
+startup = StartupReport("ai_service")
+# background: serve at once, /ready turns 200 once warm; blocking: warm before serving;
+# off: ready at once with no warm-up, models load on first use
+WARMUP_MODES = ("background", "blocking", "off")
+
+
+def get_pipeline() -> ChatPipeline:
+    global _pipeline
+    if _pipeline is not None:
+        return _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = ChatPipeline()
+        return _pipeline
+
+
+async def _apipeline() -> ChatPipeline:
+    # Off the event loop in case this request is the one that builds it
+    return _pipeline or await run_in_threadpool(get_pipeline)
+
+
+async def _arag() -> RAGStore:
+    return get_rag_store(create=False) or await run_in_threadpool(get_rag_store)
+
+
+async def _sync_local_index(rag: RAGStore):
+    # First pass at startup, then every LOCAL_INDEX_SYNC_SECONDS (0 = startup only)
+    interval = float(os.getenv("LOCAL_INDEX_SYNC_SECONDS", "300"))
+    while True:
+        try:
+            await run_in_threadpool(rag.sync_local_index)
+        except Exception as e:
+            logger.warning(f"local_index_sync_error error={e}")
+        if interval <= 0:
+            return
+        await asyncio.sleep(interval)
+
+
+async def _sync_lexical_index(rag: RAGStore):
+    # Backfill once for points indexed before lexical_docs existed, then tail it
+    interval = float(os.getenv("LEXICAL_SYNC_SECONDS", "5"))
+    purge_every = float(os.getenv("LEXICAL_PURGE_SECONDS", "3600"))
+    try:
+        await run_in_threadpool(rag.backfill_lexical)
+    except Exception as e:
+        logger.warning(f"lexical_backfill_error error={e}")
+    purged_at = time.monotonic()
+    while True:
+        try:
+            await rag.sync_lexical_index()
+        except Exception as e:
+            logger.warning(f"lexical_index_sync_error error={e}")
+        if time.monotonic() - purged_at >= purge_every:
+            purged_at = time.monotonic()
+            try:
+                await rag.purge_lexical_tombstones()
+            except Exception as e:
+                logger.warning(f"lexical_purge_error error={e}")
+        await asyncio.sleep(interval)
+
+
+async def _warm_up():
+    """Build every component and exercise it once, timing each step into ``startup``."""
+    async with startup.astep("rag"):
+        rag = await run_in_threadpool(get_rag_store)
+    async with startup.astep("embed"):
+        # The first call pays for lazy weight init and kernel selection; take that hit here
+        await rag.emb.aembed_query("warm-up")
+    if rag.reranker is not None:
+        async with startup.astep("rerank"):
+            await run_in_threadpool(rag.reranker.warm)
+    async with startup.astep("pipeline"):
+        await run_in_threadpool(get_pipeline)
+    async with startup.astep("llm"):
+        warmed = await get_llm().warm()
+    if not any(warmed.values()):
+        # Not fatal: the breakers keep probing and the model loads on the first request instead
+        startup.errors["llm"] = "no backend answered the warm-up"
+
+
+def _start_sync(rag: RAGStore, tasks: list):
+    if rag.local_mode == "fallback":
+        tasks.append(asyncio.create_task(_sync_local_index(rag)))
+    if rag.hybrid:
+        tasks.append(asyncio.create_task(_sync_lexical_index(rag)))
+
+
+async def _startup(mode: str, tasks: list):
+    delay = 1.0
+    while mode != "off":
+        try:
+            await _warm_up()
+            startup.mark_ready(logger)
+            break
+        except Exception as e:
+            # Qdrant or the model store not up yet: stay unready and try again
+            logger.warning(f"startup_warmup_failed retry_in={delay:.0f}s error={e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, float(os.getenv("STARTUP_RETRY_MAX_SECONDS", "30")))
+    if mode == "off" and os.getenv("LOCAL_INDEX", "off") != "fallback" and os.getenv("HYBRID_SEARCH", "0") not in ("1", "true", "True"):
+        # Nothing to sync, so nothing to build until a request asks for it
+        return
+    _start_sync(await _arag(), tasks)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    mode = os.getenv("STARTUP_WARMUP", "background")
+    if mode not in WARMUP_MODES:
+        raise ValueError(f"unknown STARTUP_WARMUP {mode!r}; expected one of {', '.join(WARMUP_MODES)}")
+    tasks: list = []
+    if mode == "blocking":
+        await _warm_up()
+        startup.mark_ready(logger)
+        _start_sync(get_rag_store(), tasks)
+    else:
+        if mode == "off":
+            startup.mark_ready(logger)
+        tasks.append(asyncio.create_task(_startup(mode, tasks)))
+    yield
+    for task in tasks:
+        task.cancel()
+    # Only what was actually built needs closing
+    rag = get_rag_store(create=False)
+    if rag is not None:
+        try:
+            await run_in_threadpool(rag.snapshot_local_index)
+        except Exception as e:
+            logger.warning(f"local_index_snapshot_error error={e}")
+    await embed_batcher.aclose()
+    await get_llm().aclose()
+    close_async_mongo_client()
+
+
 # FastAPI app
-app = FastAPI(title="AI Service")
+app = FastAPI(title="AI Service", lifespan=lifespan)
 setup_observability("ai_service", app)
 logger = get_logger("ai_service")
 otel_tracer = trace.get_tracer(__name__)
 
-pipeline = ChatPipeline()
-rag = RAGStore()
-
 
 # ====================== Health ======================
 @app.get("/ping")
@@ -32,27 +182,57 @@ def ping():
     return {"service": "ai_service", "status": "ok"}
 
 
-# ====================== Chat (Ollama via LangChain/LangGraph) ======================
+@app.get("/ready")
+def ready():
+    # Readiness, not liveness: 503 until the warm-up has loaded the models
+    return JSONResponse(startup.report(), status_code=200 if startup.ready else 503)
+
+
+# ====================== Chat (LLM backends via LangGraph) ======================
+async def _ndjson(first: Dict[str, Any], events: AsyncIterable[Dict[str, Any]]) -> AsyncIterator[str]:
+    yield json.dumps(first, default=str) + "\n"
+    try:
+        async for event in events:
+            yield json.dumps(event, default=str) + "\n"
+    except Exception as e:
+        logger.error(f"ai_generate_stream_error error={e}")
+        yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+
+
 @app.post("/api/v1/generate")
 @traceable
-async def generate(payload: dict, request: Request):
+async def generate(payload: dict, user: dict = Depends(require_role("user"))):
     with otel_tracer.start_as_current_span("ai_service.generate"):
         text = payload.get("text") or ""
-        # Try to decode user from Authorization header; fall back to payload or anonymous
-        auth = request.headers.get("Authorization", "")
-        user_id = payload.get("user_id") or "anonymous"
-        if auth.startswith("Bearer "):
-            try:
-                from jose import jwt
-                token = auth.split(" ", 1)[1]
-                user = jwt.decode(token, os.getenv("SECRET_KEY", ""), algorithms=["HS256"]) or {}
-                user_id = user.get("sub", user_id)
-            except Exception:
-                ...
+        # Memory, cache and retrieval are all scoped by this id, so it comes from the token only
+        user_id = user["id"]
         conv_id = payload.get("conv_id")
+        tenant_id = payload.get("tenant_id")
+        # "interactive" (chat) or "background" (batch work that can wait behind chat)
+        priority = payload.get("priority") or "interactive"
         logger.info("ai_generate_received")
-        resp = pipeline.run(user_id=user_id, text=text, conv_id=conv_id)
-        return resp
+        try:
+            pipeline = await _apipeline()
+            if payload.get("stream"):
+                events = pipeline.astream(user_id=user_id, text=text, conv_id=conv_id, tenant_id=tenant_id, priority=priority)
+                # Admission happens before the first event, so a refusal can still be an HTTP status
+                first = await events.__anext__()
+                return StreamingResponse(_ndjson(first, events), media_type="application/x-ndjson")
+            return await pipeline.arun(user_id=user_id, text=text, conv_id=conv_id, tenant_id=tenant_id, priority=priority)
+        except Rejected as e:
+            return JSONResponse({"detail": str(e), "reason": e.reason, "retry_after": e.retry_after}, status_code=e.status, headers=e.headers)
+        except LLMUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/api/v1/llm/backends")
+def llm_backends():
+    return get_llm().stats()
+
+
+@app.get("/api/v1/scheduler")
+def scheduler_stats():
+    return get_scheduler().stats()
 
 
 # ====================== OCR/Voice passthrough (to external provider if present) ======================
@@ -67,45 +247,63 @@ def _headers() -> dict:
     return h
 
 
+async def _spool(file: UploadFile):
+    # Chunked copy to disk so the provider upload is streamed, not held in memory
+    try:
+        return await spool_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
 @app.post("/api/v1/ocr")
 @traceable
 async def ocr(file: UploadFile):
     with otel_tracer.start_as_current_span("ai_service.ocr"):
-        content = await file.read()
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            resp = await client.post(
-                f"{OPENROUTER_BASE_URL}/v1/ocr",
-                files={"file": (file.filename, content)},
-                headers=_headers(),
-            )
-            resp.raise_for_status()
-            return resp.json()
+        spooled = await _spool(file)
+        try:
+            with spooled.open() as fh:
+                async with httpx.AsyncClient(timeout=120.0) as client:
+                    resp = await client.post(
+                        f"{OPENROUTER_BASE_URL}/v1/ocr",
+                        files={"file": (file.filename, fh, file.content_type)},
+                        headers=_headers(),
+                    )
+                    resp.raise_for_status()
+                    return resp.json()
+        finally:
+            spooled.remove()
 
 
 @app.post("/api/v1/voice")
 @traceable
 async def voice(file: UploadFile):
     with otel_tracer.start_as_current_span("ai_service.voice"):
-        content = await file.read()
-        async with httpx.AsyncClient(timeout=180.0) as client:
-            resp = await client.post(
-                f"{OPENROUTER_BASE_URL}/v1/voice",
-                files={"file": (file.filename or "audio.webm", content)},
-                headers=_headers(),
-            )
-            resp.raise_for_status()
-            return resp.json()
+        spooled = await _spool(file)
+        try:
+            with spooled.open() as fh:
+                async with httpx.AsyncClient(timeout=180.0) as client:
+                    resp = await client.post(
+                        f"{OPENROUTER_BASE_URL}/v1/voice",
+                        files={"file": (file.filename or "audio.webm", fh, file.content_type)},
+                        headers=_headers(),
+                    )
+                    resp.raise_for_status()
+                    return resp.json()
+        finally:
+            spooled.remove()
 
 
 # ====================== RAG Ingestion ======================
 @app.post("/api/v1/index")
 @traceable
-async def index(payload: dict, _: dict = Depends(require_role("user"))):
+async def index(payload: dict, user: dict = Depends(require_role("user"))):
     with otel_tracer.start_as_current_span("ai_service.index"):
-        user_id = payload.get("user_id") or "anonymous"
+        # Owner is the caller, never the body: retrieval is scoped by owner
+        user_id = user["id"]
         text = payload.get("text") or ""
         metadata = payload.get("metadata") or {}
-        return rag.store_medical_doc(user_id=user_id, content=text, metadata=metadata)
+        rag = await _arag()
+        return await rag.astore_medical_doc(user_id=user_id, content=text, metadata=metadata)
 
 
 @app.post("/api/v1/embed")
@@ -116,14 +314,38 @@ async def embed(payload: dict):
         if not text:
             return {"vector": [], "dim": 0}
         try:
-            vec = rag.emb.embed_query(text)
+            vec = await embed_batcher.embed(text)
             return {"vector": vec, "dim": len(vec)}
         except Exception:
             try:
-                from langchain_community.embeddings import HuggingFaceEmbeddings
-                model = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
-                emb = HuggingFaceEmbeddings(model_name=model)
-                vec = emb.embed_query(text)
+                # Retry once directly on the shared model; the registry never reloads it
+                vec = await get_embeddings().aembed_query(text)
                 return {"vector": vec, "dim": len(vec)}
             except Exception as e:
                 return {"error": str(e), "vector": [], "dim": 0}
+
+
+@app.get("/api/v1/embed/models")
+def embed_models():
+    return registry.stats()
+
+
+# One request may not hold the embedding thread pool for longer than this many texts take
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "256"))
+
+
+@app.post("/api/v1/embed/batch")
+@traceable
+async def embed_batch(payload: dict):
+    with otel_tracer.start_as_current_span("ai_service.embed_batch"):
+        texts = [str(t) for t in (payload.get("texts") or [])]
+        if not texts:
+            return {"vectors": [], "dim": 0}
+        if len(texts) > EMBED_BATCH_MAX:
+            raise HTTPException(status_code=413, detail=f"{len(texts)} texts exceed EMBED_BATCH_MAX={EMBED_BATCH_MAX}; split the batch")
+        try:
+            rag = await _arag()
+            vectors = await run_in_threadpool(rag.emb.embed_documents, texts)
+            return {"vectors": vectors, "dim": len(vectors[0]) if vectors else 0}
+        except Exception as e:
+            return {"error": str(e), "vectors": [], "dim": 0}
@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text with Llama-family tokenizers
+    return max(1, len(text or "") // 4)
+
+
+class ConversationWindow:
+    """Recent turns of one conversation kept within a token budget.
+
+    Turns that fall out of the window are folded into a short extractive
+    summary, itself capped, so the prompt never grows without bound.
+    """
+
+    def __init__(self, max_tokens: int, summary_tokens: int):
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.turns: List[Dict[str, Any]] = []
+        self.summary_lines: List[str] = []
+        self.tokens = 0
+        # Persisted messages this window accounts for: the stored count at load plus turns added since
+        self.seen = 0
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, role: str, content: str):
+        with self.lock:
+            self.seen += 1
+            tokens = estimate_tokens(content)
+            self.turns.append({"role": role, "content": content, "tokens": tokens})
+            self.tokens += tokens
+            while self.tokens > self.max_tokens and len(self.turns) > 1:
+                self._fold(self.turns.pop(0))
+
+    def _fold(self, turn: Dict[str, Any]):
+        self.tokens -= turn["tokens"]
+        who = "User" if turn["role"] == "user" else "Assistant"
+        first = (turn["content"] or "").strip().split("\n", 1)[0]
+        self.summary_lines.append(f"{who}: {first[:200]}")
+        while len(self.summary_lines) > 1 and sum(estimate_tokens(line) for line in self.summary_lines) > self.summary_tokens:
+            self.summary_lines.pop(0)
+
+    def digest(self, turns: int) -> Optional[str]:
+        """Hash of the last ``turns`` turns; ``None`` for a conversation with no history yet."""
+        with self.lock:
+            recent = self.turns[-turns:] if turns > 0 else []
+            if not recent and not self.summary_lines:
+                return None
+            h = hashlib.sha1()
+            for turn in recent:
+                h.update(f"{turn['role']}\x00{turn['content']}\x00".encode("utf-8"))
+            if not recent:
+                h.update("\n".join(self.summary_lines).encode("utf-8"))
+            return h.hexdigest()[:16]
+
+    def messages(self) -> List[Any]:
+        with self.lock:
+            out: List[Any] = []
+            if self.summary_lines:
+                out.append(SystemMessage(content="Summary of earlier conversation:\n" + "\n".join(self.summary_lines)))
+            for turn in self.turns:
+                cls = HumanMessage if turn["role"] == "user" else AIMessage
+                out.append(cls(content=turn["content"]))
+            return out
+
+
+class ConversationMemoryStore:
+    """Per-conversation memory, loaded lazily from persisted history and evicted when idle.
+
+    Windows are keyed by owner and ``conv_id``, and the loaders are given the
+    owner too, so a caller naming someone else's conversation gets no history.
+    With a ``counter``, each lookup compares the stored message count against
+    the cached window and reloads it when another replica has answered turns
+    this one has not seen.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str, Optional[str], int], List[Dict[str, Any]]],
+        aloader: Optional[Callable[[str, Optional[str], int], Awaitable[List[Dict[str, Any]]]]] = None,
+        counter: Optional[Callable[[str], int]] = None,
+        acounter: Optional[Callable[[str], Awaitable[int]]] = None,
+    ):
+        self.loader = loader
+        self.aloader = aloader
+        self.counter = counter
+        self.acounter = acounter
+        self.max_tokens = int(os.getenv("MEMORY_MAX_TOKENS", "1500"))
+        self.summary_tokens = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))
+        self.history_limit = int(os.getenv("MEMORY_HISTORY_LIMIT", "50"))
+        self.idle_seconds = float(os.getenv("MEMORY_IDLE_SECONDS", "1800"))
+        self.max_conversations = int(os.getenv("MEMORY_MAX_CONVERSATIONS", "5000"))
+        self._windows: "OrderedDict[Tuple[Optional[str], str], ConversationWindow]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._windows:
+            key, window = next(iter(self._windows.items()))
+            if window.last_used >= cutoff and len(self._windows) <= self.max_conversations:
+                break
+            self._windows.pop(key)
+
+    def _cached(self, key: Tuple[Optional[str], str], stored: Optional[int] = None) -> Optional[ConversationWindow]:
+        with self._lock:
+            self._evict()
+            window = self._windows.get(key)
+            if window is None or (stored is not None and stored > window.seen):
+                return None
+            window.last_used = time.monotonic()
+            self._windows.move_to_end(key)
+            return window
+
+    def _build(self, key: Tuple[Optional[str], str], history: List[Dict[str, Any]], stored: Optional[int] = None) -> ConversationWindow:
+        window = ConversationWindow(self.max_tokens, self.summary_tokens)
+        for m in history:
+            window.add("user" if m.get("sender") == "user" else "assistant", m.get("content") or "")
+        # The history may be capped at history_limit; the window still accounts for every stored message
+        window.seen = max(window.seen, stored or 0)
+        with self._lock:
+            # Another request may have loaded it meanwhile; keep whichever is current
+            existing = self._windows.get(key)
+            if existing is None or existing.seen < window.seen:
+                self._windows[key] = existing = window
+            self._windows.move_to_end(key)
+            return existing
+
+    def _load(self, conv_id: str, user_id: Optional[str]) -> List[Dict[str, Any]]:
+        try:
+            return self.loader(conv_id, user_id, self.history_limit)
+        except Exception:
+            return []
+
+    def _count(self, conv_id: str) -> Optional[int]:
+        if self.counter is None:
+            return None
+        try:
+            return self.counter(conv_id)
+        except Exception:
+            # Serve the cached window rather than fail the turn
+            return None
+
+    async def _acount(self, conv_id: str) -> Optional[int]:
+        if self.acounter is None:
+            return await asyncio.to_thread(self._count, conv_id) if self.counter is not None else None
+        try:
+            return await self.acounter(conv_id)
+        except Exception:
+            return None
+
+    def get(self, conv_id: Optional[str], user_id: Optional[str] = None) -> Optional[ConversationWindow]:
+        if not conv_id:
+            return None
+        key = (user_id, conv_id)
+        stored = self._count(conv_id)
+        return self._cached(key, stored) or self._build(key, self._load(conv_id, user_id), stored)
+
+    async def aget(self, conv_id: Optional[str], user_id: Optional[str] = None) -> Optional[ConversationWindow]:
+        if not conv_id:
+            return None
+        key = (user_id, conv_id)
+        stored = await self._acount(conv_id)
+        window = self._cached(key, stored)
+        if window is not None:
+            return window
+        if self.aloader is None:
+            history = await asyncio.to_thread(self._load, conv_id, user_id)
+        else:
+            try:
+                history = await self.aloader(conv_id, user_id, self.history_limit)
+            except Exception:
+                history = []
+        return self._build(key, history, stored)
@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from shared.logger import get_logger
+
+from .embedders import DEFAULT_EMBEDDING_BACKEND, DEFAULT_EMBEDDING_MODEL, Embedder, make_embedder
+
+logger = get_logger("ai_service.models")
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        try:
+            import resource
+            # ru_maxrss is the peak RSS in KiB on Linux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except Exception:
+            return 0
+
+
+class EmbeddingRegistry:
+    """Process-wide cache of embedders, one per (backend, model), each loaded once on first use."""
+
+    def __init__(self):
+        self._models: Dict[str, Any] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._model_locks: Dict[str, threading.Lock] = {}
+
+    def _load(self, backend: str, model_name: str) -> Embedder:
+        return make_embedder(backend, model_name)
+
+    def get(self, model_name: Optional[str] = None, backend: Optional[str] = None) -> Embedder:
+        model_name = model_name or os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+        backend = backend or os.getenv("EMBEDDING_BACKEND", DEFAULT_EMBEDDING_BACKEND)
+        name = f"{backend}:{model_name}"
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            model_lock = self._model_locks.setdefault(name, threading.Lock())
+        # Per-model lock: concurrent first callers wait for a single load
+        with model_lock:
+            model = self._models.get(name)
+            if model is not None:
+                return model
+            rss_before = _rss_bytes()
+            start = time.perf_counter()
+            model = self._load(backend, model_name)
+            load_seconds = time.perf_counter() - start
+            rss_delta = max(0, _rss_bytes() - rss_before)
+            self._stats[name] = {
+                "model": model_name,
+                "backend": backend,
+                "dim": model.dim,
+                "load_seconds": round(load_seconds, 3),
+                "rss_delta_bytes": rss_delta,
+                "loaded_at": time.time(),
+            }
+            self._models[name] = model
+            logger.info(f"embedding_model_loaded model={name} load_seconds={load_seconds:.2f} rss_delta_mb={rss_delta / 2**20:.1f}")
+            return model
+
+    def stats(self) -> Dict[str, Any]:
+        return {"models": list(self._stats.values()), "rss_bytes": _rss_bytes()}
+
+
+registry = EmbeddingRegistry()
+
+
+def get_embeddings(model_name: Optional[str] = None, backend: Optional[str] = None) -> Embedder:
+    return registry.get(model_name, backend)
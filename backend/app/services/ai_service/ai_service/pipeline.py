@@ -1,57 +1,107 @@
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, AsyncIterator
 import os
-from cachetools import LRUCache
 
-from langchain.schema import HumanMessage, AIMessage
-from langchain.memory import ConversationBufferMemory
-from langchain_community.chat_models import ChatOllama
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph
 
-from .rag import RAGStore
+from .llm import get_llm
+from .memory import ConversationMemoryStore, ConversationWindow
+from .prompt import Prompt, PromptAssembler
+from .rag import RAGStore, get_rag_store
+from .scheduler import get_scheduler
+from .semantic_cache import SemanticCache
 
 
 class ConversationState(dict):
     user_id: str
+    tenant_id: Optional[str]
     text: str
     conv_id: Optional[str]
+    priority: str
+    query_vector: Optional[List[float]]
+    cached: bool
+    cache_scope: Optional[str]
     context_docs: List[Dict[str, Any]]
     answer: Optional[str]
     sources: List[Dict[str, Any]]
 
 
 class ChatPipeline:
-    def __init__(self):
-        self.ollama_url = os.getenv("OLLAMA_URL", os.getenv("OLLAMA_HOST", "http://localhost:11434"))
-        self.ollama_model = os.getenv("OLLAMA_MODEL", "llama3.1")
-        self.memory = ConversationBufferMemory(return_messages=True)
-        self.llm = ChatOllama(base_url=self.ollama_url, model=self.ollama_model)
-        self.rag = RAGStore()
-        self.cache = LRUCache(maxsize=256)
+    def __init__(self, rag: Optional[RAGStore] = None):
+        # MODEL_BACKEND with LLM_FALLBACKS behind it; each backend caps its own in-flight generations
+        self.llm = get_llm()
+        # Admission control across all generations of this process; cache hits never queue
+        self.scheduler = get_scheduler()
+        self.rag = rag or get_rag_store()
+        # History is per conversation and token-bounded; nothing is shared across conv_ids
+        self.memory = ConversationMemoryStore(
+            loader=self.rag.get_history,
+            aloader=self.rag.aget_history,
+            counter=self.rag.count_history,
+            acounter=self.rag.acount_history,
+        )
+        self.cache = SemanticCache()
+        self.prompts = PromptAssembler()
+        # "user" keeps answers private to one user; "tenant" shares them within a tenant
+        self.cache_scope = os.getenv("SEMANTIC_CACHE_SCOPE", "user")
+        # A follow-up ("what about children?") means something else in every conversation,
+        # so answers given mid-conversation are keyed by the turns they follow
+        self.cache_context_turns = int(os.getenv("SEMANTIC_CACHE_CONTEXT_TURNS", "2"))
         self._build_graph()
 
-    def _retrieve(self, state: ConversationState) -> ConversationState:
-        docs = self.rag.search(state["text"], top_k=3)
+    def _scope(self, state: ConversationState, window: Optional[ConversationWindow]) -> str:
+        if self.cache_scope == "tenant":
+            scope = f"tenant:{state.get('tenant_id') or 'default'}"
+        else:
+            scope = f"user:{state.get('user_id') or 'anonymous'}"
+        context = window.digest(self.cache_context_turns) if window else None
+        return f"{scope}:ctx:{context}" if context else scope
+
+    async def _alookup(self, state: ConversationState) -> ConversationState:
+        window = await self.memory.aget(state.get("conv_id"), state.get("user_id"))
+        state["cache_scope"] = self._scope(state, window)
+        try:
+            state["query_vector"] = await self.rag.emb.aembed_query(state["text"])
+        except Exception:
+            state["query_vector"] = None
+        hit = await self.cache.alookup(state["cache_scope"], state["query_vector"])
+        if hit:
+            state["answer"] = hit.get("answer")
+            state["sources"] = hit.get("sources", [])
+            state["cached"] = True
+            # The turn happened even though the model did not run; the window must show it
+            self._remember(state, window, state["answer"] or "")
+        return state
+
+    def _route_after_lookup(self, state: ConversationState) -> str:
+        return "persist" if state.get("cached") else "retrieve"
+
+    async def _aretrieve(self, state: ConversationState) -> ConversationState:
+        docs = await self.rag.asearch(state["text"], top_k=3, vector=state.get("query_vector"), user_id=state.get("user_id") or "anonymous")
         state["context_docs"] = docs
         state["sources"] = docs
         return state
 
-    def _generate(self, state: ConversationState) -> ConversationState:
-        key = (state["text"], tuple(sorted([d.get("text", "")[:64] for d in state.get("context_docs", [])])))
-        if key in self.cache:
-            state["answer"] = self.cache[key]
-            return state
-        messages = []
-        for m in (self.memory.chat_memory.messages or []):
-            messages.append(m)
-        # System prompt with lightweight RAG context
-        context = "\n\n".join([d.get("text", "") for d in state.get("context_docs", [])])
-        prompt = f"You are a medical assistant. Use the following context if relevant:\n{context}\n\nUser: {state['text']}"
-        messages.append(HumanMessage(content=prompt))
-        resp = self.llm.invoke(messages)
-        answer = resp.content if hasattr(resp, "content") else str(resp)
-        self.memory.chat_memory.add_message(HumanMessage(content=state["text"]))
-        self.memory.chat_memory.add_message(AIMessage(content=answer))
-        self.cache[key] = answer
+    def _build_prompt(self, state: ConversationState, window: Optional[ConversationWindow]) -> Prompt:
+        prompt = self.prompts.build(state["text"], state.get("context_docs", []), window.messages() if window else [])
+        # Sources in the order the prompt numbers them, so [n] citations line up
+        state["sources"] = prompt.sources
+        return prompt
+
+    def _remember(self, state: ConversationState, window: Optional[ConversationWindow], answer: str) -> Dict[str, Any]:
+        if window:
+            window.add("user", state["text"])
+            window.add("assistant", answer)
+        return {"answer": answer, "sources": state.get("sources", [])}
+
+    async def _agenerate(self, state: ConversationState) -> ConversationState:
+        window = await self.memory.aget(state.get("conv_id"), state.get("user_id"))
+        prompt = self._build_prompt(state, window)
+        async with self.scheduler.slot(state.get("user_id"), state.get("priority") or "interactive"):
+            resp = await self.llm.agenerate(prompt.messages)
+        self.prompts.log(prompt, state.get("conv_id"), resp.prompt_tokens)
+        answer = resp.text
+        await self.cache.astore(state["cache_scope"], state.get("query_vector"), state["text"], self._remember(state, window, answer))
         state["answer"] = answer
         return state
 
@@ -61,23 +111,63 @@ class ChatPipeline:
 
     def _build_graph(self):
         g = StateGraph(ConversationState)
-        g.add_node("retrieve", self._retrieve)
-        g.add_node("generate", self._generate)
+        # Async only: generation must go through the scheduler and the backends' slots
+        g.add_node("lookup", RunnableLambda(self._alookup))
+        g.add_node("retrieve", RunnableLambda(self._aretrieve))
+        g.add_node("generate", RunnableLambda(self._agenerate))
         g.add_node("persist", self._persist)
-        g.set_entry_point("retrieve")
+        g.set_entry_point("lookup")
+        g.add_conditional_edges("lookup", self._route_after_lookup, {"retrieve": "retrieve", "persist": "persist"})
         g.add_edge("retrieve", "generate")
         g.add_edge("generate", "persist")
         self.graph = g.compile()
 
-    def run(self, user_id: str, text: str, conv_id: Optional[str] = None) -> Dict[str, Any]:
-        initial: ConversationState = {
+    def _initial_state(self, user_id: str, text: str, conv_id: Optional[str], tenant_id: Optional[str] = None, priority: str = "interactive") -> ConversationState:
+        return {
             "user_id": user_id,
+            "tenant_id": tenant_id,
             "text": text,
             "conv_id": conv_id,
+            "priority": priority,
+            "query_vector": None,
+            "cached": False,
+            "cache_scope": None,
             "context_docs": [],
             "answer": None,
             "sources": [],
         }
-        result = self.graph.invoke(initial)
-        return {"text": result.get("answer"), "sources": result.get("sources", [])}
 
+    async def arun(self, user_id: str, text: str, conv_id: Optional[str] = None, tenant_id: Optional[str] = None, priority: str = "interactive") -> Dict[str, Any]:
+        result = await self.graph.ainvoke(self._initial_state(user_id, text, conv_id, tenant_id, priority))
+        return {"text": result.get("answer"), "sources": result.get("sources", []), "cached": bool(result.get("cached"))}
+
+    async def astream(self, user_id: str, text: str, conv_id: Optional[str] = None, tenant_id: Optional[str] = None, priority: str = "interactive") -> AsyncIterator[Dict[str, Any]]:
+        """Yield ``sources``, then one ``token`` event per LLM chunk, then ``done``.
+
+        Mirrors the retrieve -> generate path of the graph, but forwards tokens
+        as the LLM backend produces them instead of waiting for the whole answer.
+        The scheduler slot is taken before the first event, so a rejection
+        (``Rejected``) surfaces before anything is streamed.
+        """
+        state = await self._alookup(self._initial_state(user_id, text, conv_id, tenant_id, priority))
+        if state.get("cached"):
+            yield {"type": "sources", "sources": state.get("sources", [])}
+            yield {"type": "token", "text": state.get("answer") or ""}
+            yield {"type": "done", "cached": True}
+            return
+        state = await self._aretrieve(state)
+        window = await self.memory.aget(conv_id, user_id)
+        prompt = self._build_prompt(state, window)
+        parts: List[str] = []
+        prompt_eval = None
+        async with self.scheduler.slot(user_id, priority):
+            yield {"type": "sources", "sources": state.get("sources", [])}
+            async for chunk in self.llm.astream(prompt.messages):
+                prompt_eval = chunk.prompt_tokens or prompt_eval
+                if not chunk.text:
+                    continue
+                parts.append(chunk.text)
+                yield {"type": "token", "text": chunk.text}
+        self.prompts.log(prompt, conv_id, prompt_eval)
+        await self.cache.astore(state["cache_scope"], state.get("query_vector"), state["text"], self._remember(state, window, "".join(parts)))
+        yield {"type": "done"}
@@ -0,0 +1,165 @@
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain.schema import HumanMessage, SystemMessage
+
+from shared.lexical import tokenize
+from shared.logger import get_logger
+
+from .memory import estimate_tokens
+
+logger = get_logger("ai_service.prompt")
+
+DEFAULT_SYSTEM_PROMPT = (
+    "You are a medical assistant. Answer from the numbered context passages when they are relevant "
+    "and cite them as [n]. If the context does not cover the question, say so and answer from general "
+    "medical knowledge, noting that the user should consult a clinician for personal advice."
+)
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+|\n+")
+
+
+def _norm(sentence: str) -> str:
+    return " ".join(sentence.lower().split())
+
+
+@dataclass
+class Prompt:
+    messages: List[Any]
+    # Estimated tokens per part: system, history, context, question
+    tokens: Dict[str, int]
+    docs_used: int = 0
+    sentences_dropped: int = 0
+    duplicates: int = 0
+    history_dropped: int = 0
+    sources: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return sum(self.tokens.values())
+
+
+class PromptAssembler:
+    """Builds the LLM messages for one turn within ``max_tokens``.
+
+    Messages go from most to least stable: the fixed system prompt, then the
+    conversation window (which only grows at its end between turns), then a
+    final user message holding this turn's context and question. Each turn's
+    prompt therefore shares its longest possible prefix with the previous
+    one, which Ollama reuses from its KV cache instead of prefilling again.
+
+    Context fills whatever the budget leaves (but at least
+    ``min_context_tokens``, dropping the oldest history if needed). Passages
+    are taken in retrieval order; sentences already included by an earlier,
+    overlapping chunk are skipped, and a passage too long for its share
+    keeps its sentences with the most query terms, in their original order.
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        min_context_tokens: Optional[int] = None,
+        max_context_tokens: Optional[int] = None,
+        system_prompt: Optional[str] = None,
+    ):
+        self.max_tokens = max_tokens or int(os.getenv("PROMPT_MAX_TOKENS", "3072"))
+        self.min_context_tokens = min_context_tokens if min_context_tokens is not None else int(os.getenv("PROMPT_MIN_CONTEXT_TOKENS", "512"))
+        self.max_context_tokens = max_context_tokens or int(os.getenv("PROMPT_MAX_CONTEXT_TOKENS", "1536"))
+        self.system_prompt = system_prompt or os.getenv("PROMPT_SYSTEM", DEFAULT_SYSTEM_PROMPT)
+        self.system_tokens = estimate_tokens(self.system_prompt)
+
+    @staticmethod
+    def _label(n: int, doc: Dict[str, Any]) -> str:
+        metadata = doc.get("metadata") or {}
+        where = " / ".join(str(v) for v in (os.path.basename(metadata.get("source") or ""), metadata.get("section")) if v)
+        return f"[{n}] {where}".rstrip()
+
+    def _trim(self, sentences: List[str], terms: set, budget: int) -> List[str]:
+        """The sentences that fit ``budget``, most query terms first, returned in document order."""
+        ranked = sorted(
+            range(len(sentences)),
+            key=lambda i: (-len(terms.intersection(tokenize(sentences[i]))), i),
+        )
+        keep, used = [], 0
+        for i in ranked:
+            tokens = estimate_tokens(sentences[i])
+            if used + tokens > budget:
+                continue
+            keep.append(i)
+            used += tokens
+        return [sentences[i] for i in sorted(keep)]
+
+    def _context(self, question: str, docs: Sequence[Dict[str, Any]], budget: int, prompt: Prompt) -> str:
+        terms = set(tokenize(question))
+        seen: set = set()
+        blocks: List[str] = []
+        used = 0
+        for rank, doc in enumerate(docs):
+            remaining = budget - used
+            if remaining <= 0:
+                break
+            sentences = []
+            for sentence in _SENTENCE_END.split(doc.get("text") or ""):
+                key = _norm(sentence)
+                if not key:
+                    continue
+                if key in seen:
+                    prompt.duplicates += 1
+                    continue
+                seen.add(key)
+                sentences.append(sentence.strip())
+            if not sentences:
+                continue
+            label = self._label(len(blocks) + 1, doc)
+            # Split what is left evenly over the passages still to come, so the top hit cannot take it all
+            share = max(remaining // (len(docs) - rank), min(remaining, 64)) - estimate_tokens(label)
+            kept = self._trim(sentences, terms, share)
+            prompt.sentences_dropped += len(sentences) - len(kept)
+            if not kept:
+                continue
+            block = label + "\n" + " ".join(kept)
+            blocks.append(block)
+            prompt.sources.append(doc)
+            used += estimate_tokens(block)
+        prompt.docs_used = len(blocks)
+        return "\n\n".join(blocks)
+
+    def build(self, question: str, docs: Sequence[Dict[str, Any]], history: Optional[List[Any]] = None) -> Prompt:
+        history = list(history or [])
+        question_tokens = estimate_tokens(question)
+        history_tokens = [estimate_tokens(m.content) for m in history]
+        prompt = Prompt(messages=[], tokens={})
+
+        fixed = self.system_tokens + question_tokens + 16
+        # Oldest turns give way first when history would squeeze context under its floor
+        while history and fixed + sum(history_tokens) + self.min_context_tokens > self.max_tokens:
+            history.pop(0)
+            history_tokens.pop(0)
+            prompt.history_dropped += 1
+            # Whole turns: never leave a reply without its question
+            while history and getattr(history[0], "type", None) == "ai":
+                history.pop(0)
+                history_tokens.pop(0)
+                prompt.history_dropped += 1
+        budget = max(0, min(self.max_context_tokens, self.max_tokens - fixed - sum(history_tokens)))
+        context = self._context(question, docs, budget, prompt) if docs and budget else ""
+
+        final = f"Context:\n{context}\n\nQuestion: {question}" if context else question
+        prompt.messages = [SystemMessage(content=self.system_prompt), *history, HumanMessage(content=final)]
+        prompt.tokens = {
+            "system": self.system_tokens,
+            "history": sum(history_tokens),
+            "context": estimate_tokens(context) if context else 0,
+            "question": question_tokens,
+        }
+        return prompt
+
+    def log(self, prompt: Prompt, conv_id: Optional[str] = None, prompt_eval: Optional[int] = None):
+        t = prompt.tokens
+        logger.info(
+            f"prompt_tokens conv={conv_id} total={prompt.total} system={t['system']} history={t['history']} "
+            f"context={t['context']} question={t['question']} docs={prompt.docs_used} "
+            f"duplicates={prompt.duplicates} sentences_dropped={prompt.sentences_dropped} "
+            f"history_dropped={prompt.history_dropped} prompt_eval={prompt_eval}"
+        )
@@ -1,76 +1,623 @@
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
+import asyncio
+import threading
 import os
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams
+from datetime import datetime, timezone
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.http.models import (
+    FieldCondition,
+    Filter,
+    MatchAny,
+    PointStruct,
+)
 
+import numpy as np
+from bson import ObjectId
+from bson.errors import InvalidId
 from langchain_community.vectorstores import Qdrant as LCQdrant
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from starlette.concurrency import run_in_threadpool
 
 from .security import encrypt_medical
-from shared.mongo import get_db
+from .models import get_embeddings
+from .local_index import get_local_index
+from .rerank import get_reranker
+from .lexical import get_lexical_index
+from shared.chunks import chunk_hash, chunk_point_id, collection_for, retrieval_owners
+from shared.config import settings
+from shared.lexical import LexicalStore, backfill_marker, changes_query, lexical_doc, lexical_update
+from shared.logger import get_logger
+from shared.mongo import get_db, get_async_db
+from shared.qdrant import EmbeddingDimensionMismatch, ensure_collection
+
+logger = get_logger("ai_service.rag")
+
+# off: Qdrant only; fallback: mirror into the local index and search it when Qdrant fails;
+# only: local index only (tests, CI, single-node dev)
+LOCAL_INDEX_MODES = ("off", "fallback", "only")
+QDRANT_TENANCIES = ("shared", "collection")
+# LangChain's MMR defaults: candidates fetched, relevance vs. diversity weight
+MMR_FETCH_K = 20
+MMR_LAMBDA = 0.5
+# mmr: diversity re-ranking of ANN hits; rerank: wide ANN fetch, then a cross-encoder
+RETRIEVAL_MODES = ("mmr", "rerank")
 
 
 class RAGStore:
     def __init__(self):
         self.mongo = get_db()
+        self._amongo = None
         self.qdrant_url = os.getenv("QDRANT_URL", "http://localhost:6333")
         self.collection = os.getenv("QDRANT_COLLECTION", "docs")
+        # shared: one collection, every search filtered on metadata.user_id;
+        # collection: one collection per owner, created on first write
+        self.tenancy = os.getenv("QDRANT_TENANCY", "shared")
+        if self.tenancy not in QDRANT_TENANCIES:
+            raise ValueError(f"unknown QDRANT_TENANCY {self.tenancy!r}; expected one of {', '.join(QDRANT_TENANCIES)}")
+        self._known_collections: set = set()
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", "mmr")
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"unknown RETRIEVAL_MODE {self.retrieval_mode!r}; expected one of {', '.join(RETRIEVAL_MODES)}")
+        self.rerank_candidates = int(os.getenv("RERANK_CANDIDATES", "30"))
+        self.reranker = get_reranker() if self.retrieval_mode == "rerank" else None
+        # Hybrid: BM25 over lexical_docs in parallel with a plain ANN query, fused by reciprocal rank
+        self.hybrid = os.getenv("HYBRID_SEARCH", "0") in ("1", "true", "True")
+        self.lexical = get_lexical_index() if self.hybrid else None
+        self.hybrid_vector_k = int(os.getenv("HYBRID_VECTOR_K", "10"))
+        self.hybrid_lexical_k = int(os.getenv("HYBRID_LEXICAL_K", "10"))
+        self.rrf_k = int(os.getenv("RRF_K", "60"))
+        # Longer than any poller can lag, or it would never see the delete
+        self.lexical_tombstone_ttl = float(os.getenv("LEXICAL_TOMBSTONE_TTL_SECONDS", str(7 * 86400)))
+        self._stores: Dict[str, LCQdrant] = {}
         self.emb_model = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
-        self._ensure_qdrant()
-        self.emb = HuggingFaceEmbeddings(model_name=self.emb_model)
-        self.vs = LCQdrant(
-            url=self.qdrant_url,
-            prefer_grpc=False,
-            collection_name=self.collection,
-            embeddings=self.emb,
-        )
+        self.client = QdrantClient(url=self.qdrant_url, prefer_grpc=False)
+        # Async client lets LangChain's Qdrant wrapper search without blocking the event loop
+        self.async_client = AsyncQdrantClient(url=self.qdrant_url, prefer_grpc=False)
+        self.emb = get_embeddings(self.emb_model)
+        self.local_mode = os.getenv("LOCAL_INDEX", "off")
+        if self.local_mode not in LOCAL_INDEX_MODES:
+            raise ValueError(f"unknown LOCAL_INDEX {self.local_mode!r}; expected one of {', '.join(LOCAL_INDEX_MODES)}")
+        self.local = get_local_index(self.emb.dim) if self.local_mode != "off" else None
+        if self.local_mode != "only":
+            self._ensure_qdrant()
+        self.vs = self._vs(self.collection)
+
+    def _vs(self, name: str) -> LCQdrant:
+        store = self._stores.get(name)
+        if store is None:
+            store = self._stores[name] = LCQdrant(
+                client=self.client,
+                async_client=self.async_client,
+                collection_name=name,
+                embeddings=self.emb,
+            )
+        return store
+
+    def _ensure_collection(self, name: str):
+        if name in self._known_collections:
+            return
+        source = f"embedding model {self.emb.model_name!r} ({self.emb.backend})"
+        if ensure_collection(self.client, name, self.emb.dim, self.tenancy, source) and settings.LEXICAL_INDEX:
+            # Born with lexical_docs for every point; nothing to backfill
+            self.mongo["lexical_backfills"].update_one(*backfill_marker(name), upsert=True)
+        self._known_collections.add(name)
 
     def _ensure_qdrant(self):
         try:
-            client = QdrantClient(url=self.qdrant_url)
-            collections = client.get_collections().collections
-            names = {c.name for c in collections}
-            if self.collection not in names:
-                client.create_collection(
-                    collection_name=self.collection,
-                    vectors_config=VectorParams(size=384, distance=Distance.COSINE),
-                )
+            self._ensure_collection(self.collection)
+        except EmbeddingDimensionMismatch:
+            raise
         except Exception:
-            pass
+            # Qdrant unreachable at startup; collections are made on first write instead
+            return
+
+    @property
+    def amongo(self):
+        # Motor database, resolved lazily inside the event loop
+        if self._amongo is None:
+            self._amongo = get_async_db()
+        return self._amongo
+
+    @staticmethod
+    def _medical_doc(user_id: str, content: str, metadata: Dict[str, Any] | None, digest: str) -> Dict[str, Any]:
+        return {
+            "user_id": user_id,
+            "data": encrypt_medical(content.encode("utf-8")),
+            "encrypted": True,
+            "content_hash": digest,
+            "metadata": metadata or {},
+        }
+
+    @staticmethod
+    def _point_metadata(user_id: str, metadata: Dict[str, Any] | None, doc_id: str, digest: str) -> Dict[str, Any]:
+        return {"user_id": user_id, **(metadata or {}), "doc_id": doc_id, "chunk_hash": digest}
+
+    def _index_point(self, collection: str, point_id: str, content: str, metadata: Dict[str, Any]):
+        # Embed once, then write the same point to Qdrant and the local index
+        vector = self.emb.embed_documents([content])[0]
+        payload = {"page_content": content, "metadata": metadata}
+        if self.local_mode != "only":
+            self.client.upsert(collection_name=collection, points=[PointStruct(id=point_id, vector=vector, payload=payload)])
+        self.local.add([point_id], [vector], [payload])
+
+    async def _aindex_point(self, collection: str, point_id: str, content: str, metadata: Dict[str, Any]):
+        vector = (await self.emb.aembed_documents([content]))[0]
+        payload = {"page_content": content, "metadata": metadata}
+        if self.local_mode != "only":
+            await self.async_client.upsert(collection_name=collection, points=[PointStruct(id=point_id, vector=vector, payload=payload)])
+        self.local.add([point_id], [vector], [payload])
+
+    def _lexical_point(self, collection: str, point_id: str, content: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        point = {"id": point_id, "payload": {"page_content": content, "metadata": metadata}}
+        if self.lexical is not None:
+            # Searchable here at once; other processes pick it up from lexical_docs
+            doc = lexical_doc(point, collection)
+            self.lexical.add(point_id, doc["terms"], doc["owner"], collection)
+        return point
+
+    async def astore_medical_doc(self, user_id: str, content: str, metadata: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        try:
+            digest = chunk_hash(content)
+            existing = await self.amongo["medical_data"].find_one({"user_id": user_id, "content_hash": digest}, {"_id": 1})
+            if existing:
+                return {"id": str(existing["_id"]), "duplicate": True}
+            res = await self.amongo["medical_data"].insert_one(self._medical_doc(user_id, content, metadata, digest))
+            doc_id = str(res.inserted_id)
+            point_metadata = self._point_metadata(user_id, metadata, doc_id, digest)
+            collection = collection_for(user_id, self.collection)
+            if self.local_mode != "only":
+                await run_in_threadpool(self._ensure_collection, collection)
+            point_id = chunk_point_id(user_id, digest)
+            if self.local is not None:
+                await self._aindex_point(collection, point_id, content, point_metadata)
+            else:
+                await self._vs(collection).aadd_texts([content], metadatas=[point_metadata], ids=[point_id])
+            point = self._lexical_point(collection, point_id, content, point_metadata)
+            if settings.LEXICAL_INDEX:
+                await LexicalStore(db=self.amongo).upsert([point], collection)
+            return {"id": doc_id}
+        except Exception as e:
+            return {"error": str(e)}
 
     def store_medical_doc(self, user_id: str, content: str, metadata: Dict[str, Any] | None = None) -> Dict[str, Any]:
         try:
-            b = content.encode("utf-8")
-            enc = encrypt_medical(b)
-            doc = {
-                "user_id": user_id,
-                "data": enc,
-                "encrypted": True,
-                "metadata": metadata or {},
-            }
-            res = self.mongo["medical_data"].insert_one(doc)
-            # index into qdrant for semantic search
-            self.vs.add_texts([content], metadatas=[{"user_id": user_id, **(metadata or {})}], ids=[str(res.inserted_id)])
-            return {"id": str(res.inserted_id)}
+            # Same content from the same user is stored and indexed once
+            digest = chunk_hash(content)
+            existing = self.mongo["medical_data"].find_one({"user_id": user_id, "content_hash": digest}, {"_id": 1})
+            if existing:
+                return {"id": str(existing["_id"]), "duplicate": True}
+            res = self.mongo["medical_data"].insert_one(self._medical_doc(user_id, content, metadata, digest))
+            doc_id = str(res.inserted_id)
+            # index into qdrant for semantic search; the point id is the content hash, so re-indexing overwrites
+            point_metadata = self._point_metadata(user_id, metadata, doc_id, digest)
+            collection = collection_for(user_id, self.collection)
+            if self.local_mode != "only":
+                self._ensure_collection(collection)
+            point_id = chunk_point_id(user_id, digest)
+            if self.local is not None:
+                self._index_point(collection, point_id, content, point_metadata)
+            else:
+                self._vs(collection).add_texts([content], metadatas=[point_metadata], ids=[point_id])
+            point = self._lexical_point(collection, point_id, content, point_metadata)
+            if settings.LEXICAL_INDEX:
+                self.mongo["lexical_docs"].update_one(*lexical_update(point, collection), upsert=True)
+            return {"id": doc_id}
         except Exception as e:
             return {"error": str(e)}
 
-    def search(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _mmr(vector: List[float], points, top_k: int) -> List[Dict[str, Any]]:
+        # Same re-ranking LangChain's MMR search applies, over candidates Qdrant already filtered
+        if not points:
+            return []
+        picked = maximal_marginal_relevance(np.asarray(vector), [p.vector for p in points], k=top_k, lambda_mult=MMR_LAMBDA)
+        return [
+            {"text": (points[i].payload or {}).get("page_content", ""), "metadata": (points[i].payload or {}).get("metadata", {})}
+            for i in picked
+        ]
+
+    def _scopes(self, user_id: Optional[str]) -> List[Tuple[str, Optional[Filter]]]:
+        """(collection, filter) pairs a search for ``user_id`` runs over; None means unscoped."""
+        if user_id is None:
+            return [(self.collection, None)]
+        owners = retrieval_owners(user_id)
+        if self.tenancy == "collection":
+            return [(collection_for(owner, self.collection), None) for owner in owners]
+        return [(self.collection, Filter(must=[FieldCondition(key="metadata.user_id", match=MatchAny(any=owners))]))]
+
+    def _exists(self, name: str) -> bool:
+        if name not in self._known_collections and self.client.collection_exists(name):
+            self._known_collections.add(name)
+        return name in self._known_collections
+
+    async def _aexists(self, name: str) -> bool:
+        if name not in self._known_collections and await self.async_client.collection_exists(name):
+            self._known_collections.add(name)
+        return name in self._known_collections
+
+    @staticmethod
+    def _merge(results: List[List[Dict[str, Any]]], top_k: int) -> List[Dict[str, Any]]:
+        # Interleave per-collection MMR results so the user's own documents lead
+        if len(results) == 1:
+            return results[0]
+        out: List[Dict[str, Any]] = []
+        for row in range(top_k):
+            for docs in results:
+                if row < len(docs):
+                    out.append(docs[row])
+        return out[:top_k]
+
+    def _local_search(self, query: str, top_k: int, vector: Optional[List[float]], user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        if self.local is None:
+            return []
         try:
-            retriever = self.vs.as_retriever(search_type="mmr", search_kwargs={"k": top_k})
-            docs = retriever.get_relevant_documents(query)
-            out: List[Dict[str, Any]] = []
-            for d in docs:
-                out.append({
-                    "text": getattr(d, "page_content", ""),
-                    "metadata": getattr(d, "metadata", {}),
-                })
-            return out
-        except Exception:
+            if vector is None:
+                vector = self.emb.embed_query(query)
+            owners = retrieval_owners(user_id) if user_id is not None else None
+            if self.retrieval_mode == "rerank":
+                candidates = self.local.search(vector, top_k=max(self.rerank_candidates, top_k), user_id=owners)
+                return self.reranker.rerank(query, candidates, top_k)
+            return self.local.search(vector, top_k=top_k, user_id=owners)
+        except Exception as e:
+            logger.error(f"local_index_search_error error={e}")
             return []
 
-    def get_history(self, conv_id: Optional[str]) -> List[Dict[str, Any]]:
-        if not conv_id:
+    @staticmethod
+    def _hits(points) -> List[Dict[str, Any]]:
+        out = []
+        for p in points:
+            metadata = dict((p.payload or {}).get("metadata", {}))
+            if getattr(p, "score", None) is not None:
+                metadata["score"] = p.score
+            out.append({"id": str(p.id), "text": (p.payload or {}).get("page_content", ""), "metadata": metadata})
+        return out
+
+    def _ann_merge(self, results: List[List[Any]], limit: int) -> List[Dict[str, Any]]:
+        # Plain ANN candidates from every scope, best first
+        points = sorted((p for points in results for p in points), key=lambda p: -p.score)
+        return self._hits(points[:limit])
+
+    def _query_kwargs(self, vector: List[float], flt: Optional[Filter], top_k: int) -> Dict[str, Any]:
+        if self.retrieval_mode == "rerank":
+            # First stage only needs ids and payloads; vectors stay in Qdrant
+            return {"query": vector, "query_filter": flt, "limit": max(self.rerank_candidates, top_k), "with_payload": True}
+        return {"query": vector, "query_filter": flt, "limit": max(MMR_FETCH_K, top_k), "with_payload": True, "with_vectors": True}
+
+    def _rank(self, query: str, vector: List[float], results: List[List[Any]], top_k: int) -> List[Dict[str, Any]]:
+        if self.retrieval_mode == "rerank":
+            return self.reranker.rerank(query, self._ann_merge(results, self.rerank_candidates), top_k)
+        return self._merge([self._mmr(vector, points, top_k) for points in results], top_k)
+
+    def search(self, query: str, top_k: int = 3, vector: Optional[List[float]] = None, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Documents ``user_id`` may see (all documents when None), ranked per ``RETRIEVAL_MODE``."""
+        if self.hybrid:
+            return self._hybrid_search(query, top_k, vector, user_id)
+        if self.local_mode == "only":
+            return self._local_search(query, top_k, vector, user_id)
+        try:
+            if vector is None:
+                vector = self.emb.embed_query(query)
+            results = []
+            for name, flt in self._scopes(user_id):
+                if self._exists(name):
+                    res = self.client.query_points(collection_name=name, **self._query_kwargs(vector, flt, top_k))
+                    results.append(res.points)
+            return self._rank(query, vector, results, top_k) if results else []
+        except Exception as e:
+            logger.warning(f"qdrant_search_error error={e} fallback={self.local is not None}")
+            return self._local_search(query, top_k, vector, user_id)
+
+    async def asearch(self, query: str, top_k: int = 3, vector: Optional[List[float]] = None, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        if self.hybrid:
+            return await self._ahybrid_search(query, top_k, vector, user_id)
+        if self.local_mode == "only":
+            return await run_in_threadpool(self._local_search, query, top_k, vector, user_id)
+        try:
+            if vector is None:
+                vector = await self.emb.aembed_query(query)
+            results = []
+            for name, flt in self._scopes(user_id):
+                if await self._aexists(name):
+                    res = await self.async_client.query_points(collection_name=name, **self._query_kwargs(vector, flt, top_k))
+                    results.append(res.points)
+            if not results:
+                return []
+            if self.retrieval_mode == "rerank":
+                # Cross-encoder scoring is CPU-bound; keep it off the event loop
+                return await run_in_threadpool(self._rank, query, vector, results, top_k)
+            return self._rank(query, vector, results, top_k)
+        except Exception as e:
+            logger.warning(f"qdrant_search_error error={e} fallback={self.local is not None}")
+            return await run_in_threadpool(self._local_search, query, top_k, vector, user_id)
+
+    # ------------------------------------------------------------- hybrid
+
+    def _lexical_refs(self, query: str, user_id: Optional[str]) -> List[Tuple[str, str, float]]:
+        owners = retrieval_owners(user_id) if user_id is not None else None
+        return self.lexical.search(query, self.hybrid_lexical_k, owners)
+
+    def _local_candidates(self, vector: List[float], user_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        if self.local is None:
             return []
-        return list(self.mongo["messages"].find({"conv_id": conv_id}, sort=[("_id", 1)]))
+        owners = retrieval_owners(user_id) if user_id is not None else None
+        return self.local.search(vector, top_k=limit, user_id=owners)
+
+    def _vector_candidates(self, vector: List[float], user_id: Optional[str]) -> List[Dict[str, Any]]:
+        if self.local_mode == "only":
+            return self._local_candidates(vector, user_id, self.hybrid_vector_k)
+        try:
+            results = [
+                self.client.query_points(collection_name=name, query=vector, query_filter=flt, limit=self.hybrid_vector_k, with_payload=True).points
+                for name, flt in self._scopes(user_id)
+                if self._exists(name)
+            ]
+            return self._ann_merge(results, self.hybrid_vector_k)
+        except Exception as e:
+            logger.warning(f"qdrant_search_error error={e} fallback={self.local is not None}")
+            return self._local_candidates(vector, user_id, self.hybrid_vector_k)
+
+    async def _avector_candidates(self, vector: List[float], user_id: Optional[str]) -> List[Dict[str, Any]]:
+        if self.local_mode == "only":
+            return await run_in_threadpool(self._local_candidates, vector, user_id, self.hybrid_vector_k)
+        try:
+            results = []
+            for name, flt in self._scopes(user_id):
+                if await self._aexists(name):
+                    res = await self.async_client.query_points(collection_name=name, query=vector, query_filter=flt, limit=self.hybrid_vector_k, with_payload=True)
+                    results.append(res.points)
+            return self._ann_merge(results, self.hybrid_vector_k)
+        except Exception as e:
+            logger.warning(f"qdrant_search_error error={e} fallback={self.local is not None}")
+            return await run_in_threadpool(self._local_candidates, vector, user_id, self.hybrid_vector_k)
+
+    def _missing_by_collection(self, refs, have: Dict[str, Dict[str, Any]]) -> Dict[str, List[str]]:
+        missing: Dict[str, List[str]] = {}
+        for point_id, collection, _ in refs:
+            if point_id not in have:
+                missing.setdefault(collection, []).append(point_id)
+        if missing and self.local is not None:
+            for hit in self.local.get([i for ids in missing.values() for i in ids]):
+                have[hit["id"]] = hit
+            missing = {c: [i for i in ids if i not in have] for c, ids in missing.items()}
+        return {c: ids for c, ids in missing.items() if ids}
+
+    def _fetch(self, refs, have: Dict[str, Dict[str, Any]]):
+        # Lexical-only hits need their text and metadata from the vector store
+        if self.local_mode == "only":
+            self._missing_by_collection(refs, have)
+            return
+        for collection, ids in self._missing_by_collection(refs, have).items():
+            for hit in self._hits(self.client.retrieve(collection_name=collection, ids=ids, with_payload=True)):
+                have[hit["id"]] = hit
+
+    async def _afetch(self, refs, have: Dict[str, Dict[str, Any]]):
+        if self.local_mode == "only":
+            self._missing_by_collection(refs, have)
+            return
+        for collection, ids in self._missing_by_collection(refs, have).items():
+            for hit in self._hits(await self.async_client.retrieve(collection_name=collection, ids=ids, with_payload=True)):
+                have[hit["id"]] = hit
+
+    def _fuse(self, query: str, dense: List[Dict[str, Any]], refs, have: Dict[str, Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+        """Reciprocal rank fusion: each list adds 1 / (RRF_K + rank) to a chunk's score."""
+        fused: Dict[str, float] = {}
+        for ranking in ([d["id"] for d in dense], [r[0] for r in refs]):
+            for rank, point_id in enumerate(ranking, start=1):
+                fused[point_id] = fused.get(point_id, 0.0) + 1.0 / (self.rrf_k + rank)
+        order = sorted((i for i in fused if i in have), key=lambda i: -fused[i])
+        docs = [{**have[i], "metadata": {**have[i]["metadata"], "rrf_score": fused[i]}} for i in order]
+        if self.retrieval_mode == "rerank":
+            return self.reranker.rerank(query, docs[: self.rerank_candidates], top_k)
+        return docs[:top_k]
+
+    def _hybrid_search(self, query: str, top_k: int, vector: Optional[List[float]], user_id: Optional[str]) -> List[Dict[str, Any]]:
+        if vector is None:
+            vector = self.emb.embed_query(query)
+        dense = self._vector_candidates(vector, user_id)
+        refs = self._lexical_refs(query, user_id)
+        have = {d["id"]: d for d in dense}
+        try:
+            self._fetch(refs, have)
+        except Exception as e:
+            logger.warning(f"lexical_fetch_error error={e}")
+        return self._fuse(query, dense, refs, have, top_k)
+
+    async def _ahybrid_search(self, query: str, top_k: int, vector: Optional[List[float]], user_id: Optional[str]) -> List[Dict[str, Any]]:
+        if vector is None:
+            vector = await self.emb.aembed_query(query)
+        # The BM25 lookup runs in a thread while the ANN query is in flight
+        dense, refs = await asyncio.gather(
+            self._avector_candidates(vector, user_id),
+            run_in_threadpool(self._lexical_refs, query, user_id),
+        )
+        have = {d["id"]: d for d in dense}
+        try:
+            await self._afetch(refs, have)
+        except Exception as e:
+            logger.warning(f"lexical_fetch_error error={e}")
+        if self.retrieval_mode == "rerank":
+            return await run_in_threadpool(self._fuse, query, dense, refs, have, top_k)
+        return self._fuse(query, dense, refs, have, top_k)
+
+    async def sync_lexical_index(self) -> int:
+        """Pull lexical_docs changes into the in-memory BM25 index."""
+        if self.lexical is None:
+            return 0
+        applied = await self.lexical.sync(LexicalStore(db=self.amongo))
+        if applied:
+            logger.info(f"lexical_index_synced applied={applied} docs={len(self.lexical)}")
+        return applied
+
+    def backfill_lexical(self, batch_size: int = 256) -> int:
+        """Write lexical_docs for points indexed before term statistics were recorded.
+
+        Each collection is scrolled once: a marker in ``lexical_backfills`` is
+        written when it finishes (or when the collection is created), so a
+        restart mid-way resumes with the collections not yet done.
+        """
+        if not settings.LEXICAL_INDEX or self.local_mode == "only":
+            return 0
+        markers = self.mongo["lexical_backfills"]
+        written = 0
+        for name in self._collection_names():
+            if markers.count_documents({"_id": name}, limit=1) or not self.client.collection_exists(name):
+                continue
+            docs, offset = 0, None
+            while True:
+                points, offset = self.client.scroll(collection_name=name, limit=batch_size, offset=offset, with_payload=True)
+                for p in points:
+                    self.mongo["lexical_docs"].update_one(*lexical_update({"id": str(p.id), "payload": p.payload or {}}, name), upsert=True)
+                docs += len(points)
+                if offset is None:
+                    break
+            markers.update_one(*backfill_marker(name, docs), upsert=True)
+            logger.info(f"lexical_backfill_done collection={name} docs={docs}")
+            written += docs
+        return written
+
+    async def purge_lexical_tombstones(self) -> int:
+        """Delete lexical_docs tombstones older than ``LEXICAL_TOMBSTONE_TTL_SECONDS``."""
+        purged = await LexicalStore(db=self.amongo).purge_tombstones(self.lexical_tombstone_ttl)
+        if purged:
+            logger.info(f"lexical_tombstones_purged docs={purged}")
+        return purged
+
+    def _collection_names(self) -> List[str]:
+        names = [self.collection]
+        if self.tenancy == "collection":
+            prefix = f"{self.collection}__"
+            names += [c.name for c in self.client.get_collections().collections if c.name.startswith(prefix)]
+        return names
+
+    def sync_local_index(self, batch_size: int = 256) -> int:
+        """Bring the local index up to date with Qdrant; returns how many points were applied.
+
+        Points written straight to Qdrant (chat_service ingestion, the worker)
+        only reach the local index this way. With lexical recording on, only
+        the points changed in ``lexical_docs`` since the last sync are fetched;
+        the first sync, one older than the tombstone TTL (deletes may have been
+        purged) or ``LEXICAL_INDEX=0`` scroll every point instead.
+        """
+        if self.local is None or self.local_mode == "only":
+            return 0
+        since = self.local.synced_at
+        if settings.LEXICAL_INDEX and since is not None:
+            age = datetime.now(timezone.utc) - (since if since.tzinfo else since.replace(tzinfo=timezone.utc))
+            if age.total_seconds() < self.lexical_tombstone_ttl:
+                return self._sync_local_changes(since, batch_size)
+        return self._sync_local_full(batch_size)
+
+    def _sync_local_changes(self, since: datetime, batch_size: int) -> int:
+        changed: Dict[str, List[str]] = {}
+        gone: List[str] = []
+        newest = since
+        # One lexical_docs row per point, holding its latest state
+        for doc in self.mongo["lexical_docs"].find(changes_query(since), {"collection": 1, "deleted": 1, "updated_at": 1}, sort=[("updated_at", 1)]):
+            newest = doc.get("updated_at") or newest
+            if doc.get("deleted") or not doc.get("collection"):
+                gone.append(doc["_id"])
+            else:
+                changed.setdefault(doc["collection"], []).append(doc["_id"])
+        for name, ids in changed.items():
+            for i in range(0, len(ids), batch_size):
+                batch = ids[i : i + batch_size]
+                points = self.client.retrieve(collection_name=name, ids=batch, with_payload=True, with_vectors=True)
+                found = {str(p.id) for p in points}
+                if points:
+                    self.local.add([str(p.id) for p in points], [p.vector for p in points], [p.payload or {} for p in points])
+                # Recorded but no longer in Qdrant
+                gone.extend(j for j in batch if j not in found)
+        self.local.delete(gone)
+        self.local.synced_at = newest
+        applied = sum(len(ids) for ids in changed.values()) + len(gone)
+        if applied:
+            logger.info(f"local_index_synced changes={applied} rows={len(self.local)}")
+        return applied
+
+    def _sync_local_full(self, batch_size: int) -> int:
+        # Taken before scrolling, so writes landing mid-scroll are picked up by the next incremental pass
+        newest = None
+        if settings.LEXICAL_INDEX:
+            last = self.mongo["lexical_docs"].find_one({}, {"updated_at": 1}, sort=[("updated_at", -1)])
+            newest = last.get("updated_at") if last else None
+        names = self._collection_names()
+        seen = set()
+        for name in names:
+            if not self.client.collection_exists(name):
+                continue
+            offset = None
+            while True:
+                points, offset = self.client.scroll(
+                    collection_name=name,
+                    limit=batch_size,
+                    offset=offset,
+                    with_payload=True,
+                    with_vectors=True,
+                )
+                if points:
+                    ids = [str(p.id) for p in points]
+                    self.local.add(ids, [p.vector for p in points], [p.payload or {} for p in points])
+                    seen.update(ids)
+                if offset is None:
+                    break
+        self.local.delete([i for i in self.local.ids() if i not in seen])
+        self.local.synced_at = newest
+        logger.info(f"local_index_synced collections={len(names)} rows={len(self.local)} full=1")
+        return len(seen)
+
+    def snapshot_local_index(self, path: Optional[str] = None):
+        path = path or os.getenv("LOCAL_INDEX_PATH", "")
+        if self.local is not None and path:
+            self.local.save(path)
+
+    @staticmethod
+    def _conversation_query(conv_id: str, user_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        try:
+            return {"_id": ObjectId(conv_id), "user_id": user_id}
+        except (InvalidId, TypeError):
+            return None
+
+    def get_history(self, conv_id: Optional[str], user_id: Optional[str] = None, limit: int = 0) -> List[Dict[str, Any]]:
+        """Messages of ``conv_id``, oldest first; empty unless ``user_id`` owns the conversation."""
+        query = self._conversation_query(conv_id, user_id) if conv_id and user_id else None
+        if query is None or self.mongo["conversations"].find_one(query, {"_id": 1}) is None:
+            return []
+        if not limit:
+            return list(self.mongo["messages"].find({"conv_id": conv_id}, sort=[("_id", 1)]))
+        # Most recent `limit` messages, returned oldest first
+        recent = list(self.mongo["messages"].find({"conv_id": conv_id}, sort=[("_id", -1)], limit=limit))
+        return recent[::-1]
+
+    async def aget_history(self, conv_id: Optional[str], user_id: Optional[str] = None, limit: int = 0) -> List[Dict[str, Any]]:
+        query = self._conversation_query(conv_id, user_id) if conv_id and user_id else None
+        if query is None or await self.amongo["conversations"].find_one(query, {"_id": 1}) is None:
+            return []
+        if not limit:
+            return await self.amongo["messages"].find({"conv_id": conv_id}, sort=[("_id", 1)]).to_list(length=None)
+        recent = await self.amongo["messages"].find({"conv_id": conv_id}, sort=[("_id", -1)], limit=limit).to_list(length=limit)
+        return recent[::-1]
+
+    def count_history(self, conv_id: str) -> int:
+        """Stored messages of ``conv_id`` (no owner check: it only tells a cached window it is stale)."""
+        return self.mongo["messages"].count_documents({"conv_id": conv_id})
+
+    async def acount_history(self, conv_id: str) -> int:
+        return await self.amongo["messages"].count_documents({"conv_id": conv_id})
+
+
+_rag_store: Optional[RAGStore] = None
+_rag_store_lock = threading.Lock()
+
+
+def get_rag_store(create: bool = True) -> Optional[RAGStore]:
+    """Process-wide store, so the endpoints and the pipeline share one embedder, client pool and index.
 
+    ``create=False`` returns None instead of building it (shutdown, status).
+    """
+    global _rag_store
+    if _rag_store is not None or not create:
+        return _rag_store
+    with _rag_store_lock:
+        if _rag_store is None:
+            _rag_store = RAGStore()
+        return _rag_store
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from shared.chunks import chunk_hash
+from shared.logger import get_logger
+
+logger = get_logger("ai_service.rerank")
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+# What to return when scoring would overrun the budget: the ANN order as-is,
+# or the candidates scored so far (reranked) ahead of the rest in ANN order
+BUDGET_FALLBACKS = ("ann", "partial")
+
+ScoreFn = Callable[[List[Tuple[str, str]]], Sequence[float]]
+
+
+def _query_key(query: str) -> str:
+    return hashlib.sha1(" ".join(query.lower().split()).encode("utf-8")).hexdigest()[:20]
+
+
+class ScoreCache:
+    """LRU of cross-encoder scores keyed by (query, chunk hash)."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[float]:
+        with self._lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+            return score
+
+    def put(self, key: Tuple[str, str], score: float):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._scores[key] = score
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.maxsize:
+                self._scores.popitem(last=False)
+
+
+class Reranker:
+    """Second retrieval stage: score (query, passage) pairs with a CPU cross-encoder.
+
+    Pairs are scored in batches of ``batch_size``; before each batch after
+    the first, the smoothed per-batch latency is checked against what is
+    left of ``budget_ms``, and scoring stops rather than overrun it. Scores are
+    cached per (query, chunk), so repeated questions over the same
+    documents skip the model entirely.
+    """
+
+    def __init__(
+        self,
+        score_fn: Optional[ScoreFn] = None,
+        model_name: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        budget_ms: Optional[float] = None,
+        on_budget: Optional[str] = None,
+        cache_size: Optional[int] = None,
+    ):
+        self.model_name = model_name or os.getenv("RERANK_MODEL", DEFAULT_RERANK_MODEL)
+        self.batch_size = max(1, batch_size or int(os.getenv("RERANK_BATCH_SIZE", "16")))
+        self.budget = (budget_ms if budget_ms is not None else float(os.getenv("RERANK_BUDGET_MS", "150"))) / 1000.0
+        self.on_budget = on_budget or os.getenv("RERANK_ON_BUDGET", "ann")
+        if self.on_budget not in BUDGET_FALLBACKS:
+            raise ValueError(f"unknown RERANK_ON_BUDGET {self.on_budget!r}; expected one of {', '.join(BUDGET_FALLBACKS)}")
+        self.cache = ScoreCache(cache_size if cache_size is not None else int(os.getenv("RERANK_CACHE_SIZE", "10000")))
+        self._score_fn = score_fn
+        self._load_lock = threading.Lock()
+        # Smoothed seconds per batch, used to predict whether the next one fits
+        self._batch_seconds: Optional[float] = None
+        self.stats = {"calls": 0, "cache_hits": 0, "scored": 0, "budget_exceeded": 0}
+
+    def _scorer(self) -> ScoreFn:
+        if self._score_fn is None:
+            with self._load_lock:
+                if self._score_fn is None:
+                    from sentence_transformers import CrossEncoder
+
+                    model = CrossEncoder(self.model_name, device="cpu", max_length=int(os.getenv("RERANK_MAX_LENGTH", "256")))
+                    self._score_fn = lambda pairs: model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+                    logger.info(f"rerank_model_loaded model={self.model_name}")
+        return self._score_fn
+
+    def warm(self):
+        """Load the cross-encoder and run it once, so the first query does not pay for either."""
+        self._scorer()([("warm-up", "warm-up")])
+
+    @staticmethod
+    def _doc_key(doc: Dict[str, Any]) -> str:
+        return (doc.get("metadata") or {}).get("chunk_hash") or chunk_hash(doc.get("text", ""))
+
+    def rerank(self, query: str, docs: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+        """``docs`` in ANN order; returns the ``top_k`` best by cross-encoder score."""
+        if len(docs) <= 1:
+            return docs[:top_k]
+        self.stats["calls"] += 1
+        qkey = _query_key(query)
+        scores: List[Optional[float]] = []
+        missing: List[int] = []
+        for i, doc in enumerate(docs):
+            score = self.cache.get((qkey, self._doc_key(doc)))
+            scores.append(score)
+            if score is None:
+                missing.append(i)
+        self.stats["cache_hits"] += len(docs) - len(missing)
+
+        scorer = self._scorer() if missing else None
+        start = time.perf_counter()
+        for b in range(0, len(missing), self.batch_size):
+            elapsed = time.perf_counter() - start
+            # The first batch always runs, so a slow estimate cannot starve reranking for good
+            if b and elapsed + (self._batch_seconds or 0.0) > self.budget:
+                self.stats["budget_exceeded"] += 1
+                logger.info(f"rerank_budget_exceeded scored={b} of={len(missing)} elapsed_ms={elapsed * 1000:.1f}")
+                if self.on_budget == "ann":
+                    return docs[:top_k]
+                break
+            batch = missing[b:b + self.batch_size]
+            t0 = time.perf_counter()
+            batch_scores = scorer([(query, docs[i].get("text", "")) for i in batch])
+            took = time.perf_counter() - t0
+            self._batch_seconds = took if self._batch_seconds is None else 0.8 * self._batch_seconds + 0.2 * took
+            for i, score in zip(batch, batch_scores):
+                scores[i] = float(score)
+                self.cache.put((qkey, self._doc_key(docs[i])), float(score))
+            self.stats["scored"] += len(batch)
+
+        # Unscored candidates (partial fallback) keep their ANN order after the scored ones
+        order = sorted(range(len(docs)), key=lambda i: (scores[i] is None, -(scores[i] or 0.0), i))
+        return [
+            {**docs[i], "metadata": {**(docs[i].get("metadata") or {}), "rerank_score": scores[i]}} if scores[i] is not None else docs[i]
+            for i in order[:top_k]
+        ]
+
+
+_reranker: Optional[Reranker] = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> Reranker:
+    """Process-wide reranker, so the cross-encoder and its score cache are loaded once."""
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = Reranker()
+        return _reranker
@@ -0,0 +1,227 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+
+from shared.logger import get_logger
+
+logger = get_logger("ai_service.scheduler")
+
+# Served in this order: a queued interactive request always goes before a background one
+PRIORITIES = ("interactive", "background")
+
+
+class Rejected(Exception):
+    """A request the scheduler will not run: 429 for a caller over its share, 503 for overload."""
+
+    def __init__(self, status: int, reason: str, retry_after: float):
+        super().__init__(f"{reason} (retry after {retry_after:.0f}s)")
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(self.retry_after)}
+
+
+class _Waiter:
+    __slots__ = ("user", "priority", "future", "enqueued")
+
+    def __init__(self, user: str, priority: str, future: asyncio.Future):
+        self.user = user
+        self.priority = priority
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class FairScheduler:
+    """Admission control in front of generation.
+
+    At most ``max_concurrency`` generations run at once. Waiting requests
+    are queued per priority class and, within a class, per user; a freed
+    slot goes to the next user in round-robin order, so one user's burst
+    cannot starve everyone else. A request is refused up front (429) when
+    its user already has ``max_queued_per_user`` waiting, or (503) when the
+    queue is full or the expected wait exceeds its class deadline; one that
+    is still queued at its deadline is dropped with 503. Refusals carry a
+    Retry-After derived from the current drain rate.
+
+    ``get_scheduler`` sizes ``max_concurrency`` to the LLM router's total
+    slots, so the primary backend can fill up and shed to its fallbacks
+    before anything queues here.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        max_queued_per_user: Optional[int] = None,
+        deadlines: Optional[Dict[str, float]] = None,
+    ):
+        self.max_concurrency = max(1, max_concurrency or int(os.getenv("SCHED_MAX_CONCURRENCY", "0")) or 4)
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("SCHED_MAX_QUEUE", "64"))
+        self.max_queued_per_user = max_queued_per_user or int(os.getenv("SCHED_MAX_QUEUED_PER_USER", "2"))
+        self.deadlines = deadlines or {
+            "interactive": float(os.getenv("SCHED_INTERACTIVE_DEADLINE_SECONDS", "20")),
+            "background": float(os.getenv("SCHED_BACKGROUND_DEADLINE_SECONDS", "120")),
+        }
+        self.running = 0
+        self._queues: Dict[str, "OrderedDict[str, Deque[_Waiter]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self._depth = {p: 0 for p in PRIORITIES}
+        # Smoothed seconds a generation holds its slot, for wait estimates
+        self._service_seconds: Optional[float] = None
+        self.metrics: Dict[str, Any] = {
+            "admitted": 0,
+            "completed": 0,
+            "rejected": {"user_limit": 0, "queue_full": 0, "predicted_wait": 0, "deadline": 0},
+            "wait_ms_avg": {p: 0.0 for p in PRIORITIES},
+            "wait_ms_max": {p: 0.0 for p in PRIORITIES},
+        }
+
+    # ------------------------------------------------------------- queueing
+
+    def depth(self, priority: Optional[str] = None) -> int:
+        return self._depth[priority] if priority else sum(self._depth.values())
+
+    def _ahead(self, priority: str) -> int:
+        # Requests a new arrival of this class would wait behind
+        return sum(self._depth[p] for p in PRIORITIES[: PRIORITIES.index(priority) + 1])
+
+    def expected_wait(self, priority: str) -> float:
+        # Nothing measured yet: no basis for refusing early, the deadline still applies
+        if self._service_seconds is None or (self.running < self.max_concurrency and not self.depth()):
+            return 0.0
+        return (self._ahead(priority) + 1) / self.max_concurrency * self._service_seconds
+
+    def _queued_for(self, user: str) -> int:
+        return sum(len(q.get(user, ())) for q in self._queues.values())
+
+    def _reject(self, status: int, reason: str, priority: str, retry_after: float) -> Rejected:
+        self.metrics["rejected"][reason] += 1
+        logger.warning(
+            f"sched_reject reason={reason} priority={priority} running={self.running} "
+            f"queued={self.depth()} retry_after={retry_after:.1f}"
+        )
+        return Rejected(status, reason, retry_after)
+
+    def _next(self) -> Optional[_Waiter]:
+        for priority in PRIORITIES:
+            users = self._queues[priority]
+            while users:
+                user, waiters = next(iter(users.items()))
+                waiter = waiters.popleft()
+                if waiters:
+                    users.move_to_end(user)
+                else:
+                    del users[user]
+                self._depth[priority] -= 1
+                if not waiter.future.done():
+                    return waiter
+        return None
+
+    def _remove(self, waiter: _Waiter):
+        users = self._queues[waiter.priority]
+        waiters = users.get(waiter.user)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            self._depth[waiter.priority] -= 1
+            if not waiters:
+                del users[waiter.user]
+
+    def _record_wait(self, priority: str, seconds: float):
+        ms = seconds * 1000
+        avg = self.metrics["wait_ms_avg"]
+        avg[priority] = ms if not avg[priority] else 0.9 * avg[priority] + 0.1 * ms
+        self.metrics["wait_ms_max"][priority] = max(self.metrics["wait_ms_max"][priority], ms)
+
+    # ---------------------------------------------------------------- slots
+
+    async def acquire(self, user: Optional[str], priority: str = "interactive"):
+        priority = priority if priority in PRIORITIES else "interactive"
+        user = user or "anonymous"
+        if self.running < self.max_concurrency and not self.depth():
+            self.running += 1
+            self.metrics["admitted"] += 1
+            self._record_wait(priority, 0.0)
+            return
+        if self._queued_for(user) >= self.max_queued_per_user:
+            raise self._reject(429, "user_limit", priority, self.expected_wait(priority))
+        if self.depth() >= self.max_queue:
+            raise self._reject(503, "queue_full", priority, self.expected_wait(priority))
+        deadline = self.deadlines.get(priority, self.deadlines["interactive"])
+        predicted = self.expected_wait(priority)
+        if predicted > deadline:
+            # Refuse now rather than make the caller wait out a deadline it cannot meet
+            raise self._reject(503, "predicted_wait", priority, predicted)
+
+        waiter = _Waiter(user, priority, asyncio.get_running_loop().create_future())
+        self._queues[priority].setdefault(user, deque()).append(waiter)
+        self._depth[priority] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), deadline)
+        except asyncio.TimeoutError:
+            # A slot granted just as the deadline hit is kept
+            if not waiter.future.done():
+                waiter.future.cancel()
+                self._remove(waiter)
+                raise self._reject(503, "deadline", priority, self.expected_wait(priority))
+        except asyncio.CancelledError:
+            # Hand on a slot granted to a caller that has gone away
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(None)
+            else:
+                waiter.future.cancel()
+                self._remove(waiter)
+            raise
+        self.metrics["admitted"] += 1
+        self._record_wait(priority, time.monotonic() - waiter.enqueued)
+
+    def release(self, held_seconds: Optional[float]):
+        if held_seconds is not None:
+            self.metrics["completed"] += 1
+            self._service_seconds = held_seconds if self._service_seconds is None else 0.8 * self._service_seconds + 0.2 * held_seconds
+        waiter = self._next()
+        if waiter is not None:
+            # The slot passes straight to the next waiter; ``running`` is unchanged
+            waiter.future.set_result(None)
+        else:
+            self.running -= 1
+
+    @asynccontextmanager
+    async def slot(self, user: Optional[str], priority: str = "interactive"):
+        await self.acquire(user, priority)
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - t0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "max_concurrency": self.max_concurrency,
+            "queued": {p: self._depth[p] for p in PRIORITIES},
+            "queued_users": {p: len(self._queues[p]) for p in PRIORITIES},
+            "service_ms_avg": round(self._service_seconds * 1000, 1) if self._service_seconds is not None else None,
+            **self.metrics,
+        }
+
+
+_scheduler: Optional[FairScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> FairScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            from .llm import get_llm
+
+            # SCHED_MAX_CONCURRENCY overrides; by default admit what the backends can hold between them
+            _scheduler = FairScheduler(max_concurrency=int(os.getenv("SCHED_MAX_CONCURRENCY", "0")) or get_llm().capacity)
+        return _scheduler
@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from shared.logger import get_logger
+
+logger = get_logger("ai_service.semantic_cache")
+
+# (key, vector, payload); a remote backend may leave the payload None until the best match is known
+Entry = Tuple[str, np.ndarray, Optional[Dict[str, Any]]]
+
+
+def _normalize(vector) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm else v
+
+
+def _entry_id(text: str) -> str:
+    return hashlib.sha1(" ".join(text.lower().split()).encode("utf-8")).hexdigest()[:20]
+
+
+class MemoryBackend:
+    """Per-process store: one LRU-ordered dict per scope, entries expire after ``ttl``."""
+
+    is_remote = False
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._scopes: Dict[str, "OrderedDict[str, Tuple[np.ndarray, Dict[str, Any], float]]"] = {}
+        self._lock = threading.Lock()
+
+    def candidates(self, scope: str) -> List[Entry]:
+        now = time.time()
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if not entries:
+                return []
+            for key in [k for k, (_, _, exp) in entries.items() if exp <= now]:
+                del entries[key]
+            return [(k, vec, payload) for k, (vec, payload, _) in entries.items()]
+
+    def touch(self, scope: str, key: str):
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries and key in entries:
+                entries.move_to_end(key)
+
+    def put(self, scope: str, key: str, vector: np.ndarray, payload: Dict[str, Any]):
+        with self._lock:
+            entries = self._scopes.setdefault(scope, OrderedDict())
+            entries[key] = (vector, payload, time.time() + self.ttl)
+            entries.move_to_end(key)
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+
+
+class RedisBackend:
+    """Shared store so every replica sees the same hits.
+
+    Each entry is a hash (vector bytes + JSON payload) with a TTL; a per-scope
+    sorted set scored by last access time provides LRU eviction. A lookup
+    only fetches the ``candidates`` most recently used entries of the scope,
+    so its cost does not grow with ``maxsize``.
+    """
+
+    is_remote = True
+
+    def __init__(self, client, maxsize: int, ttl: float, prefix: str = "semcache", candidates: int = 64):
+        self.client = client
+        self.maxsize = maxsize
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self.candidates_limit = max(1, min(candidates, maxsize))
+
+    def _index(self, scope: str) -> str:
+        return f"{self.prefix}:{scope}:idx"
+
+    def _key(self, scope: str, key: str) -> str:
+        return f"{self.prefix}:{scope}:{key}"
+
+    def candidates(self, scope: str) -> List[Entry]:
+        ids = [i.decode() if isinstance(i, bytes) else i for i in self.client.zrevrange(self._index(scope), 0, self.candidates_limit - 1)]
+        if not ids:
+            return []
+        pipe = self.client.pipeline()
+        for key in ids:
+            # Vectors only; the payload is fetched for the winner alone
+            pipe.hget(self._key(scope, key), "v")
+        out: List[Entry] = []
+        stale = []
+        for key, raw in zip(ids, pipe.execute()):
+            if not raw:
+                stale.append(key)
+                continue
+            out.append((key, np.frombuffer(raw, dtype=np.float32), None))
+        if stale:
+            self.client.zrem(self._index(scope), *stale)
+        return out
+
+    def touch(self, scope: str, key: str):
+        pipe = self.client.pipeline()
+        pipe.zadd(self._index(scope), {key: time.time()})
+        pipe.expire(self._key(scope, key), self.ttl)
+        pipe.execute()
+
+    def payload(self, scope: str, key: str) -> Optional[Dict[str, Any]]:
+        raw = self.client.hget(self._key(scope, key), "p")
+        return json.loads(raw) if raw else None
+
+    def put(self, scope: str, key: str, vector: np.ndarray, payload: Dict[str, Any]):
+        index = self._index(scope)
+        pipe = self.client.pipeline()
+        pipe.hset(self._key(scope, key), mapping={"v": vector.astype(np.float32).tobytes(), "p": json.dumps(payload, default=str)})
+        pipe.expire(self._key(scope, key), self.ttl)
+        pipe.zadd(index, {key: time.time()})
+        pipe.expire(index, self.ttl)
+        pipe.execute()
+        overflow = self.client.zcard(index) - self.maxsize
+        if overflow > 0:
+            evicted = self.client.zpopmin(index, overflow)
+            keys = [self._key(scope, k.decode() if isinstance(k, bytes) else k) for k, _ in evicted]
+            if keys:
+                self.client.delete(*keys)
+
+
+def _make_backend(url: str, maxsize: int, ttl: float, candidates: int):
+    if not url:
+        return MemoryBackend(maxsize, ttl)
+    try:
+        if url.startswith("fakeredis://"):
+            import fakeredis
+            client = fakeredis.FakeRedis()
+        else:
+            import redis
+            client = redis.Redis.from_url(url)
+        return RedisBackend(client, maxsize, ttl, candidates=candidates)
+    except Exception as e:
+        logger.warning(f"semantic_cache_redis_unavailable url={url} error={e}; using in-process cache")
+        return MemoryBackend(maxsize, ttl)
+
+
+class SemanticCache:
+    """Answer cache looked up by query-embedding cosine similarity within a scope."""
+
+    def __init__(self, backend=None, threshold: Optional[float] = None):
+        self.threshold = threshold if threshold is not None else float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+        self.backend = backend or _make_backend(
+            os.getenv("SEMANTIC_CACHE_URL", ""),
+            int(os.getenv("SEMANTIC_CACHE_MAXSIZE", "512")),
+            float(os.getenv("SEMANTIC_CACHE_TTL", "3600")),
+            int(os.getenv("SEMANTIC_CACHE_CANDIDATES", "64")),
+        )
+
+    def lookup(self, scope: str, vector) -> Optional[Dict[str, Any]]:
+        if vector is None:
+            return None
+        try:
+            entries = self.backend.candidates(scope)
+            if not entries:
+                return None
+            q = _normalize(vector)
+            matrix = np.stack([vec for _, vec, _ in entries])
+            scores = matrix @ q
+            best = int(np.argmax(scores))
+            if float(scores[best]) < self.threshold:
+                return None
+            key, _, payload = entries[best]
+            if payload is None:
+                payload = self.backend.payload(scope, key)
+                if payload is None:
+                    return None
+            self.backend.touch(scope, key)
+            return payload
+        except Exception as e:
+            logger.warning(f"semantic_cache_lookup_error error={e}")
+            return None
+
+    def store(self, scope: str, vector, text: str, payload: Dict[str, Any]):
+        if vector is None:
+            return
+        try:
+            self.backend.put(scope, _entry_id(text), _normalize(vector), payload)
+        except Exception as e:
+            logger.warning(f"semantic_cache_store_error error={e}")
+
+    async def alookup(self, scope: str, vector) -> Optional[Dict[str, Any]]:
+        if self.backend.is_remote:
+            return await asyncio.to_thread(self.lookup, scope, vector)
+        return self.lookup(scope, vector)
+
+    async def astore(self, scope: str, vector, text: str, payload: Dict[str, Any]):
+        if self.backend.is_remote:
+            return await asyncio.to_thread(self.store, scope, vector, text, payload)
+        return self.store(scope, vector, text, payload)
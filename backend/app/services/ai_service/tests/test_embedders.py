@@ -0,0 +1,49 @@
+import json
+
+import numpy as np
+import pytest
+
+from ai_service.embedders import OnnxEmbedder, pool
+
+
+def _model_dir(tmp_path, modules, pooling=None):
+    (tmp_path / "modules.json").write_text(json.dumps(modules))
+    if pooling is not None:
+        (tmp_path / "1_Pooling").mkdir()
+        (tmp_path / "1_Pooling" / "config.json").write_text(json.dumps(pooling))
+    return str(tmp_path)
+
+
+def test_pooling_follows_the_sentence_transformers_modules(tmp_path):
+    model = _model_dir(
+        tmp_path,
+        [
+            {"idx": 0, "name": "0", "path": "", "type": "sentence_transformers.models.Transformer"},
+            {"idx": 1, "name": "1", "path": "1_Pooling", "type": "sentence_transformers.models.Pooling"},
+        ],
+        {"word_embedding_dimension": 4, "pooling_mode_cls_token": True, "pooling_mode_mean_tokens": False},
+    )
+    assert OnnxEmbedder._pooling(model) == ("cls", False)
+
+
+def test_pooling_defaults_to_normalised_mean(tmp_path):
+    assert OnnxEmbedder._pooling(str(tmp_path)) == ("mean", True)
+
+
+def test_unsupported_pooling_is_refused(tmp_path):
+    model = _model_dir(
+        tmp_path,
+        [{"idx": 1, "name": "1", "path": "1_Pooling", "type": "sentence_transformers.models.Pooling"}],
+        {"pooling_mode_weightedmean_tokens": True},
+    )
+    with pytest.raises(ValueError):
+        OnnxEmbedder._pooling(model)
+
+
+def test_pool_ignores_padding():
+    hidden = np.array([[[1.0, 0.0], [3.0, 4.0], [100.0, 100.0]]])
+    mask = np.array([[1, 1, 0]])
+    assert pool(hidden, mask, "mean", normalize=False).tolist() == [[2.0, 2.0]]
+    assert pool(hidden, mask, "max", normalize=False).tolist() == [[3.0, 4.0]]
+    assert pool(hidden, mask, "cls", normalize=False).tolist() == [[1.0, 0.0]]
+    assert np.allclose(np.linalg.norm(pool(hidden, mask, "mean"), axis=1), 1.0)
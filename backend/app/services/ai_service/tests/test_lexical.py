@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+from ai_service.lexical import BM25Index
+from ai_service.rag import RAGStore
+from shared.lexical import LexicalStore, lexical_doc, tokenize
+
+
+def _add(index, point_id, text, owner="u1", collection="docs"):
+    doc = lexical_doc({"id": point_id, "payload": {"page_content": text, "metadata": {"user_id": owner}}}, collection)
+    index.add(point_id, doc["terms"], doc["owner"], collection)
+
+
+def test_tokenizer_keeps_codes_and_doses_whole():
+    assert tokenize("E11.9 on 500mg co-amoxiclav 5/325") == ["e11.9", "500mg", "co-amoxiclav", "5/325"]
+
+
+def test_bm25_ranks_rare_terms_and_filters_owners():
+    index = BM25Index()
+    _add(index, "a", "metformin dosing in type 2 diabetes, code E11.9")
+    _add(index, "b", "diabetes diet advice and exercise for diabetes")
+    _add(index, "c", "metformin and E11.9 for another patient", owner="u2")
+    hits = index.search("E11.9 metformin", 3)
+    assert {h[0] for h in hits} == {"a", "c"}
+    assert [h[0] for h in index.search("E11.9 diabetes", 3, owners=["u1"])] == ["a", "b"]
+    assert index.search("E11.9", 3, owners=["nobody"]) == []
+
+
+def test_bm25_replace_delete_and_compaction():
+    index = BM25Index()
+    _add(index, "a", "aspirin")
+    _add(index, "a", "ibuprofen")
+    assert len(index) == 1 and index.search("aspirin", 5) == []
+    for i in range(1100):
+        _add(index, f"x{i}", "paracetamol")
+    for i in range(1100):
+        index.delete(f"x{i}")
+    # Past the tombstone threshold the arrays are rebuilt without the dead rows
+    assert len(index) == 1 and len(index._ids) < 100
+    assert [h[0] for h in index.search("ibuprofen", 5)] == ["a"]
+
+
+def test_rrf_fuses_both_rankings():
+    rag = RAGStore.__new__(RAGStore)
+    rag.rrf_k, rag.retrieval_mode = 60, "mmr"
+    have = {i: {"id": i, "text": i, "metadata": {}} for i in "abcd"}
+    dense = [have["a"], have["b"], have["c"]]
+    refs = [("c", "docs", 9.0), ("d", "docs", 5.0), ("a", "docs", 1.0)]
+    fused = rag._fuse("q", dense, refs, have, 4)
+    # a: 1/61 + 1/63, c: 1/63 + 1/61, b: 1/62, d: 1/62
+    assert {d["id"] for d in fused[:2]} == {"a", "c"}
+    assert fused[0]["metadata"]["rrf_score"] == 1 / 61 + 1 / 63
+    assert rag._fuse("q", dense, refs + [("z", "docs", 0.1)], have, 10)[-1]["id"] != "z"
+
+
+def test_sync_applies_changes_and_old_tombstones_are_purged():
+    async def run():
+        store = LexicalStore(db=AsyncMongoMockClient()["test"])
+        index = BM25Index()
+        await store.upsert([{"id": p, "payload": {"page_content": "warfarin", "metadata": {"user_id": "u1"}}} for p in ("a", "b")], "docs")
+        first = await index.sync(store)
+        await store.delete(["a"])
+        await index.sync(store)
+        fresh = await store.purge_tombstones(3600)
+        await store.docs.update_one({"_id": "a"}, {"$set": {"updated_at": datetime.now(timezone.utc) - timedelta(days=8)}})
+        old = await store.purge_tombstones(7 * 86400)
+        return first, index, fresh, old, await store.docs.count_documents({})
+
+    first, index, fresh, old, remaining = asyncio.run(run())
+    assert first == 2 and [h[0] for h in index.search("warfarin", 5)] == ["b"]
+    assert (fresh, old, remaining) == (0, 1, 1)
+
+
+class _Point:
+    def __init__(self, point_id, owner):
+        self.id, self.payload = point_id, {"page_content": "statin", "metadata": {"user_id": owner}}
+
+
+class _Qdrant:
+    def __init__(self, collections):
+        self.collections, self.scrolled = collections, []
+
+    def collection_exists(self, name):
+        return name in self.collections
+
+    def scroll(self, collection_name, limit, offset, with_payload):
+        self.scrolled.append(collection_name)
+        return self.collections[collection_name], None
+
+
+def test_backfill_runs_once_per_collection():
+    import mongomock
+
+    rag = RAGStore.__new__(RAGStore)
+    rag.mongo, rag.local_mode = mongomock.MongoClient()["test"], "off"
+    rag.client = _Qdrant({"docs": [_Point("p1", "u1")], "docs__u2": [_Point("p2", "u2")]})
+    rag._collection_names = lambda: list(rag.client.collections)
+    # Something already in lexical_docs must not stop collections without a marker
+    rag.mongo["lexical_docs"].insert_one({"_id": "other", "deleted": False})
+    rag.mongo["lexical_backfills"].insert_one({"_id": "docs__u2", "docs": 0})
+    assert rag.backfill_lexical() == 1
+    assert rag.backfill_lexical() == 0
+    assert rag.client.scrolled == ["docs"]
+    assert rag.mongo["lexical_docs"].find_one({"_id": "p1"})["owner"] == "u1"
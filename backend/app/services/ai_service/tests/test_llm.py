@@ -0,0 +1,59 @@
+import asyncio
+
+from ai_service.llm import LLMRouter, StubBackend
+
+
+class _HeldBackend(StubBackend):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.release = asyncio.Event()
+        self.calls = 0
+        self.cancelled = 0
+
+    async def complete(self, messages):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return await super().complete(messages)
+
+
+PROMPT = [{"role": "user", "content": "dose?"}]
+
+
+def test_first_caller_cancelling_does_not_cancel_joined_callers():
+    async def run():
+        backend = _HeldBackend("primary", "m", max_concurrency=1)
+        router = LLMRouter([backend])
+        first = asyncio.create_task(router.agenerate(PROMPT))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(router.agenerate(PROMPT))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        backend.release.set()
+        result = await second
+        return first.cancelled(), result.backend, backend, router
+
+    first_cancelled, answered_by, backend, router = asyncio.run(run())
+    assert first_cancelled and answered_by == "primary"
+    assert (backend.calls, backend.cancelled) == (1, 0)
+    assert router.stats_counters["coalesced"] == 1 and not router._completions
+
+
+def test_shared_call_is_cancelled_when_every_caller_leaves():
+    async def run():
+        backend = _HeldBackend("primary", "m", max_concurrency=1)
+        router = LLMRouter([backend])
+        callers = [asyncio.create_task(router.agenerate(PROMPT)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.sleep(0.01)
+        return backend, router
+
+    backend, router = asyncio.run(run())
+    assert (backend.calls, backend.cancelled) == (1, 1)
+    assert not router._completions and backend.slots._value == 1
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+from ai_service.local_index import LocalVectorIndex
+
+
+def _payload(i, owner):
+    return {"page_content": f"chunk {i}", "metadata": {"user_id": owner, "source": f"s{i}"}}
+
+
+def _filled(mode, n=200, dim=8):
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(n, dim)).astype(np.float32)
+    index = LocalVectorIndex(dim, mode=mode, nlist=4, nprobe=4)
+    index.add([f"p{i}" for i in range(n)], vectors, [_payload(i, "u1" if i % 2 else "u2") for i in range(n)])
+    return index, vectors
+
+
+@pytest.mark.parametrize("mode", ["flat", "ivf"])
+def test_add_replace_and_search(mode):
+    index, vectors = _filled(mode)
+    assert len(index) == 200
+    hit = index.search(vectors[7], top_k=1)[0]
+    assert hit["id"] == "p7" and hit["text"] == "chunk 7" and hit["metadata"]["score"] == pytest.approx(1.0, abs=1e-5)
+    # Same id again replaces the row rather than adding one
+    index.add(["p7"], [vectors[8]], [_payload(7, "u1")])
+    assert len(index) == 200
+    assert {h["id"] for h in index.search(vectors[8], top_k=2)} == {"p7", "p8"}
+
+
+@pytest.mark.parametrize("mode", ["flat", "ivf"])
+def test_delete_keeps_remaining_rows_addressable(mode):
+    index, vectors = _filled(mode)
+    index.delete(["p0", "p5", "missing"])
+    assert len(index) == 198 and "p0" not in index.ids()
+    assert index.search(vectors[0], top_k=1)[0]["id"] != "p0"
+    # p199 was moved into a hole; it must still resolve to its own vector and payload
+    assert index.search(vectors[199], top_k=1)[0]["id"] == "p199"
+    assert [h["id"] for h in index.get(["p199", "p5"])] == ["p199"]
+
+
+@pytest.mark.parametrize("mode", ["flat", "ivf"])
+def test_owner_filter(mode):
+    index, vectors = _filled(mode)
+    assert {h["metadata"]["user_id"] for h in index.search(vectors[3], top_k=20, user_id="u2")} == {"u2"}
+    assert index.search(vectors[3], top_k=20, user_id="nobody") == []
+    both = index.search(vectors[3], top_k=5, user_id=["u1", "u2"])
+    assert both[0]["id"] == "p3"
+
+
+@pytest.mark.parametrize("mode", ["flat", "ivf"])
+def test_snapshot_round_trip(mode, tmp_path):
+    from datetime import datetime
+
+    index, vectors = _filled(mode)
+    index.delete(["p1"])
+    index.synced_at = datetime(2026, 1, 2, 3, 4, 5)
+    index.save(str(tmp_path))
+    loaded = LocalVectorIndex.load(str(tmp_path))
+    assert loaded.mode == mode and loaded.synced_at == index.synced_at
+    assert sorted(loaded.ids()) == sorted(index.ids())
+    before, after = (i.search(vectors[10], top_k=3, user_id="u2") for i in (index, loaded))
+    assert [h["id"] for h in after] == [h["id"] for h in before]
+    assert after[0]["metadata"]["score"] == pytest.approx(before[0]["metadata"]["score"], abs=1e-5)
+    # Writes to a memory-mapped snapshot copy it first
+    loaded.add(["new"], [vectors[1]], [_payload(1, "u1")])
+    loaded.delete(["p2"])
+    assert loaded.search(vectors[1], top_k=1)[0]["id"] == "new"
+
+
+class _Point:
+    def __init__(self, point_id, vector, owner="u1"):
+        self.id, self.vector, self.payload = point_id, vector, _payload(point_id, owner)
+
+
+class _Qdrant:
+    def __init__(self, points):
+        self.points, self.scrolls, self.retrieved = dict(points), 0, []
+
+    def collection_exists(self, name):
+        return True
+
+    def scroll(self, collection_name, limit, offset, with_payload, with_vectors):
+        self.scrolls += 1
+        return list(self.points.values()), None
+
+    def retrieve(self, collection_name, ids, with_payload, with_vectors):
+        self.retrieved.extend(ids)
+        return [self.points[i] for i in ids if i in self.points]
+
+
+def test_sync_is_incremental_after_the_first_pass():
+    import mongomock
+
+    from ai_service.rag import RAGStore
+    from shared.lexical import lexical_update
+
+    rag = RAGStore.__new__(RAGStore)
+    rag.mongo, rag.local_mode, rag.lexical_tombstone_ttl = mongomock.MongoClient()["test"], "fallback", 3600.0
+    rag.local = LocalVectorIndex(2)
+    rag._collection_names = lambda: ["docs"]
+    rag.client = _Qdrant({i: _Point(i, [1.0, float(n)]) for n, i in enumerate(["a", "b", "c"])})
+
+    def record(point_id, deleted=False):
+        flt, update = lexical_update({"id": point_id, "payload": {}}, "docs")
+        update["$set"]["deleted"] = deleted
+        rag.mongo["lexical_docs"].update_one(flt, update, upsert=True)
+
+    for i in "abc":
+        record(i)
+    assert rag.sync_local_index() == 3 and rag.client.scrolls == 1
+    assert rag.local.synced_at is not None
+    rag.client.points["d"] = _Point("d", [0.0, 1.0], owner="u2")
+    record("d")
+    del rag.client.points["b"]
+    record("b", deleted=True)
+    rag.client.retrieved.clear()
+    rag.sync_local_index()
+    # No second scroll; only the changed points (plus the overlap window) were fetched
+    assert rag.client.scrolls == 1
+    assert "d" in rag.client.retrieved and "b" not in rag.client.retrieved
+    assert sorted(rag.local.ids()) == ["a", "c", "d"]
+    # A sync older than the tombstone TTL may have missed purged deletes: scroll again
+    rag.lexical_tombstone_ttl = 0
+    rag.sync_local_index()
+    assert rag.client.scrolls == 2
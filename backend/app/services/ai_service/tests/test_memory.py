@@ -0,0 +1,86 @@
+import asyncio
+
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+from ai_service.memory import ConversationMemoryStore, ConversationWindow
+
+
+def test_window_folds_oldest_turns_into_capped_summary():
+    window = ConversationWindow(max_tokens=100, summary_tokens=20)
+    for i in range(6):
+        window.add("user", f"question {i}\n" + "q" * 120)
+        window.add("assistant", f"answer {i}\n" + "a" * 120)
+    assert window.tokens <= 100
+    messages = window.messages()
+    summary = messages[0]
+    assert isinstance(summary, SystemMessage) and summary.content.startswith("Summary of earlier conversation:")
+    # Only the first line of each folded turn, newest ones kept within the summary cap
+    kept = [m.content.split("\n")[0] for m in messages[1:]]
+    assert kept == ["answer 4", "question 5", "answer 5"]
+    assert summary.content.endswith("User: question 4") and "question 0" not in summary.content
+    assert "q" * 120 not in summary.content
+    assert [type(m) for m in messages[1:]] == [AIMessage, HumanMessage, AIMessage]
+
+
+def test_window_always_keeps_the_latest_turn():
+    window = ConversationWindow(max_tokens=10, summary_tokens=50)
+    window.add("user", "x" * 400)
+    assert len(window.turns) == 1 and window.summary_lines == []
+
+
+def test_store_loads_once_per_owner_and_conversation(monkeypatch):
+    monkeypatch.setenv("MEMORY_MAX_TOKENS", "1000")
+    calls = []
+
+    def loader(conv_id, user_id, limit):
+        calls.append((conv_id, user_id))
+        return [{"sender": "user", "content": "hi"}, {"sender": "assistant", "content": "hello"}] if user_id == "owner" else []
+
+    store = ConversationMemoryStore(loader)
+    window = store.get("c1", "owner")
+    assert [m.content for m in window.messages()] == ["hi", "hello"]
+    assert store.get("c1", "owner") is window
+    # Someone else naming the same conversation gets their own (empty) window
+    assert asyncio.run(store.aget("c1", "intruder")).messages() == []
+    assert calls == [("c1", "owner"), ("c1", "intruder")]
+
+
+def test_digest_tracks_the_latest_turns():
+    a, b = ConversationWindow(1000, 100), ConversationWindow(1000, 100)
+    assert a.digest(2) is None
+    for window, topic in ((a, "asthma"), (b, "diabetes")):
+        window.add("user", f"What is {topic}?")
+        window.add("assistant", f"{topic} is ...")
+    # Same follow-up, different conversations: different cache scopes
+    assert a.digest(2) != b.digest(2)
+    before = a.digest(2)
+    a.add("user", "what about children?")
+    assert a.digest(2) != before
+
+
+def test_window_reloads_when_another_replica_answered(monkeypatch):
+    monkeypatch.setenv("MEMORY_MAX_TOKENS", "1000")
+    stored = [{"sender": "user", "content": "hi"}, {"sender": "bot", "content": "hello"}]
+    loads = []
+
+    def loader(conv_id, user_id, limit):
+        loads.append(len(stored))
+        return list(stored)
+
+    async def acounter(conv_id):
+        return len(stored)
+
+    store = ConversationMemoryStore(loader, counter=lambda conv_id: len(stored), acounter=acounter)
+    window = store.get("c1", "owner")
+    # Turns this replica answers itself are in the window before they are stored
+    window.add("user", "local question")
+    window.add("assistant", "local answer")
+    assert store.get("c1", "owner") is window
+    stored += [{"sender": "user", "content": "local question"}, {"sender": "bot", "content": "local answer"}]
+    assert asyncio.run(store.aget("c1", "owner")) is window
+    # Another replica answered a turn: reload instead of serving the stale window
+    stored += [{"sender": "user", "content": "elsewhere"}, {"sender": "bot", "content": "answered elsewhere"}]
+    fresh = asyncio.run(store.aget("c1", "owner"))
+    assert fresh is not window and fresh.messages()[-1].content == "answered elsewhere"
+    assert store.get("c1", "owner") is fresh
+    assert loads == [2, 6]
@@ -0,0 +1,44 @@
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+from ai_service.prompt import PromptAssembler
+
+
+def _history(turns):
+    out = []
+    for i in range(turns):
+        out += [HumanMessage(content=f"question {i} " + "x" * 400), AIMessage(content=f"answer {i} " + "y" * 400)]
+    return out
+
+
+def test_oldest_whole_turns_drop_to_keep_the_context_floor():
+    assembler = PromptAssembler(max_tokens=800, min_context_tokens=200, max_context_tokens=400, system_prompt="Be brief.")
+    prompt = assembler.build("What dose?", [{"text": "Give 5 mg daily."}], history=_history(4))
+    history = prompt.messages[1:-1]
+    # Dropped in (question, answer) pairs, so the window still starts with a question
+    assert prompt.history_dropped % 2 == 0 and prompt.history_dropped > 0
+    assert isinstance(history[0], HumanMessage) and history[-1].content.startswith("answer 3")
+    assert prompt.total <= assembler.max_tokens
+    assert isinstance(prompt.messages[0], SystemMessage) and "Give 5 mg daily." in prompt.messages[-1].content
+
+
+def test_history_kept_when_it_fits():
+    assembler = PromptAssembler(max_tokens=4000, min_context_tokens=200, system_prompt="Be brief.")
+    prompt = assembler.build("What dose?", [], history=_history(2))
+    assert prompt.history_dropped == 0 and len(prompt.messages) == 6
+    assert prompt.messages[-1].content == "What dose?"
+
+
+def test_overlapping_chunks_are_deduplicated_by_sentence():
+    docs = [
+        {"text": "Metformin is first line. Start at 500 mg daily.", "metadata": {"source": "/d/diabetes.pdf"}},
+        # Overlapping window of the same document: only its new sentence is added
+        {"text": "Start at 500 mg daily. Titrate weekly to 2 g.", "metadata": {"source": "/d/diabetes.pdf"}},
+        {"text": "start at   500 MG daily.", "metadata": {"source": "/d/other.pdf"}},
+    ]
+    prompt = PromptAssembler(max_tokens=4000, system_prompt="Be brief.").build("metformin dose", docs)
+    context = prompt.messages[-1].content
+    assert context.count("Start at 500 mg daily.") == 1
+    assert "[2] diabetes.pdf\nTitrate weekly to 2 g." in context
+    # The third passage had nothing new and is left out entirely
+    assert (prompt.duplicates, prompt.docs_used) == (2, 2)
+    assert len(prompt.sources) == 2
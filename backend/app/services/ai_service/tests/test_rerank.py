@@ -0,0 +1,51 @@
+import time
+
+from ai_service.rerank import Reranker
+
+
+def _docs(n):
+    return [{"text": f"passage {i}", "metadata": {"chunk_hash": f"h{i}"}} for i in range(n)]
+
+
+class _Scorer:
+    """Scores passage i as i, so the best order reverses the ANN order."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.pairs = 0
+
+    def __call__(self, pairs):
+        time.sleep(self.delay)
+        self.pairs += len(pairs)
+        return [float(text.split()[-1]) for _, text in pairs]
+
+
+def test_reranks_and_caches_scores_per_query_and_chunk():
+    scorer = _Scorer()
+    reranker = Reranker(score_fn=scorer, batch_size=4, budget_ms=1000, cache_size=100)
+    first = reranker.rerank("Statin dose?", _docs(6), top_k=3)
+    assert [d["text"] for d in first] == ["passage 5", "passage 4", "passage 3"]
+    assert first[0]["metadata"]["rerank_score"] == 5.0
+    # Same question (modulo case and spacing): every score comes from the cache
+    again = reranker.rerank("statin   DOSE?", _docs(6), top_k=3)
+    assert again == first and scorer.pairs == 6
+    assert reranker.stats["cache_hits"] == 6
+    reranker.rerank("another question", _docs(6), top_k=3)
+    assert scorer.pairs == 12
+
+
+def test_budget_fallback_returns_ann_order():
+    reranker = Reranker(score_fn=_Scorer(delay=0.03), batch_size=2, budget_ms=20, on_budget="ann", cache_size=0)
+    docs = _docs(6)
+    assert reranker.rerank("q", docs, top_k=3) == docs[:3]
+    assert reranker.stats["budget_exceeded"] == 1
+
+
+def test_budget_fallback_partial_keeps_scored_first():
+    scorer = _Scorer(delay=0.03)
+    reranker = Reranker(score_fn=scorer, batch_size=2, budget_ms=20, on_budget="partial", cache_size=0)
+    out = reranker.rerank("q", _docs(6), top_k=4)
+    # Only the first batch ran; it is reranked, the rest follow in ANN order
+    assert scorer.pairs == 2
+    assert [d["text"] for d in out] == ["passage 1", "passage 0", "passage 2", "passage 3"]
+    assert "rerank_score" not in out[2]["metadata"]
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from ai_service.llm import LLMRouter, StubBackend
+from ai_service.scheduler import FairScheduler, Rejected
+
+
+async def _grant_order(scheduler, requests):
+    """Hold the only slot, queue ``requests`` (user, priority), then release and record who gets it."""
+    order = []
+    await scheduler.acquire("holder")
+
+    async def waiter(user, priority):
+        await scheduler.acquire(user, priority)
+        order.append((user, priority))
+        scheduler.release(0.01)
+
+    tasks = []
+    for user, priority in requests:
+        tasks.append(asyncio.create_task(waiter(user, priority)))
+        await asyncio.sleep(0)
+    scheduler.release(0.01)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_round_robin_across_users():
+    scheduler = FairScheduler(max_concurrency=1, max_queued_per_user=3)
+    order = asyncio.run(_grant_order(scheduler, [("a", "interactive")] * 3 + [("b", "interactive")]))
+    assert [user for user, _ in order] == ["a", "b", "a", "a"]
+
+
+def test_interactive_served_before_background():
+    scheduler = FairScheduler(max_concurrency=1)
+    order = asyncio.run(_grant_order(scheduler, [("a", "background"), ("b", "background"), ("c", "interactive")]))
+    assert order[0] == ("c", "interactive")
+    assert [p for _, p in order[1:]] == ["background", "background"]
+
+
+def test_user_over_share_gets_429_with_retry_after():
+    async def run():
+        scheduler = FairScheduler(max_concurrency=1, max_queued_per_user=1)
+        await scheduler.acquire("holder")
+        queued = asyncio.create_task(scheduler.acquire("a"))
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as e:
+            await scheduler.acquire("a")
+        queued.cancel()
+        return e.value, scheduler
+
+    rejected, scheduler = asyncio.run(run())
+    assert (rejected.status, rejected.reason) == (429, "user_limit")
+    assert int(rejected.headers["Retry-After"]) >= 1
+    assert scheduler.depth() == 0
+
+
+def test_queue_full_and_predicted_wait_are_503():
+    async def run():
+        full = FairScheduler(max_concurrency=1, max_queue=1)
+        await full.acquire("holder")
+        queued = asyncio.create_task(full.acquire("a"))
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as queue_full:
+            await full.acquire("b")
+        queued.cancel()
+
+        slow = FairScheduler(max_concurrency=1, deadlines={"interactive": 1.0, "background": 1.0})
+        await slow.acquire("holder")
+        slow.release(10.0)
+        await slow.acquire("holder")
+        with pytest.raises(Rejected) as predicted:
+            await slow.acquire("a")
+        return queue_full.value, predicted.value
+
+    queue_full, predicted = asyncio.run(run())
+    assert (queue_full.status, queue_full.reason) == (503, "queue_full")
+    assert (predicted.status, predicted.reason) == (503, "predicted_wait")
+    # Retry-After follows the measured service time
+    assert predicted.retry_after >= 10
+
+
+def test_deadline_drops_queued_request():
+    async def run():
+        scheduler = FairScheduler(max_concurrency=1, deadlines={"interactive": 0.05, "background": 0.05})
+        await scheduler.acquire("holder")
+        with pytest.raises(Rejected) as e:
+            await scheduler.acquire("a")
+        return e.value, scheduler
+
+    rejected, scheduler = asyncio.run(run())
+    assert (rejected.status, rejected.reason) == (503, "deadline")
+    assert scheduler.depth() == 0 and scheduler.running == 1
+
+
+class _HeldBackend(StubBackend):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.release = asyncio.Event()
+
+    async def complete(self, messages):
+        await self.release.wait()
+        return await super().complete(messages)
+
+
+def test_admission_leaves_room_to_shed_to_fallback():
+    async def run():
+        primary = _HeldBackend("primary", "m", max_concurrency=1)
+        router = LLMRouter([primary, StubBackend("fallback", "m", max_concurrency=2)], shed_after=0.5, coalesce=False)
+        scheduler = FairScheduler(max_concurrency=router.capacity)
+        await scheduler.acquire("a")
+        first = asyncio.create_task(router.agenerate([{"role": "user", "content": "one"}]))
+        await asyncio.sleep(0)
+        # Still admitted: the scheduler counts the fallback's slots too
+        await scheduler.acquire("b")
+        second = await router.agenerate([{"role": "user", "content": "two"}])
+        primary.release.set()
+        return router.capacity, (await first).backend, second.backend
+
+    capacity, first, second = asyncio.run(run())
+    assert capacity == 3
+    assert (first, second) == ("primary", "fallback")
@@ -0,0 +1,57 @@
+import fakeredis
+
+from ai_service import semantic_cache
+from ai_service.semantic_cache import MemoryBackend, RedisBackend, SemanticCache
+
+
+def _backends():
+    return [MemoryBackend(maxsize=8, ttl=60), RedisBackend(fakeredis.FakeRedis(), maxsize=8, ttl=60)]
+
+
+def test_hits_are_scoped_and_thresholded():
+    for backend in _backends():
+        cache = SemanticCache(backend=backend, threshold=0.9)
+        cache.store("u1", [1.0, 0.0, 0.0], "What is the dose of amoxicillin?", {"answer": "500 mg"})
+        # A near-identical question in the same scope hits
+        assert cache.lookup("u1", [0.99, 0.05, 0.0]) == {"answer": "500 mg"}
+        # Another user's scope never sees it
+        assert cache.lookup("u2", [1.0, 0.0, 0.0]) is None
+        # Below the similarity threshold misses
+        assert cache.lookup("u1", [0.5, 0.86, 0.0]) is None
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache.time, "time", lambda: now[0])
+    cache = SemanticCache(backend=MemoryBackend(maxsize=8, ttl=30), threshold=0.9)
+    cache.store("u1", [0.0, 1.0], "q", {"answer": "a"})
+    now[0] += 29
+    assert cache.lookup("u1", [0.0, 1.0]) == {"answer": "a"}
+    now[0] += 2
+    assert cache.lookup("u1", [0.0, 1.0]) is None
+    assert cache.backend.candidates("u1") == []
+
+
+def test_redis_entries_carry_ttl_and_lru_evicts():
+    client = fakeredis.FakeRedis()
+    cache = SemanticCache(backend=RedisBackend(client, maxsize=2, ttl=30), threshold=0.9)
+    for i, vector in enumerate(([1.0, 0.0], [0.0, 1.0])):
+        cache.store("u1", vector, f"q{i}", {"answer": i})
+    assert 0 < client.ttl(f"semcache:u1:{semantic_cache._entry_id('q0')}") <= 30
+    # q0 is used again, so q1 is least recently used when a third entry arrives
+    assert cache.lookup("u1", [1.0, 0.0]) == {"answer": 0}
+    cache.store("u1", [-1.0, 0.0], "q2", {"answer": 2})
+    assert cache.lookup("u1", [0.0, 1.0]) is None
+    assert cache.lookup("u1", [1.0, 0.0]) == {"answer": 0}
+
+
+def test_redis_lookup_scans_only_recent_candidates():
+    client = fakeredis.FakeRedis()
+    cache = SemanticCache(backend=RedisBackend(client, maxsize=100, ttl=60, candidates=2), threshold=0.9)
+    cache.store("u1", [1.0, 0.0, 0.0], "old", {"answer": "old"})
+    cache.store("u1", [0.0, 1.0, 0.0], "mid", {"answer": "mid"})
+    cache.store("u1", [0.0, 0.0, 1.0], "new", {"answer": "new"})
+    assert len(cache.backend.candidates("u1")) == 2
+    # Pushed out of the recent window, though still stored
+    assert cache.lookup("u1", [1.0, 0.0, 0.0]) is None
+    assert cache.lookup("u1", [0.0, 1.0, 0.0]) == {"answer": "mid"}
@@ -1,27 +1,45 @@
 from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, Dict
 
-from chat_service.services.chat_service import ChatService
-from chat_service.core.auth import get_current_user
+from chat_service.services.chat_service import ConversationNotFound, GenerationBusy
+from chat_service.core.auth import get_current_user, oauth2_scheme
+from chat_service.core.services import get_chat_service
 
 router = APIRouter()
-chat_service = ChatService()
 
 
 class ChatRequest(BaseModel):
     text: str
     modalities: Optional[Dict] = None
+    conv_id: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
     answer: str
     sources: Optional[list] = []
+    conv_id: Optional[str] = None
 
 
 @router.post("/query", response_model=ChatResponse)
-async def query(req: ChatRequest, bg: BackgroundTasks, current_user: dict = Depends(get_current_user)):
+async def query(req: ChatRequest, bg: BackgroundTasks, current_user: dict = Depends(get_current_user), token: str = Depends(oauth2_scheme)):
     if not req.text:
         raise HTTPException(status_code=400, detail="text required")
-    resp = await chat_service.handle_query(current_user["id"], req.text, modalities=req.modalities or {})
-    return resp
+    try:
+        return await get_chat_service().handle_query(current_user["id"], req.text, modalities=req.modalities or {}, conv_id=req.conv_id, token=token)
+    except ConversationNotFound:
+        raise HTTPException(status_code=404, detail="conversation not found")
+    except GenerationBusy as e:
+        raise HTTPException(status_code=e.status, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+@router.post("/query/stream")
+async def query_stream(req: ChatRequest, current_user: dict = Depends(get_current_user), token: str = Depends(oauth2_scheme)):
+    if not req.text:
+        raise HTTPException(status_code=400, detail="text required")
+    try:
+        events = await get_chat_service().stream_query(current_user["id"], req.text, modalities=req.modalities or {}, conv_id=req.conv_id, token=token)
+    except ConversationNotFound:
+        raise HTTPException(status_code=404, detail="conversation not found")
+    return StreamingResponse(events, media_type="application/x-ndjson")
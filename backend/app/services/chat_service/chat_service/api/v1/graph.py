@@ -1,14 +1,17 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 
-from chat_service.services.langgraph_service import LangGraphService
+from chat_service.core.auth import get_current_user
+from chat_service.core.services import get_chat_service, get_graph_service
 
 router = APIRouter()
 
 
 @router.get("/graph/{conv_id}")
-def get_graph(conv_id: str):
-    lg = LangGraphService()
-    g = lg.get_graph(conv_id)
+async def get_graph(conv_id: str, current_user: dict = Depends(get_current_user)):
+    conv = await get_chat_service().repo.get_conversation(conv_id)
+    if not conv or str(conv.get("user_id")) != str(current_user["id"]):
+        raise HTTPException(status_code=404, detail="No graph found")
+    g = await get_graph_service().get_graph(conv_id)
     if not g:
         raise HTTPException(status_code=404, detail="No graph found")
     return g
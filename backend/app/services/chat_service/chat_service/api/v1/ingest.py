@@ -1,17 +1,63 @@
-from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException, Depends
+from typing import List
+
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from fastapi.responses import JSONResponse
+from pydantic import BaseModel
 
-from chat_service.services.ingest_service import IngestService
 from chat_service.core.auth import get_current_user
+from chat_service.core.services import get_ingest_service
+from shared.uploads import UploadTooLarge
 
 router = APIRouter()
-ingest_service = IngestService()
+
+
+class BulkIngestRequest(BaseModel):
+    # Files or directories, relative to UPLOAD_DIR; only the caller's own uploads are taken
+    paths: List[str]
 
 
 @router.post("/upload")
-async def upload_document(background_tasks: BackgroundTasks, file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+async def upload_document(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+    ingest_service = get_ingest_service()
     if file.filename == "":
         raise HTTPException(status_code=400, detail="file required")
-    saved_path = await ingest_service.save_upload(file, uploaded_by=current_user["id"])
-    background_tasks.add_task(ingest_service.ingest_file, saved_path, current_user["id"]) 
-    return JSONResponse({"status": "accepted", "filepath": saved_path}, status_code=202)
+    try:
+        saved = await ingest_service.save_upload(file, uploaded_by=current_user["id"])
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if saved["duplicate"]:
+        return JSONResponse({"status": "duplicate", "filepath": saved["filepath"], "sha256": saved["sha256"]}, status_code=200)
+    job_id = await ingest_service.submit([saved["filepath"]], current_user["id"], priority="interactive")
+    return JSONResponse({"status": "accepted", "job_id": job_id, "filepath": saved["filepath"], "sha256": saved["sha256"]}, status_code=202)
+
+
+@router.post("/bulk")
+async def bulk_ingest(req: BulkIngestRequest, current_user: dict = Depends(get_current_user)):
+    ingest_service = get_ingest_service()
+    try:
+        paths = await ingest_service.resolve_paths(req.paths, current_user["id"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not paths:
+        raise HTTPException(status_code=400, detail="no files to ingest")
+    job_id = await ingest_service.submit(paths, current_user["id"], priority="bulk")
+    return JSONResponse({"status": "accepted", "job_id": job_id, "files": len(paths)}, status_code=202)
+
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str, file_limit: int = 100, current_user: dict = Depends(get_current_user)):
+    ingest_service = get_ingest_service()
+    job = await ingest_service.job_status(job_id, file_limit=file_limit)
+    if not job or job.get("uploaded_by") != current_user["id"]:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
+
+@router.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    ingest_service = get_ingest_service()
+    job = await ingest_service.jobs.get_job(job_id)
+    if not job or job.get("uploaded_by") != current_user["id"]:
+        raise HTTPException(status_code=404, detail="job not found")
+    requeued = await ingest_service.retry(job_id)
+    return JSONResponse({"status": "accepted" if requeued else "noop", "job_id": job_id, "requeued": requeued}, status_code=202 if requeued else 200)
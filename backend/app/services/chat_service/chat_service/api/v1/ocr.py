@@ -1,6 +1,7 @@
-from fastapi import APIRouter, UploadFile
+from fastapi import APIRouter, UploadFile, HTTPException
 import httpx
 from shared.config import settings
+from shared.uploads import spool_upload, UploadTooLarge
 
 router = APIRouter()
 
@@ -18,10 +19,18 @@ def _get_trocr():
 @router.post("/ocr")
 async def extract_text(file: UploadFile):
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            files = {"file": (file.filename or "image", await file.read())}
-            resp = await client.post(settings.AI_SERVICE_URL.rstrip("/") + "/api/v1/ocr", files=files)
-            resp.raise_for_status()
-            return resp.json()
+        spooled = await spool_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        # httpx streams the open file in chunks instead of one in-memory body
+        with spooled.open() as fh:
+            async with httpx.AsyncClient(timeout=60.0) as client:
+                files = {"file": (file.filename or "image", fh, file.content_type)}
+                resp = await client.post(settings.AI_SERVICE_URL.rstrip("/") + "/api/v1/ocr", files=files)
+                resp.raise_for_status()
+                return resp.json()
     except Exception:
-        return {"text": "[OCR failed]"}
\ No newline at end of file
+        return {"text": "[OCR failed]"}
+    finally:
+        spooled.remove()
\ No newline at end of file
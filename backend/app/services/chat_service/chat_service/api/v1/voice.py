@@ -1,6 +1,7 @@
-from fastapi import APIRouter, UploadFile
+from fastapi import APIRouter, UploadFile, HTTPException
 import httpx
 from shared.config import settings
+from shared.uploads import spool_upload, UploadTooLarge
 
 router = APIRouter()
 
@@ -16,10 +17,17 @@ def _get_asr_pipeline():
 @router.post("/voice")
 async def transcribe_audio(file: UploadFile):
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            files = {"file": (file.filename or "voice.webm", await file.read())}
-            resp = await client.post(settings.AI_SERVICE_URL.rstrip("/") + "/api/v1/voice", files=files)
-            resp.raise_for_status()
-            return resp.json()
+        spooled = await spool_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        with spooled.open() as fh:
+            async with httpx.AsyncClient(timeout=120.0) as client:
+                files = {"file": (file.filename or "voice.webm", fh, file.content_type)}
+                resp = await client.post(settings.AI_SERVICE_URL.rstrip("/") + "/api/v1/voice", files=files)
+                resp.raise_for_status()
+                return resp.json()
     except Exception:
-        return {"text": "[ASR not available]"}
\ No newline at end of file
+        return {"text": "[ASR not available]"}
+    finally:
+        spooled.remove()
\ No newline at end of file
@@ -1,25 +1,26 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-import os
 import base64
 import json
 import hmac
 import hashlib
 import time
+from typing import Optional, Tuple
+
 import httpx
-from shared.config import settings
-from shared.mongo import get_db
 from bson import ObjectId
+from cachetools import TLRUCache, TTLCache
+from shared.config import settings
+from shared.mongo import get_async_db
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 SECRET_KEY = getattr(settings, "SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
-db = get_db()
 
 
 def _users():
-    return db["users"]
+    return get_async_db()["users"]
 
 
 def _b64url_decode(s: str) -> bytes:
@@ -40,7 +41,7 @@ def _decode_jwt(token: str) -> dict | None:
             return None
         signing_input = (header_b64 + "." + payload_b64).encode()
         expected = base64.urlsafe_b64encode(hmac.new(SECRET_KEY.encode(), signing_input, hashlib.sha256).digest()).rstrip(b"=")
-        if expected.decode() != sig_b64:
+        if not hmac.compare_digest(expected.decode(), sig_b64):
             return None
         exp = payload.get("exp")
         if exp and time.time() > float(exp):
@@ -50,38 +51,119 @@ def _decode_jwt(token: str) -> dict | None:
         return None
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
+def _unverified_claims(token: str) -> dict:
+    # Only for cache bookkeeping (exp) once the token has been verified elsewhere
+    try:
+        return json.loads(_b64url_decode(token.split(".")[1]))
+    except Exception:
+        return {}
+
+
+def _profile(doc: dict) -> dict:
+    return {"id": doc.get("id") or str(doc.get("_id")), "email": doc.get("email"), "full_name": doc.get("full_name"), "created_at": doc.get("created_at")}
+
+
+class TokenVerifier:
+    """Verify bearer tokens once and serve repeat requests from memory.
+
+    Identities are cached per token until the earlier of ``AUTH_CACHE_TTL``
+    and the token's own ``exp``; profiles are cached per user id for
+    ``AUTH_CACHE_TTL``, so a deleted user or edited profile is seen within
+    that window (nothing pushes revocations). Tokens user_service rejects with a
+    401 are remembered briefly so a bad token cannot keep hitting Mongo or
+    user_service; an unreachable user_service is never cached as a rejection.
+    """
+
+    def __init__(self):
+        self.ttl = settings.AUTH_CACHE_TTL
+        self.identities = TLRUCache(maxsize=settings.AUTH_CACHE_MAXSIZE, ttu=self._expires_at, timer=time.time)
+        self.profiles = TTLCache(maxsize=settings.AUTH_CACHE_MAXSIZE, ttl=self.ttl, timer=time.time)
+        self.rejected = TTLCache(maxsize=settings.AUTH_CACHE_MAXSIZE, ttl=settings.AUTH_NEGATIVE_CACHE_TTL, timer=time.time)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _expires_at(self, token: str, identity: dict, now: float) -> float:
+        exp = identity.get("exp")
+        return min(now + self.ttl, float(exp)) if exp else now + self.ttl
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=settings.USER_SERVICE_URL.rstrip("/"),
+                timeout=settings.AUTH_REMOTE_TIMEOUT,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=10),
+            )
+        return self._client
+
+    async def _load_profile(self, user_id: str) -> Optional[dict]:
+        profile = self.profiles.get(user_id)
+        if profile is not None:
+            return profile
+        try:
+            u = await _users().find_one({"_id": ObjectId(user_id)})
+        except Exception:
+            return None
+        if not u:
+            return None
+        profile = self.profiles[user_id] = _profile(u)
+        return profile
+
+    async def _remote(self, token: str) -> Tuple[Optional[dict], bool]:
+        """Ask user_service; returns ``(profile, rejected)``.
+
+        Only a 401 counts as a rejection. Timeouts, connection errors and
+        other statuses fail this request without being remembered.
+        """
+        try:
+            r = await self._http().get("/auth/me", headers={"Authorization": f"Bearer {token}"})
+        except Exception:
+            return None, False
+        if r.status_code == 200:
+            return _profile(r.json()), False
+        return None, r.status_code == 401
+
+    async def verify(self, token: str) -> Optional[dict]:
+        identity = self.identities.get(token)
+        if identity is not None:
+            profile = self.profiles.get(identity["id"]) or await self._load_profile(identity["id"])
+            if profile is not None:
+                return profile
+        if token in self.rejected:
+            return None
+
+        # Decode locally without external deps
+        payload = _decode_jwt(token)
+        profile = None
+        if payload and payload.get("sub"):
+            profile = await self._load_profile(payload["sub"])
+        exp = payload.get("exp") if payload else None
+        if profile is None:
+            # Fallback: validate via user_service /auth/me
+            profile, rejected = await self._remote(token)
+            if profile is None or not profile.get("id"):
+                if rejected:
+                    self.rejected[token] = True
+                return None
+            self.profiles[profile["id"]] = profile
+            exp = _unverified_claims(token).get("exp")
+        self.identities[token] = {"id": profile["id"], "exp": exp}
+        return profile
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+token_verifier = TokenVerifier()
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    # Decode locally without external deps
-    payload = _decode_jwt(token)
-    if payload:
-        user_id = payload.get("sub")
-        if user_id:
-            u = _users().find_one({"_id": ObjectId(user_id)})
-            if u:
-                return {"id": str(u["_id"]), "email": u.get("email"), "full_name": u.get("full_name"), "created_at": u.get("created_at")}
-
-    # Fallback: validate via user_service /auth/me
-    bases = [
-        os.getenv("USER_SERVICE_URL"),
-        "http://genai_user_service:8086",
-        "http://localhost:8001",
-        os.getenv("GATEWAY_URL"),
-        "http://localhost:8000",
-    ]
-    for base in [b for b in bases if b]:
-        base = base.rstrip("/")
-        url = f"{base}/auth/me"
-        try:
-            with httpx.Client(timeout=10.0) as client:
-                r = client.get(url, headers={"Authorization": f"Bearer {token}"})
-                if r.status_code == 200:
-                    data = r.json()
-                    return {"id": data.get("id"), "email": data.get("email"), "full_name": data.get("full_name"), "created_at": data.get("created_at")}
-        except Exception:
-            pass
-    raise credentials_exception
+    user = await token_verifier.verify(token)
+    if user is None:
+        raise credentials_exception
+    return user
@@ -0,0 +1,34 @@
+import threading
+from typing import Optional
+
+from chat_service.services.chat_service import ChatService
+from chat_service.services.ingest_service import IngestService
+from chat_service.services.langgraph_service import LangGraphService
+
+# Built by the lifespan (or the first request), never at import
+_chat_service: Optional[ChatService] = None
+_ingest_service: Optional[IngestService] = None
+_lock = threading.Lock()
+
+
+def get_chat_service(create: bool = True) -> Optional[ChatService]:
+    global _chat_service
+    if _chat_service is None and create:
+        with _lock:
+            if _chat_service is None:
+                _chat_service = ChatService()
+    return _chat_service
+
+
+def get_ingest_service(create: bool = True) -> Optional[IngestService]:
+    global _ingest_service
+    if _ingest_service is None and create:
+        with _lock:
+            if _ingest_service is None:
+                _ingest_service = IngestService()
+    return _ingest_service
+
+
+def get_graph_service() -> LangGraphService:
+    # Reads go through the chat service's recorder, so the process has one repo and one write-behind queue
+    return get_chat_service().graph
@@ -1,12 +1,47 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
+from shared.chunker import token_counter
 from shared.config import settings
-from shared.logger import setup_observability
+from shared.logger import setup_observability, get_logger
+from shared.mongo import close_async_mongo_client, get_async_db
+from shared.startup import StartupReport
 from chat_service.api.v1 import chat, ingest, voice, ocr, graph
+from chat_service.core.auth import token_verifier
+from chat_service.core.services import get_chat_service, get_ingest_service
 
+logger = get_logger("chat_service")
+startup = StartupReport("chat_service")
 
-app = FastAPI(title="Chat Service")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.INGEST_EXECUTOR == "local":
+        with startup.step("tokenizer"):
+            # Chunking runs here: refuse to start rather than chunk by estimate
+            token_counter()
+    with startup.step("ingest"):
+        # Picks up ingestion jobs interrupted by a crash or restart, then keeps sweeping
+        get_ingest_service().start_sweeper()
+    with startup.step("chat"):
+        get_chat_service()
+    startup.mark_ready(logger)
+    yield
+    ingest_service = get_ingest_service(create=False)
+    if ingest_service is not None:
+        await ingest_service.aclose()
+    chat_service = get_chat_service(create=False)
+    if chat_service is not None:
+        # Flush conversation turns still queued for the write-behind recorder
+        await chat_service.graph.aclose()
+    await token_verifier.aclose()
+    close_async_mongo_client()
+
+
+app = FastAPI(title="Chat Service", lifespan=lifespan)
 setup_observability("chat_service", app)
 
 app.add_middleware(
@@ -27,3 +62,20 @@ app.include_router(graph.router, prefix="/api/v1", tags=["graph"])
 @app.get("/")
 def root():
     return {"service": "chat_service"}
+
+
+@app.get("/ready")
+async def ready():
+    # Ready once the services are built and Mongo answers; "/" stays the liveness check
+    report = startup.report()
+    try:
+        await asyncio.wait_for(get_async_db().command("ping"), 2.0)
+        report["mongo"] = "ok"
+    except Exception as e:
+        report["mongo"] = f"{type(e).__name__}: {e}"
+        report["ready"] = False
+    chat_service = get_chat_service(create=False)
+    if chat_service is not None:
+        # Write-behind health: written/retried/dropped turns and the current backlog
+        report["graph_writer"] = chat_service.graph.stats()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
@@ -1,111 +1,199 @@
-import asyncio
-from typing import Dict, Any
+import json
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 
 import httpx
-from shared.mongo_repo import MongoRepo
+from shared.mongo_repo import AsyncMongoRepo
 from shared.config import settings
 from shared.tracing import tracer
 
-# Optional langchain imports (if installed)
-try:
-    from langchain.chains import RetrievalQA
-    from langchain.vectorstores import Qdrant
-    from langchain.embeddings import HuggingFaceEmbeddings
-except Exception:
-    Qdrant = None
-    RetrievalQA = None
-    HuggingFaceEmbeddings = None
+from .langgraph_service import GraphTurn, LangGraphService
+
+
+class GenerationBusy(Exception):
+    """ai_service refused the turn under load (429/503); nothing was generated or persisted."""
+
+    def __init__(self, status: int, retry_after: int):
+        super().__init__(f"model busy, retry after {retry_after}s")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ConversationNotFound(Exception):
+    """``conv_id`` does not exist or belongs to another user; reported as 404 either way."""
+
+
+def _retry_after(headers: httpx.Headers, default: int = 1) -> int:
+    """Seconds from a Retry-After header (delta or HTTP date); ``default`` when missing or malformed."""
+    value = (headers.get("Retry-After") or "").strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0, int((when - datetime.now(timezone.utc)).total_seconds()))
+
+
+def _busy(e: httpx.HTTPStatusError) -> Optional[GenerationBusy]:
+    if e.response.status_code in (429, 503):
+        return GenerationBusy(e.response.status_code, _retry_after(e.response.headers))
+    return None
+
+
+def _auth(token: Optional[str]) -> Dict[str, str]:
+    # ai_service takes the caller from the bearer token, never from the body
+    return {"Authorization": f"Bearer {token}"} if token else {}
 
 
 class ChatService:
     def __init__(self):
-        self.repo = MongoRepo()
-        self._init_rag()
-
-    def _init_rag(self):
-        if Qdrant and HuggingFaceEmbeddings:
-            try:
-                emb = HuggingFaceEmbeddings(model_name=settings.EMBEDDING_MODEL)
-                self.vs = Qdrant(url=settings.QDRANT_URL, prefer_grpc=False, collection_name=settings.QDRANT_COLLECTION)
-                retriever = self.vs.as_retriever(search_type="mmr", search_kwargs={"k": 3})
-                self.rqa = RetrievalQA.from_chain_type(llm=self.model.llm, chain_type="stuff", retriever=retriever)
-            except Exception:
-                self.vs = None
-                self.rqa = None
-        else:
-            self.vs = None
-            self.rqa = None
-
-    async def handle_query(self, user_id: str, text: str, modalities: Dict | None = None) -> Dict[str, Any]:
+        self.repo = AsyncMongoRepo()
+        # One graph recorder per service; it owns the write-behind queue
+        self.graph = LangGraphService(repo=self.repo)
+
+    async def _open_turn(self, user_id: str, text: str, conv_id: Optional[str]) -> GraphTurn:
+        """Turn for ``conv_id`` if ``user_id`` owns it, or for a new conversation.
+
+        Raises ``ConversationNotFound`` before anything is recorded or sent to
+        ai_service. A new conversation is written at once rather than behind,
+        so the next turn's ownership check always finds it.
+        """
+        if conv_id:
+            conv = await self.repo.get_conversation(conv_id)
+            if not conv or str(conv.get("user_id")) != str(user_id):
+                raise ConversationNotFound(conv_id)
+            return GraphTurn(conv_id)
+        turn = GraphTurn()
+        turn.open_conversation(user_id=user_id, title=(text[:50] + "..."))
+        await self.repo.insert_turns([{"conversations": turn.docs["conversations"]}])
+        turn.docs["conversations"] = []
+        return turn
+
+    async def handle_query(self, user_id: str, text: str, modalities: Dict | None = None, conv_id: Optional[str] = None, token: Optional[str] = None) -> Dict[str, Any]:
         t = tracer.trace("chat_service.handle_query")
         modalities = modalities or {}
-        sources: list[Any] = []
 
-        try:
-            conv_id = self.repo.create_conversation(user_id=user_id, title=(text[:50] + "..."))
-        except Exception:
-            conv_id = None
-
-        from .langgraph_service import LangGraphService
-        lg = LangGraphService()
-
-        user_node_id = None
-        if conv_id is not None:
-            user_node_id = lg.record_node(conv_id=conv_id, node_type="user", content=text, metadata={"user_id": user_id})
-
-        retrieval_node_ids: list[int] = []
-        retrieval_texts: list[str] = []
-        if getattr(self, "rqa", None):
-            try:
-                loop = asyncio.get_event_loop()
-                rqa_output = await loop.run_in_executor(None, lambda: self.rqa.run(text))
-                try:
-                    retriever = self.vs.as_retriever(search_type="mmr", search_kwargs={"k": 3})
-                    docs = retriever.get_relevant_documents(text)
-                except Exception:
-                    docs = []
-                for d in docs:
-                    content_snippet = (d.page_content[:400] if hasattr(d, "page_content") else str(d))
-                    nid = lg.record_node(conv_id=conv_id, node_type="retrieval", content=content_snippet, metadata={"source": getattr(d, "metadata", {})})
-                    retrieval_node_ids.append(nid)
-                    retrieval_texts.append(content_snippet)
-                    sources.append(getattr(d, "metadata", {}))
-            except Exception:
-                pass
+        turn = await self._open_turn(user_id, text, conv_id)
+        conv_id = turn.conv_id
+        user_node_id = turn.node(node_type="user", content=text, metadata={"user_id": user_id})
 
+        # ai_service retrieves once and returns the documents it used; they
+        # become the retrieval nodes here, so no second vector search is needed.
         answer = None
+        docs: list[Dict[str, Any]] = []
         try:
             async with httpx.AsyncClient(timeout=30.0) as client:
-                resp = await client.post(settings.AI_SERVICE_URL.rstrip("/") + "/api/v1/generate", json={"text": text})
+                resp = await client.post(settings.AI_SERVICE_URL.rstrip("/") + "/api/v1/generate", json={"text": text, "conv_id": conv_id}, headers=_auth(token))
                 resp.raise_for_status()
-                answer = resp.json().get("text")
+                data = resp.json()
+                answer = data.get("text")
+                docs = data.get("sources") or []
+        except httpx.HTTPStatusError as e:
+            busy = _busy(e)
+            if busy:
+                raise busy
+            answer = "Sorry — model generation failed."
         except Exception:
             answer = "Sorry — model generation failed."
 
-        gen_node_id = None
-        if conv_id is not None:
-            gen_node_id = lg.record_node(conv_id=conv_id, node_type="generation", content=answer, metadata={"sources": sources})
+        retrieval_node_ids, sources = self._record_sources(turn, docs)
+
+        await self._persist_turn(turn, user_id, text, user_node_id, retrieval_node_ids, answer, sources)
 
         try:
-            if conv_id is not None and user_node_id:
-                if gen_node_id:
-                    lg.record_edge(conv_id=conv_id, from_node=user_node_id, to_node=gen_node_id, relation="asked_for")
-                for r_nid in retrieval_node_ids:
-                    lg.record_edge(conv_id=conv_id, from_node=user_node_id, to_node=r_nid, relation="retrieved")
-                    if gen_node_id:
-                        lg.record_edge(conv_id=conv_id, from_node=r_nid, to_node=gen_node_id, relation="informed")
+            t.log({"user_id": user_id, "text": text, "answer": answer, "conv_id": conv_id, "sources": sources})
+            t.end()
         except Exception:
             pass
+        return {"answer": answer, "sources": sources, "conv_id": conv_id}
+
+    def _record_sources(self, turn: GraphTurn, docs: List[Dict[str, Any]]) -> Tuple[List[str], List[Any]]:
+        node_ids: List[str] = []
+        sources: List[Any] = []
+        for d in docs:
+            content_snippet = (d.get("text") or "")[:400]
+            metadata = d.get("metadata") or {}
+            node_ids.append(turn.node(node_type="retrieval", content=content_snippet, metadata={"source": metadata}))
+            sources.append(metadata)
+        return node_ids, sources
+
+    async def _persist_turn(self, turn: GraphTurn, user_id: str, text: str, user_node_id: str, retrieval_node_ids: List[str], answer: str, sources: List[Any]) -> None:
+        gen_node_id = turn.node(node_type="generation", content=answer, metadata={"sources": sources})
+        turn.edge(from_node=user_node_id, to_node=gen_node_id, relation="asked_for")
+        for r_nid in retrieval_node_ids:
+            turn.edge(from_node=user_node_id, to_node=r_nid, relation="retrieved")
+            turn.edge(from_node=r_nid, to_node=gen_node_id, relation="informed")
+        turn.message(sender="user", content=text, metadata={"user_id": user_id})
+        turn.message(sender="bot", content=answer, metadata={"sources": sources})
+        await self.graph.submit(turn)
+
+    async def stream_query(self, user_id: str, text: str, modalities: Dict | None = None, conv_id: Optional[str] = None, token: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream an answer as NDJSON events, relaying ai_service tokens as they arrive.
 
+        Checks ``conv_id`` up front (``ConversationNotFound``), so the caller
+        can still answer with a status; the returned iterator emits ``start``
+        (with ``conv_id``), ``sources``, ``token`` events and a final ``done``.
+        The turn is persisted once the upstream stream ends.
+        """
+        turn = await self._open_turn(user_id, text, conv_id)
+        return self._stream_turn(turn, user_id, text, token)
+
+    async def _stream_turn(self, turn: GraphTurn, user_id: str, text: str, token: Optional[str] = None) -> AsyncIterator[str]:
+        t = tracer.trace("chat_service.stream_query")
+        sources: list[Any] = []
+        conv_id = turn.conv_id
+        user_node_id = turn.node(node_type="user", content=text, metadata={"user_id": user_id})
+        yield json.dumps({"type": "start", "conv_id": conv_id}) + "\n"
+
+        retrieval_node_ids: list[str] = []
+        parts: list[str] = []
+        failed = False
         try:
-            self.repo.create_message(conv_id=conv_id, sender="user", content=text, metadata={"user_id": user_id})
-            self.repo.create_message(conv_id=conv_id, sender="bot", content=answer, metadata={"sources": sources})
+            # No read timeout: gaps between tokens are bounded by the model, not the network.
+            timeout = httpx.Timeout(30.0, read=None)
+            async with httpx.AsyncClient(timeout=timeout) as client:
+                async with client.stream(
+                    "POST",
+                    settings.AI_SERVICE_URL.rstrip("/") + "/api/v1/generate",
+                    json={"text": text, "conv_id": conv_id, "stream": True},
+                    headers=_auth(token),
+                ) as resp:
+                    if resp.status_code in (429, 503):
+                        # Refused before generating: tell the client when to retry and record nothing
+                        yield json.dumps({"type": "error", "error": "busy", "status": resp.status_code, "retry_after": _retry_after(resp.headers)}) + "\n"
+                        yield json.dumps({"type": "done", "conv_id": conv_id}) + "\n"
+                        return
+                    resp.raise_for_status()
+                    async for line in resp.aiter_lines():
+                        if not line:
+                            continue
+                        event = json.loads(line)
+                        kind = event.get("type")
+                        if kind == "token":
+                            parts.append(event.get("text") or "")
+                            yield line + "\n"
+                        elif kind == "sources":
+                            retrieval_node_ids, sources = self._record_sources(turn, event.get("sources") or [])
+                            yield json.dumps({"type": "sources", "sources": sources}) + "\n"
+                        elif kind == "error":
+                            failed = True
         except Exception:
-            pass
+            failed = True
+
+        answer = "".join(parts)
+        if failed and not answer:
+            answer = "Sorry — model generation failed."
+            yield json.dumps({"type": "token", "text": answer}) + "\n"
+
+        await self._persist_turn(turn, user_id, text, user_node_id, retrieval_node_ids, answer, sources)
 
         try:
             t.log({"user_id": user_id, "text": text, "answer": answer, "conv_id": conv_id, "sources": sources})
             t.end()
         except Exception:
             pass
-        return {"answer": answer, "sources": sources, "conv_id": conv_id}
+        yield json.dumps({"type": "done", "conv_id": conv_id}) + "\n"
@@ -0,0 +1,178 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from shared.chunks import ChunkManifest
+from shared.config import settings
+from shared.ingest import STAGES, IndexWriter, IngestJobStore, build_points, check_text, complete_file, plan_file
+from shared.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class IngestPipeline:
+    """extract → split → embed → upsert, each stage a pool of workers fed by a bounded queue.
+
+    Indexing is incremental: chunk ids are content hashes, and only chunks
+    missing from the source's manifest are embedded; chunks the source no
+    longer contains are deleted once it completes. ``embed(texts)``,
+    ``upsert(points)`` and ``delete(ids, owner)`` default to ai_service's batch
+    endpoint and Qdrant; pass your own to run the pipeline elsewhere.
+    """
+
+    def __init__(
+        self,
+        store: Optional[IngestJobStore] = None,
+        embed: Optional[Callable[[List[str]], Awaitable[List[List[float]]]]] = None,
+        upsert: Optional[Callable[[List[Dict[str, Any]]], Awaitable[None]]] = None,
+        delete: Optional[Callable[[List[str], Optional[str]], Awaitable[None]]] = None,
+        manifest: Optional[ChunkManifest] = None,
+    ):
+        self.store = store or IngestJobStore()
+        self.manifest = manifest or ChunkManifest(db=self.store._db)
+        self.writer = IndexWriter()
+        self.embed = embed or self.writer.embed
+        self.upsert = upsert or self.writer.upsert
+        self.delete = delete or self.writer.delete
+        self.workers = {
+            "extract": max(1, settings.INGEST_EXTRACT_WORKERS),
+            "split": max(1, settings.INGEST_SPLIT_WORKERS),
+            "embed": max(1, settings.INGEST_EMBED_WORKERS),
+            "upsert": max(1, settings.INGEST_UPSERT_WORKERS),
+        }
+        self.batch_size = max(1, settings.EMBED_BATCH_SIZE)
+        self.max_retries = max(1, settings.INGEST_MAX_RETRIES)
+        # None: a third of INGEST_LEASE_SECONDS
+        self.heartbeat_every: Optional[float] = None
+
+    async def _retry(self, fn, *args):
+        for attempt in range(self.max_retries):
+            try:
+                return await fn(*args)
+            except Exception:
+                if attempt == self.max_retries - 1:
+                    raise
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def aclose(self):
+        await self.writer.aclose()
+
+    async def run(self, job_id: str) -> str:
+        job = await self.store.get_job(job_id)
+        if not job:
+            raise KeyError(job_id)
+        files = await self.store.pending_files(job_id)
+        logger.info(f"ingest_job_start job={job_id} files={len(files)}")
+        run = _JobRun(self, job, files)
+        async with self.store.keep_alive(job_id, self.heartbeat_every):
+            await run.execute()
+        status = await self.store.finish_job(job_id)
+        logger.info(f"ingest_job_end job={job_id} status={status}")
+        return status
+
+
+class _JobRun:
+    """State of one pass over a job: the queues, how many batches each file still owes,
+    and each file's fresh chunk hashes until its manifest is rewritten."""
+
+    def __init__(self, pipeline: IngestPipeline, job: Dict[str, Any], files: List[Dict[str, Any]]):
+        self.p = pipeline
+        self.store = pipeline.store
+        self.job_id = job["_id"]
+        self.uploaded_by = job.get("uploaded_by")
+        self.files = files
+        size = max(1, settings.INGEST_QUEUE_SIZE)
+        self.queues = {stage: asyncio.Queue(maxsize=size) for stage in STAGES}
+        self.remaining: Dict[str, int] = {}
+        self.pending: Dict[str, Dict[str, List[str]]] = {}
+        self.failed: set = set()
+
+    async def execute(self):
+        stages = [
+            asyncio.create_task(self._stage(stage, handler, nxt))
+            for stage, handler, nxt in (
+                ("extract", self._extract, "split"),
+                ("split", self._split, "embed"),
+                ("embed", self._embed, "upsert"),
+                ("upsert", self._upsert, None),
+            )
+        ]
+        try:
+            for f in self.files:
+                await self.queues["extract"].put({"file": f})
+            for _ in range(self.p.workers["extract"]):
+                await self.queues["extract"].put(_DONE)
+            await asyncio.gather(*stages)
+        except BaseException:
+            for t in stages:
+                t.cancel()
+            raise
+
+    async def _stage(self, stage: str, handler, nxt: Optional[str]):
+        inbox = self.queues[stage]
+
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is _DONE:
+                    return
+                file_id = item["file"]["_id"]
+                if file_id in self.failed:
+                    continue
+                try:
+                    await handler(item)
+                except Exception as e:
+                    logger.error(f"ingest_stage_error job={self.job_id} file={file_id} stage={stage} error={e}")
+                    self.failed.add(file_id)
+                    await self.store.finish_file(self.job_id, file_id, error=str(e), stage=stage)
+
+        await asyncio.gather(*(worker() for _ in range(self.p.workers[stage])))
+        if nxt:
+            for _ in range(self.p.workers[nxt]):
+                await self.queues[nxt].put(_DONE)
+
+    async def _extract(self, item: Dict[str, Any]):
+        t0 = time.perf_counter()
+        await asyncio.to_thread(check_text, item["file"]["path"])
+        await self.queues["split"].put({**item, "timings": {"extract": time.perf_counter() - t0}})
+
+    async def _split(self, item: Dict[str, Any]):
+        f = item["file"]
+        plan = await plan_file(self.p.manifest, self.uploaded_by, f["path"], self.p.batch_size, f.get("done_batches"))
+        timings = {**item["timings"], **plan.timings}
+        await self.store.start_file(self.job_id, f["_id"], len(plan.hashes), plan.batches_total, timings, plan.stats)
+        self.pending[f["_id"]] = {"hashes": plan.hashes, "removed": plan.removed}
+        if not plan.pending:
+            await self._complete(f)
+            return
+        self.remaining[f["_id"]] = plan.pending
+        # The bounded embed queue paces how far ahead of embedding the file is read
+        async for n, hashes, texts, sections in plan.abatches():
+            await self.queues["embed"].put({"file": f, "batch": n, "hashes": hashes, "texts": texts, "sections": sections})
+
+    async def _complete(self, f: Dict[str, Any]):
+        state = self.pending.pop(f["_id"])
+
+        async def delete(ids, owner):
+            await self.p._retry(self.p.delete, ids, owner)
+
+        await complete_file(self.store, self.p.manifest, delete, self.job_id, f["_id"], self.uploaded_by, f["path"], state["hashes"], state["removed"])
+
+    async def _embed(self, item: Dict[str, Any]):
+        t0 = time.perf_counter()
+        vectors = await self.p._retry(self.p.embed, item["texts"])
+        await self.queues["upsert"].put({**item, "vectors": vectors, "timings": {"embed": time.perf_counter() - t0}})
+
+    async def _upsert(self, item: Dict[str, Any]):
+        f = item["file"]
+        points = build_points(self.uploaded_by, f["path"], item["hashes"], item["texts"], item["vectors"], item["sections"])
+        t0 = time.perf_counter()
+        await self.p._retry(self.p.upsert, points)
+        timings = {**item["timings"], "upsert": time.perf_counter() - t0}
+        await self.store.batch_done(self.job_id, f["_id"], item["batch"], len(points), timings)
+        self.remaining[f["_id"]] -= 1
+        if self.remaining[f["_id"]] == 0:
+            await self._complete(f)
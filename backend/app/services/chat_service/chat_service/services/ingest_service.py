@@ -1,62 +1,171 @@
+import asyncio
 from pathlib import Path
+from typing import Any, Dict, List, Optional
 from uuid import uuid4
 from shared.config import settings
-import httpx
+from shared.logger import get_logger
+from shared.uploads import spool_upload
 
-# optional OCR libraries will be used if installed
-Image = None
+from .ingest_pipeline import IngestJobStore, IngestPipeline
 
-# langchain utilities if available
-try:
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
-    from langchain.vectorstores import Qdrant
-except Exception:
-    RecursiveCharacterTextSplitter = None
-    Qdrant = None
+logger = get_logger(__name__)
 
 
 class IngestService:
-    def __init__(self):
+    def __init__(self, pipeline: Optional[IngestPipeline] = None):
         self.upload_dir = Path(settings.UPLOAD_DIR)
         self.upload_dir.mkdir(parents=True, exist_ok=True)
-        self.qdrant = None
-        if Qdrant:
-            try:
-                self.qdrant = Qdrant(url=settings.QDRANT_URL, prefer_grpc=False, collection_name=settings.QDRANT_COLLECTION)
-            except Exception:
-                self.qdrant = None
+        self.pipeline = pipeline or IngestPipeline()
+        self.jobs: IngestJobStore = self.pipeline.store
+        self._running: Dict[str, asyncio.Task] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        # "celery": hand jobs to the worker's ingest queues instead of running them in this process
+        self.executor = settings.INGEST_EXECUTOR
+        self._celery = None
+
+    async def save_upload(self, file, uploaded_by: str) -> Dict[str, Any]:
+        """Spool the upload to disk and report whether this user already sent the same bytes.
 
-    async def save_upload(self, file, uploaded_by: str) -> str:
+        Raises ``shared.uploads.UploadTooLarge`` beyond ``UPLOAD_MAX_BYTES``.
+        """
         ext = Path(file.filename).suffix or ""
         fname = f"{uuid4().hex}{ext}"
         dest = self.upload_dir / fname
-        contents = await file.read()
-        with open(dest, "wb") as f:
-            f.write(contents)
-        return str(dest)
-
-    def _extract_text(self, filepath: str) -> str:
-        # basic extraction: read as text only; images handled via dedicated OCR endpoint
-        p = Path(filepath)
+        spooled = await spool_upload(file, dest=str(dest))
+        saved = {"filepath": spooled.path, "sha256": spooled.sha256, "size": spooled.size, "duplicate": False}
         try:
-            return Path(filepath).read_text(errors="ignore")
+            uploads = self.jobs.db["uploads"]
+            existing = await uploads.find_one({"sha256": spooled.sha256, "uploaded_by": uploaded_by})
+            if existing and Path(existing["path"]).exists():
+                spooled.remove()
+                return {**saved, "filepath": existing["path"], "duplicate": True}
+            await uploads.insert_one({"sha256": spooled.sha256, "uploaded_by": uploaded_by, "path": spooled.path, "size": spooled.size, "filename": file.filename})
         except Exception:
-            return ""
-
-    def ingest_file(self, filepath: str, uploaded_by: str):
-        text = self._extract_text(filepath)
-        if not text:
-            return
-        if RecursiveCharacterTextSplitter and self.qdrant:
-            splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=100)
-            docs = splitter.split_text(text)
+            pass
+        return saved
+
+    async def resolve_paths(self, paths: List[str], uploaded_by: str) -> List[str]:
+        """Expand files/directories under ``UPLOAD_DIR`` to the caller's own uploads.
+
+        Every user's uploads share the directory, so only files recorded in
+        ``uploads`` for ``uploaded_by`` are returned: a directory expands to
+        those, and naming anyone else's file (or anything outside the
+        directory) raises ``ValueError``.
+        """
+        root = self.upload_dir.resolve()
+        own = set()
+        async for u in self.jobs.db["uploads"].find({"uploaded_by": uploaded_by}, {"path": 1}):
+            own.add(str(Path(u["path"]).resolve()))
+        out: List[str] = []
+        for raw in paths:
+            p = (root / raw).resolve()
+            if p != root and root not in p.parents:
+                raise ValueError(f"path outside upload dir: {raw}")
+            if p.is_dir():
+                out.extend(str(f) for f in sorted(p.rglob("*")) if f.is_file() and str(f) in own)
+            elif p.is_file() and str(p) in own:
+                out.append(str(p))
+            else:
+                # Same answer for a missing file and someone else's, so neither can be probed
+                raise ValueError(f"no such file: {raw}")
+        return out
+
+    async def submit(self, paths: List[str], uploaded_by: str, priority: str = "bulk") -> str:
+        """Create a job and start it; ``priority`` is "interactive" (single uploads) or "bulk"."""
+        job_id = await self.jobs.create_job(paths, uploaded_by, priority=priority)
+        await self.start(job_id)
+        return job_id
+
+    def _celery_app(self):
+        if self._celery is None:
+            from celery import Celery
+            self._celery = Celery("chat_service", broker=settings.CELERY_BROKER_URL)
+        return self._celery
+
+    async def _dispatch(self, job_id: str) -> bool:
+        job = await self.jobs.get_job(job_id)
+        if not job:
+            return False
+        priority = job.get("priority") or "bulk"
+        queue = settings.INGEST_INTERACTIVE_QUEUE if priority == "interactive" else settings.INGEST_BULK_QUEUE
+        # The worker claims the job itself; a duplicate message is a no-op there
+        await asyncio.to_thread(self._celery_app().send_task, "ingest.job", args=[job_id, priority], queue=queue)
+        await self.jobs.mark_dispatched(job_id)
+        return True
+
+    async def start(self, job_id: str) -> bool:
+        if self.executor == "celery":
+            return await self._dispatch(job_id)
+        if job_id in self._running or not await self.jobs.claim(job_id):
+            return False
+        task = asyncio.get_running_loop().create_task(self._run(job_id))
+        self._running[job_id] = task
+        task.add_done_callback(lambda _: self._running.pop(job_id, None))
+        return True
+
+    async def _run(self, job_id: str):
+        try:
+            await self.pipeline.run(job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"ingest_job_error job={job_id} error={e}")
+
+    async def retry(self, job_id: str) -> int:
+        if job_id in self._running:
+            return 0
+        requeued = await self.jobs.requeue_failed(job_id)
+        if requeued:
+            await self.start(job_id)
+        return requeued
+
+    async def resume_abandoned(self) -> List[str]:
+        """Restart jobs left queued, or whose owner stopped heart-beating (crash).
+
+        With the Celery executor only queued jobs whose message never went
+        out are re-sent; recovering running work is left to Celery.
+        """
+        resumed = []
+        abandoned = self.jobs.undispatched_jobs() if self.executor == "celery" else self.jobs.abandoned_jobs()
+        for job_id in await abandoned:
+            if await self.start(job_id):
+                resumed.append(job_id)
+        if resumed:
+            logger.info(f"ingest_resumed jobs={resumed}")
+        return resumed
+
+    async def _sweep(self):
+        while True:
+            try:
+                await self.resume_abandoned()
+            except Exception as e:
+                logger.error(f"ingest_sweep_error error={e}")
+            await asyncio.sleep(settings.INGEST_LEASE_SECONDS)
+
+    def start_sweeper(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep())
+
+    async def job_status(self, job_id: str, file_limit: int = 100) -> Optional[Dict[str, Any]]:
+        job = await self.jobs.get_job(job_id)
+        if not job:
+            return None
+        job["job_id"] = job.pop("_id")
+        job["running_here"] = job_id in self._running
+        job["failed"] = await self.jobs.list_files(job_id, status="failed", limit=file_limit)
+        job["files"] = await self.jobs.list_files(job_id, limit=file_limit)
+        return job
+
+    async def aclose(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        tasks = dict(self._running)
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        for job_id in tasks:
             try:
-                vectors = []
-                with httpx.Client(timeout=30.0) as client:
-                    for d in docs:
-                        r = client.post(settings.AI_SERVICE_URL.rstrip("/") + "/api/v1/embed", json={"text": d})
-                        v = r.json().get("vector", [])
-                        vectors.append(v)
-                self.qdrant.upsert(points=[{"id": uuid4().hex, "vector": v, "payload": {"source": filepath}} for v in vectors])
+                await self.jobs.release(job_id)
             except Exception:
                 pass
+        await self.pipeline.aclose()
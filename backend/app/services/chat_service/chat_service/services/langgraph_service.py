@@ -1,4 +1,10 @@
-from typing import Dict, Any, Optional
+import asyncio
+from typing import Dict, Any, List, Optional
+
+from bson import ObjectId
+
+from shared.config import settings
+from shared.logger import get_logger
 
 try:
     import langgraph  # optional
@@ -7,15 +13,50 @@ except Exception:
     HAS_LANGGRAPH = False
 
 try:
-    from shared.mongo_repo import MongoRepo
+    from shared.mongo_repo import AsyncMongoRepo
     HAS_MONGO = True
 except Exception:
     HAS_MONGO = False
 
+logger = get_logger(__name__)
+
+
+class GraphTurn:
+    """One conversation turn (conversation, graph nodes/edges, messages) built in memory.
+
+    Ids are generated client-side so edges can reference nodes before anything
+    is written; the whole turn is then flushed in a single batch.
+    """
+
+    def __init__(self, conv_id: Optional[str] = None):
+        self.conv_id = conv_id
+        self.docs: Dict[str, List[Dict[str, Any]]] = {"conversations": [], "graph_nodes": [], "graph_edges": [], "messages": []}
+
+    def open_conversation(self, user_id: str, title: str | None = None) -> str:
+        oid = ObjectId()
+        self.conv_id = str(oid)
+        self.docs["conversations"].append({"_id": oid, "user_id": user_id, "title": title})
+        return self.conv_id
+
+    def node(self, node_type: str, content: str, metadata: Dict[str, Any] | None = None) -> str:
+        oid = ObjectId()
+        self.docs["graph_nodes"].append({"_id": oid, "conv_id": self.conv_id, "node_type": node_type, "content": content, "metadata": metadata or {}})
+        return str(oid)
+
+    def edge(self, from_node: str, to_node: str, relation: str, metadata: Dict[str, Any] | None = None) -> str:
+        oid = ObjectId()
+        self.docs["graph_edges"].append({"_id": oid, "conv_id": self.conv_id, "from_node": from_node, "to_node": to_node, "relation": relation, "metadata": metadata or {}})
+        return str(oid)
+
+    def message(self, sender: str, content: str, metadata: Dict[str, Any] | None = None) -> str:
+        oid = ObjectId()
+        self.docs["messages"].append({"_id": oid, "conv_id": self.conv_id, "sender": sender, "content": content, "metadata": metadata or {}})
+        return str(oid)
+
 
 class LangGraphService:
-    def __init__(self):
-        self.repo = MongoRepo() if HAS_MONGO else None
+    def __init__(self, repo=None):
+        self.repo = repo or (AsyncMongoRepo() if HAS_MONGO else None)
         self.use_langgraph = HAS_LANGGRAPH
         if self.use_langgraph:
             try:
@@ -23,27 +64,77 @@ class LangGraphService:
             except Exception:
                 self.client = None
                 self.use_langgraph = False
+        # Write-behind queue: turns are flushed off the request path
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.counters = {"written_turns": 0, "retries": 0, "dropped_turns": 0}
+
+    async def _write(self, turns: List[GraphTurn], retries: Optional[int] = None):
+        """Insert ``turns``, retrying with exponential backoff; counts what is finally dropped."""
+        if not self.repo:
+            return
+        retries = settings.GRAPH_WRITE_RETRIES if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                await self.repo.insert_turns([t.docs for t in turns])
+                self.counters["written_turns"] += len(turns)
+                return
+            except Exception as e:
+                if attempt == retries:
+                    self.counters["dropped_turns"] += len(turns)
+                    logger.error(f"graph_write_dropped turns={len(turns)} attempts={attempt + 1} dropped_total={self.counters['dropped_turns']} error={e}")
+                    return
+                self.counters["retries"] += 1
+                delay = settings.GRAPH_WRITE_RETRY_BACKOFF * 2 ** attempt
+                logger.warning(f"graph_write_retry turns={len(turns)} attempt={attempt + 1} delay={delay:.1f}s error={e}")
+                await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "queued": self._queue.qsize() if self._queue is not None else 0}
 
-    def record_node(self, conv_id: str, node_type: str, content: str, metadata: Dict[str, Any] | None = None) -> Optional[int]:
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(maxsize=settings.GRAPH_WRITE_QUEUE_SIZE)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, turn: GraphTurn):
+        """Queue a turn for writing; waits briefly when the queue is full (backpressure)."""
+        self._ensure_worker()
         try:
-            if self.repo:
-                return self.repo.create_graph_node(conv_id=conv_id, node_type=node_type, content=content, metadata=metadata or {})
-        except Exception:
-            pass
-        return None
+            await asyncio.wait_for(self._queue.put(turn), timeout=settings.GRAPH_WRITE_ENQUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Writer is saturated: persist this turn ourselves rather than drop it.
+            # One attempt only: backing off here would hold up the request.
+            logger.warning("graph_write_queue_full; writing inline")
+            await self._write([turn], retries=0)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < settings.GRAPH_WRITE_BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
 
-    def record_edge(self, conv_id: str, from_node: int, to_node: int, relation: str, metadata: Dict[str, Any] | None = None) -> Optional[int]:
+    async def aclose(self):
+        """Flush queued turns and stop the writer."""
+        if self._worker is None:
+            return
+        await self._queue.join()
+        self._worker.cancel()
         try:
-            if self.repo:
-                return self.repo.create_graph_edge(conv_id=conv_id, from_node=from_node, to_node=to_node, relation=relation, metadata=metadata or {})
-        except Exception:
+            await self._worker
+        except asyncio.CancelledError:
             pass
-        return None
+        self._worker = None
 
-    def get_graph(self, conv_id: str):
+    async def get_graph(self, conv_id: str):
         if self.use_langgraph and getattr(self, "client", None):
             # TODO: fetch from langgraph client and convert to dict
             pass
         if self.repo:
-            return self.repo.get_graph(conv_id)
+            return await self.repo.get_graph(conv_id)
         return {"nodes": [], "edges": []}
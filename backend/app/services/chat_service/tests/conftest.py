@@ -0,0 +1,4 @@
+import os
+
+# No model hub in CI: chunk by estimate rather than fail loading the embedder's tokenizer
+os.environ.setdefault("CHUNK_TOKENIZER", "approx")
@@ -0,0 +1,48 @@
+import asyncio
+import base64
+import json
+import time
+
+import httpx
+
+from chat_service.core.auth import TokenVerifier
+
+
+def _token(exp):
+    def part(d):
+        return base64.urlsafe_b64encode(json.dumps(d).encode()).rstrip(b"=").decode()
+
+    # Signed by user_service with a key this service does not hold
+    return f"{part({'alg': 'HS256'})}.{part({'sub': 'u1', 'exp': exp})}.c2ln"
+
+
+def _verifier(handler):
+    verifier = TokenVerifier()
+    verifier._client = httpx.AsyncClient(base_url="http://users", transport=httpx.MockTransport(handler))
+    return verifier
+
+
+def test_remote_fallback_caches_until_token_exp():
+    exp = int(time.time()) + 30
+    verifier = _verifier(lambda request: httpx.Response(200, json={"id": "u1", "email": "a@b.c"}))
+    profile = asyncio.run(verifier.verify(_token(exp)))
+    assert profile["id"] == "u1"
+    assert verifier.identities[_token(exp)]["exp"] == exp
+
+
+def test_only_a_401_is_negative_cached():
+    status = {"code": 503}
+
+    def handler(request):
+        if status["code"] == 0:
+            raise httpx.ConnectTimeout("slow", request=request)
+        return httpx.Response(status["code"])
+
+    verifier = _verifier(handler)
+    token = _token(int(time.time()) + 60)
+    for status["code"] in (503, 0):
+        assert asyncio.run(verifier.verify(token)) is None
+        assert token not in verifier.rejected
+    status["code"] = 401
+    assert asyncio.run(verifier.verify(token)) is None
+    assert token in verifier.rejected
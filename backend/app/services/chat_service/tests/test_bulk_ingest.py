@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from chat_service.services.ingest_pipeline import IngestJobStore, IngestPipeline
+from chat_service.services.ingest_service import IngestService
+
+
+def test_bulk_ingest_takes_only_the_callers_uploads(tmp_path):
+    mine, theirs = tmp_path / "a1.txt", tmp_path / "b2.txt"
+    mine.write_text("my notes")
+    theirs.write_text("another patient's record")
+
+    async def run():
+        db = AsyncMongoMockClient()["test"]
+        service = IngestService(pipeline=IngestPipeline(store=IngestJobStore(db=db)))
+        service.upload_dir = tmp_path
+        await db["uploads"].insert_many([{"uploaded_by": "u1", "path": str(mine)}, {"uploaded_by": "u2", "path": str(theirs)}])
+        everything = await service.resolve_paths(["."], "u1")
+        with pytest.raises(ValueError):
+            await service.resolve_paths(["b2.txt"], "u1")
+        with pytest.raises(ValueError):
+            await service.resolve_paths(["../"], "u1")
+        return everything, await service.resolve_paths(["b2.txt"], "u2")
+
+    everything, own = asyncio.run(run())
+    assert everything == [str(mine.resolve())]
+    assert own == [str(theirs.resolve())]
@@ -0,0 +1,60 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from shared.config import settings
+from shared.mongo_repo import AsyncMongoRepo
+from chat_service.services.langgraph_service import GraphTurn, LangGraphService
+
+
+def test_turns_are_written_behind():
+    async def run():
+        repo = AsyncMongoRepo(db=AsyncMongoMockClient()["test"])
+        lg = LangGraphService(repo=repo)
+        turn = GraphTurn()
+        conv_id = turn.open_conversation(user_id="u1", title="Hello...")
+        user_node = turn.node(node_type="user", content="Hello")
+        gen_node = turn.node(node_type="generation", content="Hi")
+        turn.edge(from_node=user_node, to_node=gen_node, relation="asked_for")
+        turn.message(sender="user", content="Hello")
+        await lg.submit(turn)
+        await lg.aclose()
+        return conv_id, await lg.get_graph(conv_id), await repo.messages.count_documents({"conv_id": conv_id})
+
+    conv_id, graph, messages = asyncio.run(run())
+    assert [n["node_type"] for n in graph["nodes"]] == ["user", "generation"]
+    assert graph["edges"][0]["relation"] == "asked_for"
+    assert messages == 1
+
+
+def test_failed_writes_are_retried_then_counted_as_dropped(monkeypatch):
+    monkeypatch.setattr(settings, "GRAPH_WRITE_RETRY_BACKOFF", 0.0)
+    monkeypatch.setattr(settings, "GRAPH_WRITE_RETRIES", 2)
+
+    class FlakyRepo(AsyncMongoRepo):
+        def __init__(self, db, failures):
+            super().__init__(db=db)
+            self.failures = failures
+
+        async def insert_turns(self, turns):
+            # Half-written before failing: the retry must not trip over what already landed
+            await super().insert_turns([{"conversations": t["conversations"]} for t in turns])
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("mongo away")
+            await super().insert_turns(turns)
+
+    async def run(failures):
+        repo = FlakyRepo(AsyncMongoMockClient()["test"], failures)
+        lg = LangGraphService(repo=repo)
+        turn = GraphTurn()
+        conv_id = turn.open_conversation(user_id="u1", title="Hello...")
+        turn.message(sender="user", content="Hello")
+        await lg.submit(turn)
+        await lg.aclose()
+        return lg.stats(), await repo.messages.count_documents({"conv_id": conv_id})
+
+    stats, messages = asyncio.run(run(failures=2))
+    assert (stats["written_turns"], stats["retries"], stats["dropped_turns"], messages) == (1, 2, 0, 1)
+    stats, messages = asyncio.run(run(failures=3))
+    assert (stats["written_turns"], stats["retries"], stats["dropped_turns"], messages) == (0, 2, 1, 0)
@@ -0,0 +1,181 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from qdrant_client import AsyncQdrantClient
+
+from chat_service.services.ingest_pipeline import IngestJobStore, IngestPipeline
+from shared.ingest import FilePlan, IndexWriter, _chunk_hashes, build_points
+from shared.qdrant import EmbeddingDimensionMismatch
+
+
+def test_failed_file_resumes_from_last_completed_batch(tmp_path):
+    good = tmp_path / "good.txt"
+    good.write_text("\n".join(f"Guideline {i}: aspirin {i * 10} mg." for i in range(400)))
+    empty = tmp_path / "empty.txt"
+    empty.write_text("")
+    calls = []
+
+    async def embed(texts):
+        return [[float(len(t))] for t in texts]
+
+    async def upsert(points):
+        calls.append([p["id"] for p in points])
+        if len(calls) == 2:
+            raise RuntimeError("qdrant down")
+
+    async def run():
+        store = IngestJobStore(db=AsyncMongoMockClient()["test"])
+        pipeline = IngestPipeline(store=store, embed=embed, upsert=upsert)
+        pipeline.workers = dict.fromkeys(pipeline.workers, 1)
+        pipeline.batch_size = 4
+        pipeline.max_retries = 1
+        job_id = await store.create_job([str(good), str(empty)], uploaded_by="u1")
+        await store.claim(job_id)
+        first = await pipeline.run(job_id)
+        assert await store.requeue_failed(job_id) == 2
+        second = await pipeline.run(job_id)
+        return first, second, await store.get_job(job_id), await store.list_files(job_id)
+
+    first, second, job, files = asyncio.run(run())
+    assert (first, second) == ("failed", "partial")
+    by_path = {f["path"]: f for f in files}
+    assert by_path[str(good)]["status"] == "done"
+    assert by_path[str(empty)]["failed_stage"] == "extract"
+    # Batch 0 is not replayed on resume; the failed batch 1 is
+    assert calls[2] == calls[1]
+    assert calls.count(calls[0]) == 1
+    assert len(calls) == by_path[str(good)]["batches_total"] + 1
+    assert job["chunks_done"] == by_path[str(good)]["chunks"]
+
+
+def test_reindex_embeds_only_changed_chunks_and_deletes_removed(tmp_path):
+    doc = tmp_path / "guide.txt"
+    paragraphs = [f"Section {i}. " + f"Statin advice {i}. " * 30 for i in range(6)]
+    embedded, points, deleted = [], {}, []
+
+    async def embed(texts):
+        embedded.extend(texts)
+        return [[1.0] for _ in texts]
+
+    async def upsert(batch):
+        points.update({p["id"]: p for p in batch})
+
+    async def delete(ids, owner=None):
+        deleted.extend(ids)
+        for i in ids:
+            points.pop(i, None)
+
+    async def ingest(store, pipeline):
+        job_id = await store.create_job([str(doc)], uploaded_by="u1")
+        await store.claim(job_id)
+        return await pipeline.run(job_id)
+
+    async def run():
+        db = AsyncMongoMockClient()["test"]
+        store = IngestJobStore(db=db)
+        pipeline = IngestPipeline(store=store, embed=embed, upsert=upsert, delete=delete)
+        doc.write_text("\n\n".join(paragraphs))
+        await ingest(store, pipeline)
+        first = len(embedded)
+        await ingest(store, pipeline)
+        unchanged = len(embedded) - first
+        doc.write_text("\n\n".join(paragraphs[:-1] + ["Section 5 rewritten. " * 20]))
+        await ingest(store, pipeline)
+        return first, unchanged, len(embedded) - first
+
+    first, unchanged, changed = asyncio.run(run())
+    assert len(points) == first - len(deleted) + changed
+    assert unchanged == 0
+    assert 0 < changed < first
+    assert deleted and all(i not in points for i in deleted)
+
+
+def test_celery_dispatch_never_queues_a_file_or_counts_a_batch_twice():
+    async def run():
+        store = IngestJobStore(db=AsyncMongoMockClient()["test"])
+        job_id = await store.create_job(["a.txt", "b.txt"], uploaded_by="u1")
+        before = await store.undispatched_jobs()
+        await store.mark_dispatched(job_id)
+        after = await store.undispatched_jobs()
+        await store.claim(job_id)
+        first = await store.enqueue_pending(job_id)
+        # A re-claimed job (stale heartbeat) finds nothing left to queue
+        await store.jobs.update_one({"_id": job_id}, {"$set": {"status": "queued"}})
+        await store.claim(job_id)
+        second = await store.enqueue_pending(job_id)
+        for _ in range(2):
+            # Redelivered batch task
+            await store.batch_done(job_id, first[0], 0, 10, {"embed": 0.1})
+        return before, after, first, second, await store.get_job(job_id)
+
+    before, after, first, second, job = asyncio.run(run())
+    assert before and not after
+    assert len(first) == 2 and second == []
+    assert job["chunks_done"] == 10
+
+
+def test_batch_range_reads_only_its_slice(tmp_path):
+    doc = tmp_path / "guide.txt"
+    doc.write_text("\n\n".join(f"Paragraph {i}: give {i * 5} mg twice daily. " * 12 for i in range(20)))
+    hashes = _chunk_hashes(str(doc))
+
+    def plan(done=()):
+        return FilePlan(str(doc), hashes, [], set(hashes), 1, set(done), {}, {})
+
+    full = {n: h for n, h, _, _ in plan().iter_batches()}
+    part = [(n, h) for n, h, _, _ in plan(done={3}).iter_batches(2, 5)]
+    assert [n for n, _ in part] == [2, 4]
+    assert all(full[n] == h for n, h in part)
+    assert sorted(full) == list(range(plan().batches_total))
+
+
+def test_stalled_stage_keeps_its_lease(tmp_path, monkeypatch):
+    from shared.config import settings
+
+    doc = tmp_path / "slow.txt"
+    doc.write_text("Warfarin interacts with many antibiotics. " * 20)
+    monkeypatch.setattr(settings, "INGEST_LEASE_SECONDS", 0.15)
+    stolen = []
+
+    async def run():
+        store = IngestJobStore(db=AsyncMongoMockClient()["test"])
+
+        async def embed(texts):
+            # Stalls for several leases; another replica tries to take the job meanwhile
+            for _ in range(4):
+                await asyncio.sleep(0.1)
+                stolen.append(await store.claim(job_id))
+            return [[1.0] for _ in texts]
+
+        async def upsert(points):
+            pass
+
+        pipeline = IngestPipeline(store=store, embed=embed, upsert=upsert)
+        pipeline.heartbeat_every = 0.03
+        job_id = await store.create_job([str(doc)], uploaded_by="u1")
+        await store.claim(job_id)
+        return await pipeline.run(job_id)
+
+    assert asyncio.run(run()) == "done"
+    assert stolen == [False] * 4
+
+
+def test_writer_refuses_a_collection_of_another_vector_size():
+    async def run():
+        writer = IndexWriter()
+        writer.lexical = None
+        writer._qdrant = AsyncQdrantClient(":memory:")
+        points = build_points("u1", "a.txt", ["h1"], ["text"], [[0.1, 0.2, 0.3, 0.4]])
+        await writer.upsert(points)
+        name = next(iter(writer._collections))
+        info = await writer._qdrant.get_collection(name)
+        # A second writer with another model must not append to the same collection
+        other = IndexWriter()
+        other.lexical = None
+        other._qdrant = writer._qdrant
+        with pytest.raises(EmbeddingDimensionMismatch):
+            await other.upsert(build_points("u1", "a.txt", ["h2"], ["text"], [[0.1] * 8]))
+        return info.config.params.vectors.size
+
+    assert asyncio.run(run()) == 4
@@ -0,0 +1,25 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+
+from chat_service.services.chat_service import _busy, _retry_after
+
+
+def test_retry_after_accepts_seconds_and_dates():
+    soon = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert _retry_after(httpx.Headers({"Retry-After": "7"})) == 7
+    assert 25 <= _retry_after(httpx.Headers({"Retry-After": soon})) <= 30
+
+
+def test_missing_or_malformed_retry_after_falls_back():
+    assert _retry_after(httpx.Headers()) == 1
+    assert _retry_after(httpx.Headers({"Retry-After": "soon"})) == 1
+    assert _retry_after(httpx.Headers({"Retry-After": "-3"})) == 1
+
+
+def test_busy_without_retry_after_is_still_busy():
+    request = httpx.Request("POST", "http://ai/api/v1/generate")
+    error = httpx.HTTPStatusError("busy", request=request, response=httpx.Response(503, request=request))
+    busy = _busy(error)
+    assert busy.status == 503 and busy.retry_after == 1
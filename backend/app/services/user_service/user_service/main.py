@@ -1,16 +1,22 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from shared.logger import get_logger, setup_observability
-from shared.mongo import get_db
+from shared.mongo import get_async_db, close_async_mongo_client
 from shared.config import settings
 
 from user_service.api import auth
 from datetime import datetime
 
-app = FastAPI(title="User Service")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    close_async_mongo_client()
+
+
+app = FastAPI(title="User Service", lifespan=lifespan)
 setup_observability("user_service", app)
 logger = get_logger(__name__)
-db = get_db()
 
 # Add CORS middleware
 app.add_middleware(
@@ -28,7 +34,7 @@ app.include_router(auth.router, prefix="/auth", tags=["auth"])
 @app.get("/ping")
 async def ping():
     try:
-        db.command("ping")
+        await get_async_db().command("ping")
         return {"service": "user", "status": "ok", "db": {"connected": True}}
     except Exception as e:
         return {"service": "user", "status": "error", "db": {"connected": False, "error": str(e)}}
@@ -0,0 +1,237 @@
+import functools
+import io
+import os
+import re
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from .config import settings
+from .logger import get_logger
+
+logger = get_logger("shared.chunker")
+
+# (chunk text, section path such as "Medications > Dosage", or None before any heading)
+Chunk = Tuple[str, Optional[str]]
+
+_MARKDOWN_HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+# "HISTORY OF PRESENT ILLNESS:" / "ASSESSMENT AND PLAN"
+_CAPS_HEADING = re.compile(r"^[A-Z][A-Z0-9 ,/&()'-]{2,80}:?$")
+# "Chief Complaint:" alone on its line
+_LABEL_HEADING = re.compile(r"^[A-Z][A-Za-z0-9 ,/&()'-]{2,60}:$")
+# Plain-text headings nest under any markdown heading
+_TEXT_HEADING_LEVEL = 7
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+")
+
+
+def approx_tokens(text: str) -> int:
+    # ~4 characters per token for English WordPiece/BPE vocabularies
+    return max(1, (len(text) + 3) // 4)
+
+
+@functools.lru_cache(maxsize=4)
+def token_counter(model_name: Optional[str] = None) -> Callable[[str], int]:
+    """Token count under the embedding model's tokenizer (a Hub id or a local tokenizer.json / model dir).
+
+    ``approx`` opts into the ~4 chars/token estimate. Any other name that
+    cannot be loaded raises: estimated counts run short on codes, doses and
+    numbers, and chunks would overflow the embedder's sequence length.
+    Services call this at startup so a bad image or name fails fast.
+    """
+    model_name = model_name or settings.CHUNK_TOKENIZER
+    if not model_name or model_name == "approx":
+        return approx_tokens
+    try:
+        from tokenizers import Tokenizer
+
+        local = os.path.join(model_name, "tokenizer.json") if os.path.isdir(model_name) else model_name
+        tokenizer = Tokenizer.from_file(local) if os.path.isfile(local) else Tokenizer.from_pretrained(model_name)
+    except Exception as e:
+        raise RuntimeError(f"CHUNK_TOKENIZER {model_name!r} could not be loaded ({e}); install tokenizers or set CHUNK_TOKENIZER=approx") from e
+    tokenizer.no_truncation()
+    logger.info(f"chunk_tokenizer_loaded model={model_name}")
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def _heading(line: str) -> Optional[Tuple[int, str]]:
+    m = _MARKDOWN_HEADING.match(line)
+    if m:
+        return len(m.group(1)), m.group(2)
+    if len(line.split()) <= 10 and (_CAPS_HEADING.match(line) and any(c.isalpha() for c in line) or _LABEL_HEADING.match(line)):
+        return _TEXT_HEADING_LEVEL, line.rstrip(":").strip()
+    return None
+
+
+class Chunker:
+    """Splits text into chunks of at most ``max_tokens`` model tokens.
+
+    Input is consumed as a stream of lines: headings (markdown ``#``,
+    all-caps lines, ``Label:`` lines) close the current chunk and become the
+    ``section`` of the chunks that follow; blank lines separate paragraphs,
+    which are packed whole when they fit and split at sentence, then word,
+    boundaries when they do not. Consecutive chunks of a section share up to
+    ``overlap_tokens`` of trailing sentences. Only the current paragraph and
+    chunk are held, so memory stays flat however large the file is.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None, count_tokens: Optional[Callable[[str], int]] = None, read_size: Optional[int] = None):
+        self.max_tokens = max(16, max_tokens or settings.CHUNK_MAX_TOKENS)
+        self.overlap_tokens = max(0, min(overlap_tokens if overlap_tokens is not None else settings.CHUNK_OVERLAP_TOKENS, self.max_tokens // 2))
+        self.count = count_tokens or token_counter()
+        self.read_size = read_size or settings.CHUNK_READ_SIZE
+        # A "line" or paragraph longer than this is cut, so one giant line cannot exhaust memory
+        self.max_chars = self.max_tokens * 16
+
+    # ------------------------------------------------------------- reading
+
+    def _lines(self, fh) -> Iterator[str]:
+        rest = ""
+        while True:
+            block = fh.read(self.read_size)
+            if not block:
+                break
+            rest += block
+            lines = rest.split("\n")
+            rest = lines.pop()
+            yield from lines
+            while len(rest) > self.max_chars:
+                cut = rest.rfind(" ", 0, self.max_chars)
+                cut = cut if cut > 0 else self.max_chars
+                yield rest[:cut]
+                rest = rest[cut:].lstrip()
+        if rest:
+            yield rest
+
+    def _blocks(self, lines: Iterable[str]) -> Iterator[Tuple[str, object]]:
+        """("heading", (level, title)) and ("para", text) events."""
+        para: List[str] = []
+        size = 0
+        for raw in lines:
+            line = raw.strip()
+            if not line:
+                if para:
+                    yield "para", "\n".join(para)
+                    para, size = [], 0
+                continue
+            heading = _heading(line)
+            if heading:
+                if para:
+                    yield "para", "\n".join(para)
+                    para, size = [], 0
+                yield "heading", heading
+                continue
+            para.append(line)
+            size += len(line) + 1
+            if size > self.max_chars:
+                yield "para", "\n".join(para)
+                para, size = [], 0
+        if para:
+            yield "para", "\n".join(para)
+
+    # ------------------------------------------------------------- packing
+
+    def _pieces(self, text: str) -> Iterator[Tuple[str, int]]:
+        """``text`` as (piece, tokens) under ``max_tokens``: whole, by sentence, or by words."""
+        tokens = self.count(text)
+        if tokens < self.max_tokens:
+            yield text, tokens
+            return
+        for sentence in _SENTENCE_END.split(text):
+            tokens = self.count(sentence)
+            if tokens < self.max_tokens:
+                yield sentence, tokens
+                continue
+            words = sentence.split()
+            # Estimate words per window from this sentence's density, then verify
+            limit = self.max_tokens - 1
+            step = max(1, int(len(words) * limit / tokens))
+            i = 0
+            while i < len(words):
+                take = step
+                window = " ".join(words[i:i + take])
+                while take > 1 and self.count(window) > limit:
+                    take = max(1, take * 3 // 4)
+                    window = " ".join(words[i:i + take])
+                tokens = self.count(window)
+                while tokens > limit:
+                    # A single "word" longer than a chunk (base64, a table row without spaces)
+                    cut = max(1, len(window) * limit // tokens)
+                    yield window[:cut], self.count(window[:cut])
+                    window = window[cut:]
+                    tokens = self.count(window)
+                yield window, tokens
+                i += take
+
+    def _tail(self, pieces: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        if not self.overlap_tokens or not pieces:
+            return []
+        sentences = [s for s in _SENTENCE_END.split(pieces[-1][0]) if s]
+        carry: List[Tuple[str, int]] = []
+        budget = self.overlap_tokens
+        for sentence in reversed(sentences[1:] if len(pieces) == 1 else sentences):
+            tokens = self.count(sentence)
+            if tokens + 1 > budget:
+                break
+            carry.insert(0, (sentence, tokens + 1))
+            budget -= tokens
+        return carry
+
+    def _chunks(self, blocks: Iterable[Tuple[str, object]]) -> Iterator[Chunk]:
+        stack: List[Tuple[int, str]] = []
+        section: Optional[str] = None
+        pieces: List[Tuple[str, int]] = []
+        carried = 0  # leading pieces that only repeat the previous chunk
+        used = 0
+
+        def emit() -> Optional[Chunk]:
+            if len(pieces) <= carried:
+                return None
+            return "\n\n".join(p for p, _ in pieces), section
+
+        for kind, value in blocks:
+            if kind == "heading":
+                chunk = emit()
+                if chunk:
+                    yield chunk
+                pieces, carried, used = [], 0, 0
+                level, title = value
+                while stack and stack[-1][0] >= level:
+                    stack.pop()
+                stack.append((level, title))
+                section = " > ".join(t for _, t in stack)
+                continue
+            for piece, tokens in self._pieces(value):
+                # One token per piece for the separator it is joined with
+                tokens += 1
+                if pieces and used + tokens > self.max_tokens:
+                    chunk = emit()
+                    if chunk:
+                        yield chunk
+                    pieces = self._tail(pieces)
+                    used = sum(t for _, t in pieces)
+                    if used + tokens > self.max_tokens:
+                        pieces, used = [], 0
+                    carried = len(pieces)
+                pieces.append((piece, tokens))
+                used += tokens
+        chunk = emit()
+        if chunk:
+            yield chunk
+
+    # ----------------------------------------------------------------- api
+
+    def iter_file(self, path: str) -> Iterator[Chunk]:
+        with open(path, "r", encoding="utf-8", errors="ignore") as fh:
+            yield from self._chunks(self._blocks(self._lines(fh)))
+
+    def split(self, text: str) -> List[Chunk]:
+        return list(self._chunks(self._blocks(self._lines(io.StringIO(text)))))
+
+
+def has_text(path: str, read_size: int = 1 << 16) -> bool:
+    """Whether the file holds any non-whitespace text, reading only as far as the first."""
+    with open(path, "r", encoding="utf-8", errors="ignore") as fh:
+        while True:
+            block = fh.read(read_size)
+            if not block:
+                return False
+            if block.strip():
+                return True
@@ -0,0 +1,95 @@
+import hashlib
+import re
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from .config import settings
+from .mongo import get_async_db
+
+# Fixed namespace so the same (owner, content) maps to the same point id everywhere
+CHUNK_NAMESPACE = uuid.UUID("6f1c2a4e-93b5-5d0e-9a57-2c1d8e0b7f31")
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_point_id(owner: Optional[str], digest: str) -> str:
+    # Scoped by owner so one user's chunk never overwrites another's payload
+    return str(uuid.uuid5(CHUNK_NAMESPACE, f"{owner or ''}:{digest}"))
+
+
+# Payload fields retrieval filters on; Qdrant gets a keyword index on each
+PAYLOAD_INDEX_FIELDS = ("metadata.user_id", "metadata.source")
+
+
+def collection_for(owner: Optional[str], base: Optional[str] = None) -> str:
+    """The Qdrant collection holding ``owner``'s chunks under ``QDRANT_TENANCY``."""
+    base = base or settings.QDRANT_COLLECTION
+    if settings.QDRANT_TENANCY != "collection" or not owner:
+        return base
+    return f"{base}__{re.sub(r'[^A-Za-z0-9_-]', '_', owner)}"
+
+
+def retrieval_owners(user_id: str) -> List[str]:
+    """Owners whose chunks ``user_id`` may retrieve: their own plus ``RAG_SHARED_OWNER``."""
+    owners = [user_id]
+    if settings.RAG_SHARED_OWNER and settings.RAG_SHARED_OWNER != user_id:
+        owners.append(settings.RAG_SHARED_OWNER)
+    return owners
+
+
+class ChunkManifest:
+    """Which chunk hashes each source currently contributes to the vector store.
+
+    One document per ``(owner, source)`` in ``chunk_manifests``. Comparing a
+    fresh split against it yields the chunks to embed and the ones to delete;
+    a removed hash is only deleted once no other source of the same owner
+    still lists it.
+    """
+
+    def __init__(self, db=None):
+        self._db = db
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = get_async_db()
+        return self._db
+
+    @property
+    def manifests(self):
+        return self.db["chunk_manifests"]
+
+    @staticmethod
+    def _key(owner: Optional[str], source: str) -> str:
+        return f"{owner or ''}:{source}"
+
+    async def get(self, owner: Optional[str], source: str) -> List[str]:
+        doc = await self.manifests.find_one({"_id": self._key(owner, source)})
+        return (doc or {}).get("chunks", [])
+
+    async def diff(self, owner: Optional[str], source: str, hashes: List[str]) -> Tuple[List[str], List[str]]:
+        """(added, removed) hashes relative to what ``source`` last indexed."""
+        old = set(await self.get(owner, source))
+        new = set(hashes)
+        return [h for h in hashes if h not in old], [h for h in old if h not in new]
+
+    async def orphans(self, owner: Optional[str], source: str, removed: List[str]) -> List[str]:
+        if not removed:
+            return []
+        shared = await self.manifests.distinct("chunks", {
+            "owner": owner,
+            "_id": {"$ne": self._key(owner, source)},
+            "chunks": {"$in": removed},
+        })
+        keep = set(shared)
+        return [h for h in removed if h not in keep]
+
+    async def save(self, owner: Optional[str], source: str, hashes: List[str]):
+        await self.manifests.update_one(
+            {"_id": self._key(owner, source)},
+            {"$set": {"owner": owner, "source": source, "chunks": hashes, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
@@ -20,20 +20,63 @@ class Settings(BaseSettings):
     # Qdrant
     QDRANT_URL: str = os.getenv("QDRANT_URL", "http://localhost:6333")
     QDRANT_COLLECTION: str = os.getenv("QDRANT_COLLECTION", "docs")
+    # "shared": one collection filtered by owner; "collection": one collection per owner
+    QDRANT_TENANCY: str = os.getenv("QDRANT_TENANCY", "shared")
+    # Owner whose documents every user can retrieve (e.g. a reference corpus); empty = none
+    RAG_SHARED_OWNER: str = os.getenv("RAG_SHARED_OWNER", "")
+    # Record per-chunk term statistics (lexical_docs) on every upsert, for hybrid search
+    LEXICAL_INDEX: bool = os.getenv("LEXICAL_INDEX", "1") not in ("0", "false", "False")
 
     # Models & embeddings
-    MODEL_BACKEND: str = os.getenv("MODEL_BACKEND", "hf")  # hf or ollama
+    # ai_service generation backend: ollama, openai (OpenRouter/vLLM at AI_AGENT_BASE_URL) or stub
+    MODEL_BACKEND: str = os.getenv("MODEL_BACKEND", "ollama")
     HF_MODEL: str = os.getenv("HF_MODEL", "gpt2")
     OLLAMA_URL: str = os.getenv("OLLAMA_URL", "http://localhost:11434")
     OLLAMA_MODEL: str = os.getenv("OLLAMA_MODEL", "llama2")
     EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
     AI_SERVICE_URL: str = os.getenv("AI_SERVICE_URL", "http://localhost:8004")
+    EMBED_BATCH_SIZE: int = int(os.getenv("EMBED_BATCH_SIZE", 64))
     AI_AGENT_BASE_URL: str = os.getenv("AI_AGENT_BASE_URL", "https://openrouter.ai/api")
     AI_AGENT_API_KEY: str = os.getenv("AI_AGENT_API_KEY", os.getenv("OPENROUTER_API_KEY", ""))
     OPENROUTER_MODEL: str = os.getenv("OPENROUTER_MODEL", "openai/gpt-oss-20b:free")
 
+    # Conversation graph write-behind
+    GRAPH_WRITE_QUEUE_SIZE: int = int(os.getenv("GRAPH_WRITE_QUEUE_SIZE", 1000))
+    GRAPH_WRITE_BATCH_SIZE: int = int(os.getenv("GRAPH_WRITE_BATCH_SIZE", 50))
+    GRAPH_WRITE_ENQUEUE_TIMEOUT: float = float(os.getenv("GRAPH_WRITE_ENQUEUE_TIMEOUT", 1.0))
+    GRAPH_WRITE_RETRIES: int = int(os.getenv("GRAPH_WRITE_RETRIES", 5))
+    GRAPH_WRITE_RETRY_BACKOFF: float = float(os.getenv("GRAPH_WRITE_RETRY_BACKOFF", 0.5))
+
+    # Auth (chat_service token verification cache)
+    USER_SERVICE_URL: str = os.getenv("USER_SERVICE_URL", "http://localhost:8001")
+    AUTH_CACHE_TTL: float = float(os.getenv("AUTH_CACHE_TTL", 300))
+    AUTH_CACHE_MAXSIZE: int = int(os.getenv("AUTH_CACHE_MAXSIZE", 10000))
+    AUTH_NEGATIVE_CACHE_TTL: float = float(os.getenv("AUTH_NEGATIVE_CACHE_TTL", 30))
+    AUTH_REMOTE_TIMEOUT: float = float(os.getenv("AUTH_REMOTE_TIMEOUT", 3.0))
+
     # Uploads
     UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "/app/data/uploads")
+    UPLOAD_MAX_BYTES: int = int(os.getenv("UPLOAD_MAX_BYTES", 100 * 1024 * 1024))
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+
+    # Bulk ingestion pipeline (chat_service)
+    INGEST_QUEUE_SIZE: int = int(os.getenv("INGEST_QUEUE_SIZE", 256))
+    INGEST_EXTRACT_WORKERS: int = int(os.getenv("INGEST_EXTRACT_WORKERS", 4))
+    INGEST_SPLIT_WORKERS: int = int(os.getenv("INGEST_SPLIT_WORKERS", 2))
+    INGEST_EMBED_WORKERS: int = int(os.getenv("INGEST_EMBED_WORKERS", 4))
+    INGEST_UPSERT_WORKERS: int = int(os.getenv("INGEST_UPSERT_WORKERS", 2))
+    INGEST_MAX_RETRIES: int = int(os.getenv("INGEST_MAX_RETRIES", 3))
+    INGEST_LEASE_SECONDS: float = float(os.getenv("INGEST_LEASE_SECONDS", 120))
+    # Chunk size in tokens of CHUNK_TOKENIZER ("approx" = ~4 chars/token); keep under the embedder's max sequence length
+    CHUNK_MAX_TOKENS: int = int(os.getenv("CHUNK_MAX_TOKENS", 200))
+    CHUNK_OVERLAP_TOKENS: int = int(os.getenv("CHUNK_OVERLAP_TOKENS", 32))
+    CHUNK_TOKENIZER: str = os.getenv("CHUNK_TOKENIZER", os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
+    CHUNK_READ_SIZE: int = int(os.getenv("CHUNK_READ_SIZE", 1024 * 1024))
+    # "local" runs jobs in chat_service; "celery" sends them to the worker's queues
+    INGEST_EXECUTOR: str = os.getenv("INGEST_EXECUTOR", "local")
+    CELERY_BROKER_URL: str = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
+    INGEST_INTERACTIVE_QUEUE: str = os.getenv("INGEST_INTERACTIVE_QUEUE", "ingest.interactive")
+    INGEST_BULK_QUEUE: str = os.getenv("INGEST_BULK_QUEUE", "ingest.bulk")
 
     # Misc
     CORS_ORIGINS: list = ["*"]
@@ -0,0 +1,416 @@
+import asyncio
+import time
+import uuid
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from .chunker import Chunker, has_text
+from .chunks import ChunkManifest, chunk_hash, chunk_point_id, collection_for
+from .config import settings
+from .lexical import LexicalStore
+from .logger import get_logger
+from .mongo import get_async_db
+from .qdrant import aensure_collection
+
+logger = get_logger("shared.ingest")
+
+STAGES = ("extract", "split", "embed", "upsert")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def check_text(filepath: str):
+    # basic extraction: files are read as text only; images handled via dedicated OCR endpoint
+    if not has_text(filepath):
+        raise ValueError("no extractable text")
+
+
+def _unique_chunks(path: str) -> Iterator[Tuple[str, str, Optional[str]]]:
+    """(hash, text, section) for each chunk of the file, repeats dropped."""
+    seen: Set[str] = set()
+    for text, section in Chunker().iter_file(path):
+        digest = chunk_hash(text)
+        if digest not in seen:
+            seen.add(digest)
+            yield digest, text, section
+
+
+def _stale_before() -> datetime:
+    return _now() - timedelta(seconds=settings.INGEST_LEASE_SECONDS)
+
+
+class IngestJobStore:
+    """Job and per-file progress in Mongo (``ingest_jobs`` / ``ingest_files``).
+
+    A file records which embed batches have been upserted, so a resumed job
+    skips straight past them. Jobs carry a heartbeat; one whose heartbeat is
+    older than ``INGEST_LEASE_SECONDS`` is considered abandoned and can be
+    claimed by any replica.
+    """
+
+    def __init__(self, db=None):
+        self._db = db
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = get_async_db()
+        return self._db
+
+    @property
+    def jobs(self):
+        return self.db["ingest_jobs"]
+
+    @property
+    def files(self):
+        return self.db["ingest_files"]
+
+    async def create_job(self, paths: List[str], uploaded_by: str, priority: str = "bulk") -> str:
+        job_id = uuid.uuid4().hex
+        now = _now()
+        await self.jobs.insert_one({
+            "_id": job_id,
+            "uploaded_by": uploaded_by,
+            "priority": priority,
+            "status": "queued",
+            "total_files": len(paths),
+            "files_done": 0,
+            "files_failed": 0,
+            "chunks_done": 0,
+            "timings": {stage: 0.0 for stage in STAGES},
+            "created_at": now,
+            "updated_at": now,
+            "heartbeat_at": now,
+        })
+        if paths:
+            await self.files.insert_many([
+                {"_id": f"{job_id}:{i}", "job_id": job_id, "path": p, "status": "pending", "chunks": 0,
+                 "batches_total": None, "done_batches": [], "timings": {stage: 0.0 for stage in STAGES}, "error": None}
+                for i, p in enumerate(paths)
+            ], ordered=False)
+        return job_id
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.jobs.find_one({"_id": job_id})
+
+    async def get_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        return await self.files.find_one({"_id": file_id})
+
+    async def list_files(self, job_id: str, status: Optional[str] = None, limit: int = 0) -> List[Dict[str, Any]]:
+        query: Dict[str, Any] = {"job_id": job_id}
+        if status:
+            query["status"] = status
+        cursor = self.files.find(query, {"done_batches": 0}, sort=[("_id", 1)], limit=limit)
+        return await cursor.to_list(length=limit or None)
+
+    async def pending_files(self, job_id: str) -> List[Dict[str, Any]]:
+        return await self.files.find({"job_id": job_id, "status": {"$in": ["pending", "running"]}}).to_list(length=None)
+
+    async def claim(self, job_id: str) -> bool:
+        """Take ownership of a job that is new or whose owner stopped heart-beating."""
+        now = _now()
+        res = await self.jobs.find_one_and_update(
+            {"_id": job_id, "$or": [{"status": "queued"}, {"status": "running", "heartbeat_at": {"$lt": _stale_before()}}]},
+            {"$set": {"status": "running", "heartbeat_at": now, "updated_at": now}},
+        )
+        return res is not None
+
+    async def heartbeat(self, job_id: str):
+        await self.jobs.update_one({"_id": job_id, "status": "running"}, {"$set": {"heartbeat_at": _now()}})
+
+    @asynccontextmanager
+    async def keep_alive(self, job_id: str, interval: Optional[float] = None):
+        """Heartbeat the job every ``interval`` seconds (a third of the lease) while the block runs.
+
+        Progress alone does not move the heartbeat often enough: planning a
+        large file or a slow embed retry can outlast the lease, and another
+        replica would then claim the job and run it a second time.
+        """
+        interval = interval or settings.INGEST_LEASE_SECONDS / 3
+
+        async def beat():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.heartbeat(job_id)
+                except Exception as e:
+                    logger.warning(f"ingest_heartbeat_error job={job_id} error={e}")
+
+        task = asyncio.create_task(beat())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+    async def abandoned_jobs(self) -> List[str]:
+        cursor = self.jobs.find({"$or": [{"status": "queued"}, {"status": "running", "heartbeat_at": {"$lt": _stale_before()}}]}, {"_id": 1})
+        return [d["_id"] async for d in cursor]
+
+    async def undispatched_jobs(self) -> List[str]:
+        """Queued jobs not sent to the worker within the lease (``INGEST_EXECUTOR=celery``).
+
+        Running jobs are never returned: Celery redelivers the tasks of a
+        worker that died, and a job's heartbeat only moves while one of its
+        tasks is running, so a stale one is usually just waiting in the queue.
+        """
+        cursor = self.jobs.find({"status": "queued", "$or": [{"dispatched_at": None}, {"dispatched_at": {"$lt": _stale_before()}}]}, {"_id": 1})
+        return [d["_id"] async for d in cursor]
+
+    async def mark_dispatched(self, job_id: str):
+        await self.jobs.update_one({"_id": job_id, "status": "queued"}, {"$set": {"dispatched_at": _now()}})
+
+    async def enqueue_pending(self, job_id: str) -> List[str]:
+        """Ids of the job's pending files, marked running so a second claim cannot queue them again."""
+        ids = [d["_id"] async for d in self.files.find({"job_id": job_id, "status": "pending"}, {"_id": 1})]
+        if ids:
+            await self.files.update_many({"_id": {"$in": ids}, "status": "pending"}, {"$set": {"status": "running"}})
+        return ids
+
+    async def requeue_failed(self, job_id: str) -> int:
+        """Put failed files back in line; their completed batches are kept and skipped."""
+        res = await self.files.update_many({"job_id": job_id, "status": "failed"}, {"$set": {"status": "pending", "error": None, "failed_stage": None}})
+        if res.modified_count:
+            await self.jobs.update_one({"_id": job_id, "status": {"$ne": "running"}}, {
+                "$inc": {"files_failed": -res.modified_count},
+                "$set": {"status": "queued", "updated_at": _now()},
+                "$unset": {"dispatched_at": ""},
+            })
+        return res.modified_count
+
+    async def release(self, job_id: str):
+        # Hand an interrupted job back so the next sweep picks it up immediately
+        await self.jobs.update_one({"_id": job_id, "status": "running"}, {"$set": {"status": "queued", "updated_at": _now()}})
+
+    async def start_file(self, job_id: str, file_id: str, chunks: int, batches_total: int, timings: Dict[str, float], stats: Optional[Dict[str, int]] = None):
+        await self.files.update_one({"_id": file_id}, {
+            "$set": {"status": "running", "chunks": chunks, "batches_total": batches_total, **(stats or {})},
+            "$inc": {f"timings.{k}": v for k, v in timings.items()},
+        })
+        await self.jobs.update_one({"_id": job_id}, {
+            "$inc": {f"timings.{k}": v for k, v in timings.items()},
+            "$set": {"heartbeat_at": _now()},
+        })
+
+    async def batch_done(self, job_id: str, file_id: str, batch: int, chunks: int, timings: Dict[str, float]):
+        now = _now()
+        res = await self.files.update_one({"_id": file_id, "done_batches": {"$ne": batch}}, {
+            "$addToSet": {"done_batches": batch},
+            "$inc": {f"timings.{k}": v for k, v in timings.items()},
+        })
+        if not res.modified_count:
+            # A redelivered batch: already counted
+            await self.jobs.update_one({"_id": job_id}, {"$set": {"heartbeat_at": now}})
+            return
+        await self.jobs.update_one({"_id": job_id}, {
+            "$inc": {"chunks_done": chunks, **{f"timings.{k}": v for k, v in timings.items()}},
+            "$set": {"heartbeat_at": now, "updated_at": now},
+        })
+
+    async def finish_file(self, job_id: str, file_id: str, error: Optional[str] = None, stage: Optional[str] = None):
+        status = "failed" if error else "done"
+        res = await self.files.update_one(
+            {"_id": file_id, "status": {"$in": ["pending", "running"]}},
+            {"$set": {"status": status, "error": error, "failed_stage": stage}},
+        )
+        if res.modified_count:
+            counter = "files_failed" if error else "files_done"
+            await self.jobs.update_one({"_id": job_id}, {"$inc": {counter: 1}, "$set": {"updated_at": _now()}})
+
+    async def finish_job(self, job_id: str) -> str:
+        job = await self.get_job(job_id) or {}
+        done, failed = job.get("files_done", 0), job.get("files_failed", 0)
+        status = "done" if not failed else ("failed" if not done else "partial")
+        await self.jobs.update_one({"_id": job_id}, {"$set": {"status": status, "updated_at": _now(), "finished_at": _now()}})
+        return status
+
+    async def finish_job_if_complete(self, job_id: str) -> Optional[str]:
+        """Close the job once every file is done or failed (files may finish on different workers)."""
+        job = await self.get_job(job_id) or {}
+        if job.get("files_done", 0) + job.get("files_failed", 0) < job.get("total_files", 0):
+            return None
+        return await self.finish_job(job_id)
+
+
+class IndexWriter:
+    """Embeds (through ai_service's batch endpoint, or ``embed_fn`` in-process) and writes to Qdrant, over pooled clients."""
+
+    def __init__(self, embed_fn: Optional[Callable[[List[str]], List[List[float]]]] = None):
+        # Blocking; run in a thread. The worker passes its own model so bulk ingest stays off the API pods
+        self.embed_fn = embed_fn
+        self._http = None
+        self._qdrant = None
+        self._collections: set = set()
+        self.lexical = LexicalStore() if settings.LEXICAL_INDEX else None
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        if self.embed_fn is not None:
+            vectors = await asyncio.to_thread(self.embed_fn, texts)
+        else:
+            import httpx
+
+            if self._http is None or self._http.is_closed:
+                self._http = httpx.AsyncClient(base_url=settings.AI_SERVICE_URL.rstrip("/"), timeout=120.0)
+            r = await self._http.post("/api/v1/embed/batch", json={"texts": texts})
+            r.raise_for_status()
+            vectors = r.json().get("vectors") or []
+        if len(vectors) != len(texts):
+            raise ValueError(f"embed returned {len(vectors)} vectors for {len(texts)} texts")
+        return vectors
+
+    def _qdrant_client(self):
+        from qdrant_client import AsyncQdrantClient
+
+        if self._qdrant is None:
+            self._qdrant = AsyncQdrantClient(url=settings.QDRANT_URL, prefer_grpc=False)
+        return self._qdrant
+
+    async def _ensure_collection(self, name: str, dim: int):
+        # Per-owner collections appear on first write; laid out exactly as ai_service lays out its own
+        if name in self._collections:
+            return
+        if await aensure_collection(self._qdrant_client(), name, dim, source="the ingest embedder") and self.lexical is not None:
+            # Born with lexical_docs for every point; nothing for ai_service to backfill
+            await self.lexical.mark_backfilled(name)
+        self._collections.add(name)
+
+    async def upsert(self, points: List[Dict[str, Any]]):
+        from qdrant_client.http.models import PointStruct
+
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for p in points:
+            groups.setdefault(collection_for(p["payload"]["metadata"].get("user_id")), []).append(p)
+        for name, group in groups.items():
+            await self._ensure_collection(name, len(group[0]["vector"]))
+            await self._qdrant_client().upsert(
+                collection_name=name,
+                points=[PointStruct(**p) for p in group],
+                wait=True,
+            )
+            if self.lexical is not None:
+                await self.lexical.upsert(group, name)
+
+    async def delete(self, ids: List[str], owner: Optional[str] = None):
+        from qdrant_client.http.models import PointIdsList
+
+        await self._qdrant_client().delete(
+            collection_name=collection_for(owner),
+            points_selector=PointIdsList(points=ids),
+            wait=True,
+        )
+        if self.lexical is not None:
+            await self.lexical.delete(ids)
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._qdrant is not None:
+            try:
+                await self._qdrant.close()
+            except Exception:
+                pass
+            self._qdrant = None
+
+
+class FilePlan:
+    """What re-indexing one file involves: its chunk hashes, the batches still to
+    embed, and the hashes it no longer contains.
+
+    Only hashes are kept; chunk texts are re-read from the file batch by
+    batch, so a large file never sits in memory whole.
+    """
+
+    def __init__(self, path: str, hashes: List[str], removed: List[str], fresh: Set[str], batch_size: int, done_batches: Set[int], stats: Dict[str, int], timings: Dict[str, float]):
+        self.path = path
+        self.hashes = hashes
+        self.removed = removed
+        self.fresh = fresh
+        self.batch_size = batch_size
+        self.done_batches = done_batches
+        self.batches_total = (len(fresh) + batch_size - 1) // batch_size
+        # Batches left to embed
+        self.pending = sum(1 for n in range(self.batches_total) if n not in done_batches)
+        self.stats = stats
+        self.timings = timings
+
+    def iter_batches(self, first: int = 0, last: Optional[int] = None) -> Iterator[Tuple[int, List[str], List[str], List[Optional[str]]]]:
+        """``(batch, hashes, texts, sections)`` for every batch not yet done, streamed from the file.
+
+        ``first``/``last`` restrict it to batches ``first <= n < last``; only
+        their texts are kept, and reading stops after ``last``.
+        """
+        last = self.batches_total if last is None else min(last, self.batches_total)
+        batch: List[Tuple[str, str, Optional[str]]] = []
+        count = n = 0
+        for digest, text, section in _unique_chunks(self.path):
+            if digest not in self.fresh:
+                continue
+            if first <= n < last and n not in self.done_batches:
+                batch.append((digest, text, section))
+            count += 1
+            if count == self.batch_size:
+                if batch:
+                    yield n, [b[0] for b in batch], [b[1] for b in batch], [b[2] for b in batch]
+                batch, count, n = [], 0, n + 1
+                if n >= last and last < self.batches_total:
+                    return
+        if count:
+            if batch:
+                yield n, [b[0] for b in batch], [b[1] for b in batch], [b[2] for b in batch]
+            n += 1
+        if n != self.batches_total:
+            raise ValueError(f"file changed while it was being indexed: {self.path}")
+
+    async def abatches(self, first: int = 0, last: Optional[int] = None):
+        """``iter_batches`` with each read and split done off the event loop."""
+        it = self.iter_batches(first, last)
+        while True:
+            batch = await asyncio.to_thread(next, it, None)
+            if batch is None:
+                return
+            yield batch
+
+
+def _chunk_hashes(path: str) -> List[str]:
+    return [digest for digest, _, _ in _unique_chunks(path)]
+
+
+async def plan_file(manifest: ChunkManifest, owner: Optional[str], path: str, batch_size: int, done_batches: Optional[List[int]] = None) -> FilePlan:
+    """Chunk the file at ``path`` and diff its hashes against the source's manifest.
+
+    The manifest only changes once a file completes, so the diff (and the
+    batch numbering over it) is stable across resumes and ``done_batches``
+    can be skipped safely.
+    """
+    t0 = time.perf_counter()
+    hashes = await asyncio.to_thread(_chunk_hashes, path)
+    added, removed = await manifest.diff(owner, path, hashes)
+    stats = {"chunks_added": len(added), "chunks_removed": len(removed), "chunks_unchanged": len(hashes) - len(added)}
+    return FilePlan(path, hashes, removed, set(added), batch_size, set(done_batches or []), stats, {"split": time.perf_counter() - t0})
+
+
+def build_points(owner: Optional[str], path: str, hashes: List[str], texts: List[str], vectors: List[List[float]], sections: Optional[List[Optional[str]]] = None) -> List[Dict[str, Any]]:
+    sections = sections or [None] * len(hashes)
+    return [
+        {
+            "id": chunk_point_id(owner, digest),
+            "vector": vector,
+            # Same payload layout LangChain's Qdrant store reads back in ai_service
+            "payload": {"page_content": text, "metadata": {"source": path, "user_id": owner, "chunk_hash": digest, "section": section}},
+        }
+        for digest, text, vector, section in zip(hashes, texts, vectors, sections)
+    ]
+
+
+async def complete_file(store: IngestJobStore, manifest: ChunkManifest, delete, job_id: str, file_id: str, owner: Optional[str], path: str, hashes: List[str], removed: List[str]):
+    """Delete chunks no source of ``owner`` still lists, then commit the new manifest."""
+    orphans = await manifest.orphans(owner, path, removed)
+    if orphans:
+        await delete([chunk_point_id(owner, h) for h in orphans], owner)
+    await manifest.save(owner, path, hashes)
+    await store.finish_file(job_id, file_id)
@@ -0,0 +1,105 @@
+import asyncio
+import re
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from .mongo import get_async_db
+
+# Keeps drug names, ICD codes and dosages whole: "e11.9", "500mg", "5/325", "co-amoxiclav"
+_TOKEN = re.compile(r"[a-z0-9]+(?:[./-][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i in is it of on or that the this to was were what when which who with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall((text or "").lower()) if t not in _STOPWORDS]
+
+
+def lexical_doc(point: Dict[str, Any], collection: str) -> Dict[str, Any]:
+    """Term statistics for one Qdrant point (``id`` + LangChain-style ``payload``)."""
+    payload = point.get("payload") or {}
+    metadata = payload.get("metadata") or {}
+    counts = Counter(tokenize(payload.get("page_content", "")))
+    return {
+        "collection": collection,
+        "owner": metadata.get("user_id"),
+        "source": metadata.get("source"),
+        # [term, tf] pairs: terms like "e11.9" cannot be Mongo field names
+        "terms": [[term, tf] for term, tf in counts.items()],
+        "length": sum(counts.values()),
+        "deleted": False,
+    }
+
+
+def lexical_update(point: Dict[str, Any], collection: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """``(filter, update)`` upserting one point's term statistics."""
+    # Server clock, so pollers in every process compare against one time source
+    return {"_id": str(point["id"])}, {"$set": lexical_doc(point, collection), "$currentDate": {"updated_at": True}}
+
+
+def changes_query(since: Optional[datetime], overlap: float = 2.0) -> Dict[str, Any]:
+    """lexical_docs updated at or after ``since`` minus ``overlap`` seconds (all of them for ``None``)."""
+    return {} if since is None else {"updated_at": {"$gte": since - timedelta(seconds=overlap)}}
+
+
+def backfill_marker(collection: str, docs: int = 0) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """``(filter, update)`` recording that every point in ``collection`` has its lexical_docs."""
+    return {"_id": collection}, {"$set": {"docs": docs}, "$currentDate": {"done_at": True}}
+
+
+class LexicalStore:
+    """Per-chunk term statistics in ``lexical_docs``, written alongside every Qdrant upsert.
+
+    Each search process builds its in-memory BM25 postings from this
+    collection and then polls it for changes, so chunks indexed by any
+    ingestion worker become searchable without re-tokenising them there.
+    """
+
+    def __init__(self, db=None):
+        self._db = db
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = get_async_db()
+        return self._db
+
+    @property
+    def docs(self):
+        return self.db["lexical_docs"]
+
+    @property
+    def backfills(self):
+        return self.db["lexical_backfills"]
+
+    async def mark_backfilled(self, collection: str):
+        await self.backfills.update_one(*backfill_marker(collection), upsert=True)
+
+    async def upsert(self, points: List[Dict[str, Any]], collection: str):
+        await asyncio.gather(*(self.docs.update_one(*lexical_update(p, collection), upsert=True) for p in points))
+
+    async def delete(self, ids: List[str]):
+        if ids:
+            # Tombstones rather than deletes, so pollers see the removal
+            await self.docs.update_many(
+                {"_id": {"$in": [str(i) for i in ids]}},
+                {"$set": {"deleted": True, "terms": [], "length": 0}, "$currentDate": {"updated_at": True}},
+            )
+
+    async def purge_tombstones(self, older_than: float) -> int:
+        """Drop tombstones older than ``older_than`` seconds; pollers have applied them long before."""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=older_than)
+        result = await self.docs.delete_many({"deleted": True, "updated_at": {"$lt": cutoff}})
+        return result.deleted_count
+
+    async def changes(self, since: Optional[datetime], overlap: float = 2.0, batch_size: int = 1000):
+        """Documents updated at or after ``since`` minus ``overlap`` seconds, oldest first.
+
+        Applying a document twice is harmless, so the overlap simply covers
+        writes that commit slightly out of timestamp order.
+        """
+        cursor = self.docs.find(changes_query(since, overlap), sort=[("updated_at", 1)], batch_size=batch_size)
+        async for doc in cursor:
+            yield doc
@@ -2,12 +2,36 @@ from pymongo import MongoClient
 import os
 
 _client = None
+_async_client = None
+
+# "mongomock://" selects an in-memory backend (tests, benchmarks)
+MEMORY_URI_PREFIX = "mongomock://"
+
+
+def _uri() -> str:
+    return os.getenv("MONGO_URI", "mongodb://genai_mongo:27017")
+
+
+def _client_options() -> dict:
+    return {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000")),
+    }
+
 
 def get_mongo_client() -> MongoClient:
     global _client
     if _client is None:
-        uri = os.getenv("MONGO_URI", "mongodb://genai_mongo:27017")
-        _client = MongoClient(uri)
+        uri = _uri()
+        if uri.startswith(MEMORY_URI_PREFIX):
+            import mongomock
+            _client = mongomock.MongoClient()
+        else:
+            _client = MongoClient(uri, **_client_options())
     return _client
 
 def get_db(name: str = None):
@@ -15,6 +39,33 @@ def get_db(name: str = None):
     db_name = name or os.getenv("MONGO_DB", "genai_med")
     return client[db_name]
 
+
+def get_async_mongo_client():
+    """Process-wide Motor client; create it from within the running event loop."""
+    global _async_client
+    if _async_client is None:
+        uri = _uri()
+        if uri.startswith(MEMORY_URI_PREFIX):
+            from mongomock_motor import AsyncMongoMockClient
+            _async_client = AsyncMongoMockClient()
+        else:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            _async_client = AsyncIOMotorClient(uri, **_client_options())
+    return _async_client
+
+
+def get_async_db(name: str = None):
+    client = get_async_mongo_client()
+    db_name = name or os.getenv("MONGO_DB", "genai_med")
+    return client[db_name]
+
+
+def close_async_mongo_client():
+    global _async_client
+    if _async_client is not None:
+        _async_client.close()
+        _async_client = None
+
 def init_db(db=None):
     d = db or get_db()
     d["users"].create_index("email", unique=True)
@@ -24,3 +75,9 @@ def init_db(db=None):
     d["graph_nodes"].create_index("conv_id")
     d["graph_edges"].create_index("conv_id")
     d["graph_edges"].create_index([("from_node", 1), ("to_node", 1)])
+    d["uploads"].create_index([("sha256", 1), ("uploaded_by", 1)])
+    d["ingest_jobs"].create_index([("status", 1), ("heartbeat_at", 1)])
+    d["ingest_files"].create_index([("job_id", 1), ("status", 1)])
+    d["medical_data"].create_index([("user_id", 1), ("content_hash", 1)])
+    d["chunk_manifests"].create_index([("owner", 1), ("chunks", 1)])
+    d["lexical_docs"].create_index("updated_at")
@@ -1,5 +1,16 @@
-from typing import Dict, Any
-from .mongo import get_db
+from typing import Dict, Any, List, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import BulkWriteError
+
+from .mongo import get_db, get_async_db
+
+
+def _only_duplicates(e: BulkWriteError) -> bool:
+    # Documents carry their own _id, so a duplicate means an earlier attempt already wrote it
+    errors = e.details.get("writeErrors") or []
+    return bool(errors) and all(err.get("code") == 11000 for err in errors)
 
 
 class MongoRepo:
@@ -21,6 +32,13 @@ class MongoRepo:
         res = self.conversations.insert_one(doc)
         return str(res.inserted_id)
 
+    def get_conversation(self, conv_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            oid = ObjectId(conv_id)
+        except (InvalidId, TypeError):
+            return None
+        return self.conversations.find_one({"_id": oid})
+
     def create_message(self, conv_id: str, sender: str, content: str, metadata: Dict[str, Any] | None = None) -> str:
         doc = {"conv_id": conv_id, "sender": sender, "content": content, "metadata": metadata or {}}
         res = self.messages.insert_one(doc)
@@ -36,7 +54,104 @@ class MongoRepo:
         res = self.graph_edges.insert_one(doc)
         return str(res.inserted_id)
 
+    def insert_turns(self, turns: List[Dict[str, List[Dict[str, Any]]]]) -> None:
+        """Write pre-built conversation turns with one insert_many per collection.
+
+        Each turn maps a collection name (``conversations``, ``graph_nodes``,
+        ``graph_edges``, ``messages``) to documents that already carry their ``_id``,
+        so writing the same turns again after a partial failure is safe.
+        """
+        for name in ("conversations", "graph_nodes", "graph_edges", "messages"):
+            docs = [doc for turn in turns for doc in turn.get(name, [])]
+            if docs:
+                try:
+                    self.db[name].insert_many(docs, ordered=False)
+                except BulkWriteError as e:
+                    if not _only_duplicates(e):
+                        raise
+
     def get_graph(self, conv_id: str):
         nodes = list(self.graph_nodes.find({"conv_id": conv_id}, {"_id": 0}))
         edges = list(self.graph_edges.find({"conv_id": conv_id}, {"_id": 0}))
         return {"nodes": nodes, "edges": edges}
+
+
+class AsyncMongoRepo:
+    """Motor-backed counterpart of MongoRepo with the same methods, awaitable."""
+
+    def __init__(self, db=None):
+        self._db = db
+
+    @property
+    def db(self):
+        # Resolved on first use so the Motor client is created inside the event loop
+        if self._db is None:
+            self._db = get_async_db()
+        return self._db
+
+    @property
+    def users(self):
+        return self.db["users"]
+
+    @property
+    def conversations(self):
+        return self.db["conversations"]
+
+    @property
+    def messages(self):
+        return self.db["messages"]
+
+    @property
+    def graph_nodes(self):
+        return self.db["graph_nodes"]
+
+    @property
+    def graph_edges(self):
+        return self.db["graph_edges"]
+
+    async def create_user(self, username: str, email: str, password_hash: str, role: str = "user") -> str:
+        doc = {"username": username, "email": email, "password_hash": password_hash, "role": role}
+        res = await self.users.insert_one(doc)
+        return str(res.inserted_id)
+
+    async def create_conversation(self, user_id: str, title: str | None = None) -> str:
+        doc = {"user_id": user_id, "title": title}
+        res = await self.conversations.insert_one(doc)
+        return str(res.inserted_id)
+
+    async def get_conversation(self, conv_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            oid = ObjectId(conv_id)
+        except (InvalidId, TypeError):
+            return None
+        return await self.conversations.find_one({"_id": oid})
+
+    async def create_message(self, conv_id: str, sender: str, content: str, metadata: Dict[str, Any] | None = None) -> str:
+        doc = {"conv_id": conv_id, "sender": sender, "content": content, "metadata": metadata or {}}
+        res = await self.messages.insert_one(doc)
+        return str(res.inserted_id)
+
+    async def create_graph_node(self, conv_id: str, node_type: str, content: str, metadata: Dict[str, Any] | None = None) -> str:
+        doc = {"conv_id": conv_id, "node_type": node_type, "content": content, "metadata": metadata or {}}
+        res = await self.graph_nodes.insert_one(doc)
+        return str(res.inserted_id)
+
+    async def create_graph_edge(self, conv_id: str, from_node: str, to_node: str, relation: str, metadata: Dict[str, Any] | None = None) -> str:
+        doc = {"conv_id": conv_id, "from_node": from_node, "to_node": to_node, "relation": relation, "metadata": metadata or {}}
+        res = await self.graph_edges.insert_one(doc)
+        return str(res.inserted_id)
+
+    async def insert_turns(self, turns: List[Dict[str, List[Dict[str, Any]]]]) -> None:
+        for name in ("conversations", "graph_nodes", "graph_edges", "messages"):
+            docs = [doc for turn in turns for doc in turn.get(name, [])]
+            if docs:
+                try:
+                    await self.db[name].insert_many(docs, ordered=False)
+                except BulkWriteError as e:
+                    if not _only_duplicates(e):
+                        raise
+
+    async def get_graph(self, conv_id: str):
+        nodes = await self.graph_nodes.find({"conv_id": conv_id}, {"_id": 0}).to_list(length=None)
+        edges = await self.graph_edges.find({"conv_id": conv_id}, {"_id": 0}).to_list(length=None)
+        return {"nodes": nodes, "edges": edges}
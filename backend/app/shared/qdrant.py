@@ -0,0 +1,96 @@
+"""How every writer lays out a Qdrant collection.
+
+ai_service, chat_service and the worker all create collections on first
+write, so they share one definition: cosine vectors of the embedder's
+size, the payload indexes retrieval filters on (tenant-aware on
+``metadata.user_id`` under shared tenancy), and a refusal to write into an
+existing collection whose vectors have another size.
+"""
+
+from typing import Iterator, Optional, Tuple
+
+from .chunks import PAYLOAD_INDEX_FIELDS
+from .config import settings
+
+
+class EmbeddingDimensionMismatch(RuntimeError):
+    pass
+
+
+def _create_args(name: str, dim: int, tenancy: str) -> dict:
+    from qdrant_client.http.models import Distance, HnswConfigDiff, VectorParams
+
+    return {
+        "collection_name": name,
+        "vectors_config": VectorParams(size=dim, distance=Distance.COSINE),
+        # Extra per-owner graph links keep filtered HNSW search fast with many owners
+        "hnsw_config": HnswConfigDiff(payload_m=16) if tenancy == "shared" else None,
+    }
+
+
+def _index_schemas(tenancy: str) -> Iterator[Tuple[str, object]]:
+    from qdrant_client.http.models import KeywordIndexParams, PayloadSchemaType
+
+    for field in PAYLOAD_INDEX_FIELDS:
+        if field == "metadata.user_id" and tenancy == "shared":
+            # Tenant-aware index: Qdrant co-locates each owner's points on disk
+            yield field, KeywordIndexParams(type="keyword", is_tenant=True)
+        else:
+            yield field, PayloadSchemaType.KEYWORD
+
+
+def _check_size(name: str, info, dim: int, source: str):
+    size = getattr(info.config.params.vectors, "size", None)
+    if size is not None and size != dim:
+        # Refuse to mix vector spaces; re-index into a new QDRANT_COLLECTION instead
+        raise EmbeddingDimensionMismatch(f"collection {name!r} has vectors of size {size}, but {source} produces {dim}")
+
+
+def ensure_collection(client, name: str, dim: int, tenancy: Optional[str] = None, source: str = "the embedder") -> bool:
+    """Create ``name`` if missing, check its vector size if not, and (re)apply its
+    payload indexes. Returns True when this call created it.
+    """
+    from qdrant_client.http.models import PayloadSchemaType
+
+    tenancy = tenancy or settings.QDRANT_TENANCY
+    created = False
+    if not client.collection_exists(name):
+        try:
+            client.create_collection(**_create_args(name, dim, tenancy))
+            created = True
+        except Exception:
+            # Another writer created it first
+            if not client.collection_exists(name):
+                raise
+    if not created:
+        _check_size(name, client.get_collection(name), dim, source)
+    for field, schema in _index_schemas(tenancy):
+        try:
+            client.create_payload_index(name, field_name=field, field_schema=schema)
+        except Exception:
+            # Servers older than 1.11 reject is_tenant; a plain keyword index still filters
+            client.create_payload_index(name, field_name=field, field_schema=PayloadSchemaType.KEYWORD)
+    return created
+
+
+async def aensure_collection(client, name: str, dim: int, tenancy: Optional[str] = None, source: str = "the embedder") -> bool:
+    """:func:`ensure_collection` for an ``AsyncQdrantClient``."""
+    from qdrant_client.http.models import PayloadSchemaType
+
+    tenancy = tenancy or settings.QDRANT_TENANCY
+    created = False
+    if not await client.collection_exists(name):
+        try:
+            await client.create_collection(**_create_args(name, dim, tenancy))
+            created = True
+        except Exception:
+            if not await client.collection_exists(name):
+                raise
+    if not created:
+        _check_size(name, await client.get_collection(name), dim, source)
+    for field, schema in _index_schemas(tenancy):
+        try:
+            await client.create_payload_index(name, field_name=field, field_schema=schema)
+        except Exception:
+            await client.create_payload_index(name, field_name=field, field_schema=PayloadSchemaType.KEYWORD)
+    return created
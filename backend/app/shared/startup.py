@@ -0,0 +1,63 @@
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional
+
+
+class StartupReport:
+    """How long each component took to come up, and whether the service is ready.
+
+    Steps are timed with ``step``/``astep``; a failing step is recorded and
+    re-raised. ``report()`` backs the readiness endpoint and is logged once
+    the service is ready.
+    """
+
+    def __init__(self, service: str):
+        self.service = service
+        self.started = time.monotonic()
+        self.timings: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.ready = False
+        self.ready_after: Optional[float] = None
+
+    def _done(self, name: str, t0: float, error: Optional[BaseException]):
+        self.timings[name] = round((time.monotonic() - t0) * 1000, 1)
+        if error is None:
+            self.errors.pop(name, None)
+        else:
+            self.errors[name] = f"{type(error).__name__}: {error}"
+
+    @contextmanager
+    def step(self, name: str):
+        t0 = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self._done(name, t0, e)
+            raise
+        self._done(name, t0, None)
+
+    @asynccontextmanager
+    async def astep(self, name: str):
+        t0 = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self._done(name, t0, e)
+            raise
+        self._done(name, t0, None)
+
+    def mark_ready(self, logger=None):
+        self.ready = True
+        self.ready_after = round((time.monotonic() - self.started) * 1000, 1)
+        if logger is not None:
+            steps = " ".join(f"{name}_ms={ms}" for name, ms in self.timings.items())
+            logger.info(f"startup_report service={self.service} ready_ms={self.ready_after} {steps}")
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "service": self.service,
+            "ready": self.ready,
+            "ready_ms": self.ready_after,
+            "components_ms": dict(self.timings),
+            "errors": dict(self.errors),
+        }
@@ -0,0 +1,67 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from typing import Optional
+
+from .config import settings
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class SpooledUpload:
+    """An upload written to disk, with its size and SHA-256 computed on the way."""
+
+    def __init__(self, path: str, size: int, sha256: str, filename: Optional[str], content_type: Optional[str]):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.filename = filename
+        self.content_type = content_type
+
+    def open(self):
+        return open(self.path, "rb")
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+async def spool_upload(upload, dest: Optional[str] = None, max_bytes: Optional[int] = None, chunk_size: Optional[int] = None) -> SpooledUpload:
+    """Copy ``upload`` to ``dest`` (or a temp file) in fixed-size chunks.
+
+    Memory use is bounded by ``chunk_size`` whatever the upload size; the file
+    is removed and :class:`UploadTooLarge` raised once ``max_bytes`` is exceeded.
+    """
+    max_bytes = max_bytes or settings.UPLOAD_MAX_BYTES
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+    if dest is None:
+        fd, path = tempfile.mkstemp(prefix="upload-")
+        fh = os.fdopen(fd, "wb")
+    else:
+        path = str(dest)
+        fh = open(path, "wb")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with fh:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                await asyncio.to_thread(fh.write, chunk)
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    return SpooledUpload(path, size, digest.hexdigest(), getattr(upload, "filename", None), getattr(upload, "content_type", None))
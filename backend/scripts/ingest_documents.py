@@ -30,10 +30,20 @@ def ingest_locally(file_path: str, user_id: int):
         base_dir = os.path.dirname(os.path.dirname(__file__))  # backend
         chat_service_dir = os.path.join(base_dir, "microservices-python", "services", "chat_service")
         sys.path.append(chat_service_dir)
-        from chat_service.services.ingest_service import IngestService  # type: ignore
-        svc = IngestService()
-        svc.ingest_file(file_path, uploaded_by=user_id)
-        print("Local ingest finished for", file_path)
+        import asyncio
+        from chat_service.services.ingest_pipeline import IngestPipeline  # type: ignore
+
+        async def run():
+            pipeline = IngestPipeline()
+            job_id = await pipeline.store.create_job([os.path.abspath(file_path)], uploaded_by=str(user_id))
+            await pipeline.store.claim(job_id)
+            try:
+                return job_id, await pipeline.run(job_id)
+            finally:
+                await pipeline.aclose()
+
+        job_id, status = asyncio.run(run())
+        print(f"Local ingest job {job_id} finished with status {status} for", file_path)
     except Exception as e:
         print("Local ingest failed:", e)
         print("Please ensure chat_service is running and try HTTP mode.")
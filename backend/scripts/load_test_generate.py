@@ -0,0 +1,89 @@
+"""
+Concurrency load test for ai_service `/api/v1/generate`.
+
+Fires N concurrent generate requests and, while they run, polls `/ping` to
+check the event loop stays responsive. Prints per-request latency, wall time
+and an overlap ratio (sum of request latencies / wall time): ~1.0 means the
+requests ran one after another, values close to the concurrency level mean
+they overlapped.
+
+Each request is signed as its own user (``load-<i>``) with ``SECRET_KEY``,
+the key ai_service verifies bearer tokens with.
+
+Usage:
+  SECRET_KEY=... python backend/scripts/load_test_generate.py [--service-url http://localhost:8004] [--concurrency 8] [--text "..."]
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import statistics
+import time
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _token(user_id: str, secret: str) -> str:
+    head = _b64(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    body = _b64(json.dumps({"sub": user_id, "exp": int(time.time()) + 3600}).encode())
+    sig = hmac.new(secret.encode(), f"{head}.{body}".encode(), hashlib.sha256).digest()
+    return f"{head}.{body}.{_b64(sig)}"
+
+
+async def _generate(client, url: str, text: str, i: int) -> float:
+    start = time.perf_counter()
+    headers = {"Authorization": f"Bearer {_token(f'load-{i}', os.getenv('SECRET_KEY', ''))}"}
+    r = await client.post(url + "/api/v1/generate", json={"text": f"{text} ({i})"}, headers=headers)
+    r.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def _poll_ping(client, url: str, stop: asyncio.Event) -> list:
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            await client.get(url + "/ping")
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            latencies.append(float("inf"))
+        await asyncio.sleep(0.2)
+    return latencies
+
+
+async def run(service_url: str, concurrency: int, text: str):
+    import httpx
+    url = service_url.rstrip("/")
+    limits = httpx.Limits(max_connections=concurrency + 1)
+    async with httpx.AsyncClient(timeout=300.0, limits=limits) as client:
+        stop = asyncio.Event()
+        pinger = asyncio.create_task(_poll_ping(client, url, stop))
+        start = time.perf_counter()
+        durations = await asyncio.gather(*[_generate(client, url, text, i) for i in range(concurrency)])
+        wall = time.perf_counter() - start
+        stop.set()
+        pings = await pinger
+
+    print(f"requests: {concurrency}  wall: {wall:.2f}s")
+    print(f"latency  min: {min(durations):.2f}s  median: {statistics.median(durations):.2f}s  max: {max(durations):.2f}s")
+    print(f"overlap ratio: {sum(durations) / wall:.2f} (1.0 = serialized, {concurrency} = fully concurrent)")
+    if pings:
+        print(f"/ping during load  samples: {len(pings)}  max: {max(pings) * 1000:.0f}ms  median: {statistics.median(pings) * 1000:.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--service-url", type=str, default="http://localhost:8004")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--text", type=str, default="What is a normal resting heart rate?")
+    args = parser.parse_args()
+    asyncio.run(run(args.service_url, args.concurrency, args.text))
+
+
+if __name__ == "__main__":
+    main()
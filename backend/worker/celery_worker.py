@@ -1,48 +1,265 @@
 """
-Celery worker aligned with microservices architecture.
+Celery ingestion engine.
 
-This worker offloads long-running ingestion by streaming files to the
-chat_service HTTP endpoint instead of importing service code directly.
-This keeps the worker lightweight and avoids heavy DB/vector dependencies.
+Runs extraction, chunking, batched embedding and Qdrant upserts for the
+ingestion jobs chat_service creates when ``INGEST_EXECUTOR=celery``, so
+heavy ingest runs here instead of on the API pods. Progress goes to the
+same Mongo job/file records chat_service reports on
+(``GET /api/v1/ingest/jobs/{job_id}``).
+
+Interactive uploads and bulk backfills use separate queues; the worker
+drains ``ingest.interactive`` before ``ingest.bulk``. Files with many
+batches fan out into a chord of tasks over ranges of batches; each re-reads
+its own slice of the file, so no chunk text goes through the broker, and
+the callback prunes removed chunks and commits the file's manifest.
 """
 
+import asyncio
 import os
-from celery import Celery
-import requests
-from shared.logger import setup_observability, get_logger
+import time
+
+from celery import Celery, chord
+from celery.signals import worker_init
+from kombu import Queue
 from opentelemetry import trace
 
+from shared.chunker import token_counter
+from shared.chunks import ChunkManifest
+from shared.ingest import IndexWriter, IngestJobStore, build_points, check_text, complete_file, plan_file
+from shared.logger import setup_observability, get_logger
+
 
 BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/1")
-CHAT_SERVICE_URL = os.getenv("CHAT_SERVICE_URL", "http://genai_chat_service:8003")
+INTERACTIVE_QUEUE = os.getenv("INGEST_INTERACTIVE_QUEUE", "ingest.interactive")
+BULK_QUEUE = os.getenv("INGEST_BULK_QUEUE", "ingest.bulk")
+# Files with more embed batches than this are split into a chord
+CHORD_MIN_BATCHES = int(os.getenv("INGEST_CHORD_MIN_BATCHES", "4"))
+# Chord members per file; each re-chunks the file, so more tasks means more reading
+CHORD_TASKS = max(1, int(os.getenv("INGEST_CHORD_TASKS", "8")))
+BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "3"))
+RETRY_BACKOFF_MAX = int(os.getenv("INGEST_RETRY_BACKOFF_MAX", "300"))
+# local: embed here with ai_service's embedder code and EMBEDDING_MODEL; remote: ai_service /api/v1/embed/batch
+EMBEDDER = os.getenv("INGEST_EMBEDDER", "local")
+FILE_RATE_LIMIT = os.getenv("INGEST_FILE_RATE_LIMIT", "120/m") or None
+BATCH_RATE_LIMIT = os.getenv("INGEST_BATCH_RATE_LIMIT", "600/m") or None
 
 setup_observability("worker")
 logger = get_logger(__name__)
+tracer = trace.get_tracer("worker")
 celery_app = Celery("worker", broker=BROKER_URL, backend=RESULT_BACKEND)
+celery_app.conf.update(
+    task_queues=(Queue(INTERACTIVE_QUEUE), Queue(BULK_QUEUE)),
+    task_default_queue=BULK_QUEUE,
+    # Poll queues in the order above, so interactive work always goes first
+    broker_transport_options={"queue_order_strategy": "priority"},
+    # Redeliver tasks from a worker that died mid-way; batches are idempotent
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    worker_prefetch_multiplier=1,
+)
 
+_embedder = None
+_loop = None
 
-@celery_app.task(bind=True)
-def long_ingest_task(self, filepath: str, uploaded_by: int):
-    """
-    Stream a local file to chat_service for ingestion.
 
-    Expects the file to be present inside the worker container (e.g.,
-    via a shared volume mounted at /data). Returns the chat_service JSON.
+@worker_init.connect
+def _check_tokenizer(**_):
+    # Refuse to start rather than chunk by estimate (see shared.chunker.token_counter)
+    token_counter()
+
+
+def _embed_local(texts):
+    # Loaded on first use in each pool process, not before the fork
+    global _embedder
+    if _embedder is None:
+        from ai_service.embedders import DEFAULT_EMBEDDING_BACKEND, DEFAULT_EMBEDDING_MODEL, make_embedder
+
+        # Same defaults as ai_service: these vectors land in the collections it searches
+        _embedder = make_embedder(
+            os.getenv("EMBEDDING_BACKEND", DEFAULT_EMBEDDING_BACKEND),
+            os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL),
+        )
+        logger.info(f"worker_embedder_loaded backend={_embedder.backend} model={_embedder.model_name} dim={_embedder.dim}")
+    return _embedder.embed_documents(texts)
+
+
+_store = IngestJobStore()
+_manifest = ChunkManifest()
+_writer = IndexWriter(embed_fn=_embed_local if EMBEDDER == "local" else None)
+
+
+def _run(coro):
+    # One loop per worker process: the Motor and httpx clients are bound to it
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(coro)
+
+
+def _queue(priority: str) -> str:
+    return INTERACTIVE_QUEUE if priority == "interactive" else BULK_QUEUE
+
+
+async def _embed_and_upsert(job_id: str, file_id: str, owner, path: str, batch: int, hashes, texts, sections=None):
+    t0 = time.perf_counter()
+    vectors = await _writer.embed(texts)
+    t1 = time.perf_counter()
+    await _writer.upsert(build_points(owner, path, hashes, texts, vectors, sections))
+    timings = {"embed": t1 - t0, "upsert": time.perf_counter() - t1}
+    await _store.batch_done(job_id, file_id, batch, len(hashes), timings)
+
+
+async def _alive(job_id: str, work):
+    # A long file or chord member keeps the job's lease, so nothing re-claims it mid-run
+    async with _store.keep_alive(job_id):
+        return await work
+
+
+async def _fail_file(job_id: str, file_id: str, error: str, stage: str):
+    await _store.finish_file(job_id, file_id, error=error, stage=stage)
+    await _store.finish_job_if_complete(job_id)
+
+
+@celery_app.task(name="ingest.job")
+def ingest_job(job_id: str, priority: str = "bulk"):
+    """Claim a job and queue one task per file still pending.
+
+    Files are marked running as they are queued, so a re-claimed job never
+    queues a file twice; Celery redelivers the tasks of a worker that died.
     """
-    tracer = trace.get_tracer("worker")
-    url = CHAT_SERVICE_URL.rstrip("/") + "/api/v1/ingest/upload"
-    with tracer.start_as_current_span("worker.long_ingest_task"):
+    with tracer.start_as_current_span("worker.ingest_job"):
+        async def pending():
+            if not await _store.claim(job_id):
+                return []
+            file_ids = await _store.enqueue_pending(job_id)
+            if not file_ids:
+                await _store.finish_job_if_complete(job_id)
+            return file_ids
+
+        file_ids = _run(pending())
+        for file_id in file_ids:
+            ingest_file.apply_async((job_id, file_id, priority), queue=_queue(priority))
+        logger.info(f"ingest_job_queued job={job_id} files={len(file_ids)} priority={priority}")
+        return {"job_id": job_id, "files": len(file_ids)}
+
+
+def _retry_or_fail(task, exc: Exception, job_id: str, file_id: str, stage: str):
+    if task.request.retries < task.max_retries:
+        raise task.retry(exc=exc, countdown=min(RETRY_BACKOFF_MAX, 2 ** task.request.retries))
+    _run(_fail_file(job_id, file_id, str(exc), stage))
+
+
+@celery_app.task(name="ingest.file", bind=True, rate_limit=FILE_RATE_LIMIT, max_retries=MAX_RETRIES)
+def ingest_file(self, job_id: str, file_id: str, priority: str = "bulk"):
+    """Extract and split one file, then embed/upsert its changed chunks inline or as a chord."""
+    with tracer.start_as_current_span("worker.ingest_file"):
+        async def prepare():
+            job = await _store.get_job(job_id)
+            f = await _store.get_file(file_id)
+            if not job or not f or f["status"] not in ("pending", "running"):
+                return None, None, None
+            t0 = time.perf_counter()
+            try:
+                await asyncio.to_thread(check_text, f["path"])
+            except Exception as e:
+                await _fail_file(job_id, file_id, str(e), "extract")
+                return None, None, None
+            extract_s = time.perf_counter() - t0
+            plan = await plan_file(_manifest, job.get("uploaded_by"), f["path"], BATCH_SIZE, f.get("done_batches"))
+            await _store.start_file(job_id, file_id, len(plan.hashes), plan.batches_total, {"extract": extract_s, **plan.timings}, plan.stats)
+            return job.get("uploaded_by"), f["path"], plan
+
         try:
-            logger.info(f"ingest_start filepath={filepath} user={uploaded_by}")
-            with open(filepath, "rb") as fh:
-                files = {"file": (os.path.basename(filepath), fh)}
-                data = {"user_id": str(uploaded_by)}
-                resp = requests.post(url, files=files, data=data, timeout=120)
-                resp.raise_for_status()
-                result = {"status": "accepted", "response": resp.json(), "filepath": filepath}
-                logger.info("ingest_ok")
-                return result
+            owner, path, plan = _run(_alive(job_id, prepare()))
         except Exception as e:
-            logger.error(f"ingest_error error={e}")
-            return {"status": "error", "error": str(e), "filepath": filepath}
+            _retry_or_fail(self, e, job_id, file_id, "split")
+            return {"file_id": file_id, "status": "failed"}
+        if plan is None:
+            return {"file_id": file_id, "status": "skipped"}
+
+        if plan.pending > CHORD_MIN_BATCHES:
+            queue = _queue(priority)
+            total = plan.batches_total
+            span = -(-total // CHORD_TASKS)
+            # Members carry a batch range, not texts: the header stays tiny however large the file
+            header = [
+                ingest_batch.s(job_id, file_id, owner, path, total, first, min(first + span, total)).set(queue=queue)
+                for first in range(0, total, span)
+                if any(n not in plan.done_batches for n in range(first, min(first + span, total)))
+            ]
+            body = finalize_file.s(job_id, file_id, owner, path).set(queue=queue)
+            # A batch that exhausts its retries fails the chord, and with it the file
+            body.on_error(fail_file.si(job_id, file_id, "embed/upsert batch failed", "upsert").set(queue=queue))
+            chord(header)(body)
+            return {"file_id": file_id, "status": "fanned_out", "tasks": len(header), "batches": plan.pending}
+
+        async def inline():
+            async for n, hashes, texts, sections in plan.abatches():
+                await _embed_and_upsert(job_id, file_id, owner, path, n, hashes, texts, sections)
+            await complete_file(_store, _manifest, _writer.delete, job_id, file_id, owner, path, plan.hashes, plan.removed)
+            await _store.finish_job_if_complete(job_id)
+
+        try:
+            _run(_alive(job_id, inline()))
+        except Exception as e:
+            # A retry re-plans the file and skips the batches already recorded
+            _retry_or_fail(self, e, job_id, file_id, "upsert")
+            return {"file_id": file_id, "status": "failed"}
+        return {"file_id": file_id, "status": "done", "batches": plan.pending}
+
+
+@celery_app.task(
+    name="ingest.batch",
+    rate_limit=BATCH_RATE_LIMIT,
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    retry_backoff_max=RETRY_BACKOFF_MAX,
+    retry_jitter=True,
+    max_retries=MAX_RETRIES,
+)
+def ingest_batch(job_id: str, file_id: str, owner, path: str, batches_total: int, first: int, last: int):
+    """Embed and upsert batches ``first <= n < last`` of the file, streamed from disk."""
+    with tracer.start_as_current_span("worker.ingest_batch"):
+        async def run():
+            f = await _store.get_file(file_id)
+            # Same manifest diff as ingest.file: the manifest only moves once the file completes
+            plan = await plan_file(_manifest, owner, path, BATCH_SIZE, (f or {}).get("done_batches"))
+            if plan.batches_total != batches_total:
+                raise ValueError(f"file changed while it was being indexed: {path}")
+            async for n, hashes, texts, sections in plan.abatches(first, last):
+                await _embed_and_upsert(job_id, file_id, owner, path, n, hashes, texts, sections)
+
+        _run(_alive(job_id, run()))
+        return [first, last]
+
+
+@celery_app.task(name="ingest.finalize_file")
+def finalize_file(batches, job_id: str, file_id: str, owner, path: str):
+    """Chord callback: every batch landed, so prune removed chunks and commit the manifest."""
+    async def finish():
+        plan = await plan_file(_manifest, owner, path, BATCH_SIZE)
+        await complete_file(_store, _manifest, _writer.delete, job_id, file_id, owner, path, plan.hashes, plan.removed)
+        await _store.finish_job_if_complete(job_id)
+
+    _run(_alive(job_id, finish()))
+    return {"file_id": file_id, "status": "done", "tasks": len(batches)}
+
+
+@celery_app.task(name="ingest.fail_file")
+def fail_file(job_id: str, file_id: str, error: str, stage: str):
+    logger.error(f"ingest_file_failed job={job_id} file={file_id} stage={stage} error={error}")
+    _run(_fail_file(job_id, file_id, error, stage))
+
+
+@celery_app.task(bind=True)
+def long_ingest_task(self, filepath: str, uploaded_by: str, priority: str = "bulk"):
+    """
+    Ingest a file already present inside the worker container (e.g. via a
+    shared volume mounted at /data) as a one-file job.
+    """
+    job_id = _run(_store.create_job([filepath], str(uploaded_by)))
+    ingest_job.apply_async((job_id, priority), queue=_queue(priority))
+    logger.info(f"ingest_start filepath={filepath} user={uploaded_by} job={job_id}")
+    return {"status": "accepted", "job_id": job_id, "filepath": filepath}